@@ -1,10 +1,27 @@
 import simpy
-import random
 import pandas as pd
 import simpy.resources
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.figure
 import csv
+import concurrent.futures
+import dataclasses
+import functools
+import argparse
+import bisect
+import collections
+import hashlib
+import heapq
+import inspect
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import statistics
+import time
 
 # Global class (g) stores the key variables for the model, these are used 
 # throughout the model and can be changed by the user to test different
@@ -22,6 +39,17 @@ class g:
     warm_up_period = sim_duration / 5
     patient_inter_day = 189
     patient_inter_night = 247
+
+    # Setting this to True starts each arrival window (in hours and out of 
+    # hours) with an arrival within a minute of it opening, on top of the 
+    # arrivals drawn at the window's rate. The original model's in hours and 
+    # out of hours generators did this, and the model was calibrated with it,
+    # it adds about one patient a day in hours and 0.6 out of hours. Setting
+    # it to False only gives the arrivals drawn at each window's rate (see 
+    # arrival_rate_table), about 22% fewer patients overall and 56% fewer out
+    # of hours.
+
+    window_opening_arrivals = True
     number_of_nurses = 2
     mean_n_consult_time = 60
     mean_n_ct_time = 20
@@ -50,6 +78,22 @@ class g:
 
     mean_n_non_stroke_ward_time = 1440 * 4
     mean_n_tia_ward_time = 1440 * 1.4
+
+    # Some of the LOS distributions are adjusted from the means above. Each row
+    # is (diagnosis, MRS, rate factor, cap in days), the sampled LOS is divided
+    # by the rate factor and limited to the cap (None for no cap). Diagnosis 
+    # 0 = ICH, 1 = I, 2 = TIA, 3 = Stroke Mimic and 4 = Non Stroke, with an 
+    # MRS of 7 for the non stroke diagnosis.
+
+    ward_los_adjustments = ((0, 3, 1.0, 81),
+                            (0, 4, 1.0, 120),
+                            (0, 5, 1.0, 130),
+                            (1, 3, 3.0, 70),
+                            (1, 4, 1.0, 140),
+                            (1, 5, 2.0, None),
+                            (2, 7, 3.0, None),
+                            (3, 7, 3.0, None),
+                            (4, 7, 3.0, None))
     
     # This model works on the assumption, supported by third party research that
     # thrombolysis reduces the length of stay in hospital, this value is
@@ -73,10 +117,11 @@ class g:
     inpatient_bed_cost_thrombolysis = 528.17
 
     # To detemine the patients diagnosis the model assigns each patient a value
-    # between 0 and 100. This is done within the "Patient" class. This value is
-    # then compared to the values below to determine the patients diagnosis. 
-    # For example, <=10 is ICH, >10 and <=60 is I. By default this values are 
-    # alligned to real world data collect from MGH between 2023 and 2026.
+    # between 0 and 100. This is done within the "PatientSampler" class. This 
+    # value is then compared to the values below to determine the patients 
+    # diagnosis (see PatientLookupTables). For example, <=10 is ICH, >10 and 
+    # <=60 is I. By default this values are alligned to real world data 
+    # collect from MGH between 2023 and 2026.
     
     ich = 10
     i = 60
@@ -121,52 +166,1552 @@ class g:
     ctp_unav_time = 0 
     ctp_unav_freq = 0 
 
-    # These values are set by the model / user to control the models operation.
+    # The percentage of the day the SDEC and CTP are open, as entered by the 
+    # user. These are used to set the values above (see set_sdec_open_percent
+    # and set_ctp_open_percent), they are None until they have been set.
+
+    sdec_open_percent = None
+    ctp_open_percent = None
+
+    # These values are set by the user to control the models operation.
     # They should not be adjusted here, but rather as an input.
 
-    sdec_unav = False
-    ctp_unav = False
     write_to_csv = False
     gen_graph = False
     therapy_sdec = False
     trials_run_counter = 1
-    patient_arrival_gen_1 = False
-    patient_arrival_gen_2 = False
-
-# Patient class to store patient attributes that are used throughout the model.
-
-class Patient:
-    def __init__(self, p_id):
-        self.id = p_id
-        self.q_time_nurse = 0
-        self.q_time_ward = 0
 
-        #0 = known onset, 1 = unknown onset (in ctp range), 2 = unknown (out of
-        # ctp range)
-
-        self.onset_type = random.randint(0, 2)
-
-        # MRS values goes 0 to 6 with 7 being used for Non Stroke patients.
+    # The folder the CSV files are written to, by default the folder the model
+    # is run from.
+
+    output_folder = ""
+
+    # These values control how the runs in a trial are carried out. The runs 
+    # are shared between the number of worker processes set here (1 means the
+    # runs are carried out one after another). Setting a master seed means 
+    # a trial gives the same results every time, whatever the number of 
+    # workers.
+
+    number_of_workers = 1
+    master_seed = None
+
+    # Common random numbers. Each run draws its arrivals, patient values, 
+    # service times and LOS from separate streams made from its seed, so run k
+    # of every trial sees the same patients if the trials share a master seed.
+    # Setting this to True gives every trial the same master seed when one 
+    # isn't set, and the difference between each trial and the first is 
+    # reported with a confidence interval (see paired_differences).
+
+    common_random_numbers = False
+
+    # Setting a target half width runs each trial until the 95% confidence 
+    # interval of the results below is narrow enough, rather than for a fixed
+    # number of runs. The target is a fraction of the mean (eg 0.05 for a half
+    # width of 5% of the mean). The number of runs above is run first, then 
+    # runs are added in batches (one per worker) until the target is met or
+    # the maximum number of runs is reached.
+
+    target_half_width = None
+    precision_results = ("Mean Q Time Ward (Hour)", "Total Savings")
+    max_number_of_runs = 100
+
+    # Patients held in the SDEC while the ward is full are released as soon as
+    # a ward bed is free. Setting this to True goes back to checking the ward 
+    # every minute, this is only kept to compare against.
+
+    ward_bed_polling = False
+
+    # Setting this to True writes the per patient results of each run to a 
+    # results log in the output folder as patients complete their journey, 
+    # rather than keeping them in memory until the end of the run. The log 
+    # ("trial {n} output {run}.results") is written instead of the per run 
+    # CSV file and can be read with read_results_log.
+
+    spill_results = False
+
+    # Setting this to True replaces the warm up period above with one found 
+    # from a pilot run of each trial (see estimate_warm_up). The pilot run is
+    # as long as a run with the warm up period above, every other run of the
+    # trial is then only as long as the results period plus the warm up found.
+
+    auto_warm_up = False
+
+    # Setting a cache folder stores the key results of each run there, under
+    # a hash of the config, the run's seed and the model code. Runs that have
+    # already been carried out with the same settings are then read from the 
+    # cache rather than run again. Only trials with a master seed are cached.
+    # The per patient results are also stored if cache_patient_results is 
+    # True, they are needed to reuse a run that writes its CSV file. The least
+    # recently used runs are removed once the cache is larger than 
+    # result_cache_size (in bytes).
+
+    result_cache_folder = None
+    result_cache_size = 1024 ** 3
+    cache_patient_results = False
+
+    # Setting this to True profiles each run, the wall time and number of 
+    # events scheduled are added up for each stage of the model (the arrival
+    # and obstruct generators and the stages of the patient pathway) and 
+    # written to "trial {n} profile {run}.csv" in the output folder. This 
+    # slows the run down, when it is False the model runs as normal.
+
+    profile_stages = False
+
+    # Setting this to True lets scenarios that only differ in settings that
+    # can be changed part way through a run (see warm_start_settings) share
+    # their warm up. Each run's warm up is simulated once and the warmed up 
+    # model is copied (forked) for each scenario, which then runs the results
+    # period with its own settings. The scenarios are given the same master 
+    # seed if they don't have one. This only applies to scenario files.
+
+    share_warm_up = False
+
+    # Graphs are shown on screen by default. Setting graph_files to True draws
+    # them off screen and saves them as PNG files in the output folder 
+    # instead, runs carried out in worker processes then draw their own 
+    # graphs. The occupancy series are cut down to at most graph_point_budget
+    # points, keeping their shape (see lttb_indices), before they are drawn.
+    # A graph of all the runs of each trial is also drawn.
+
+    graph_files = False
+    graph_point_budget = 2000
+
+    # Setting this to True carries out each run with the fast engine (see 
+    # FastModel), which finds the arrivals, nurse queue and CT / CTP times of
+    # a whole run at once with NumPy and only steps through the SDEC and ward
+    # one event at a time. It sees the same patients as the normal model, and
+    # can be checked against it with validate_fast_engine. It can't be used
+    # with ward_bed_polling or profile_stages.
+
+    fast_engine = False
+
+    # Setting arrival_trace to the folder of a converted arrival log (see 
+    # ArrivalTrace) replays the real arrival times, onset type, diagnosis and
+    # MRS of the log rather than drawing them, the other values of each 
+    # patient are still drawn. The log is replayed day by day from its first
+    # day, starting again once it runs out. Setting bootstrap_trace to True 
+    # draws the day of the log replayed on each day of the run at random 
+    # (with replacement), so each run sees a different set of days.
+
+    arrival_trace = None
+    bootstrap_trace = False
+
+# A frozen copy of the settings in the g class. One of these is passed to each
+# Model and Trial, as it can't be changed once it has been created any number
+# of models can share it and be run side by side in the same process. The 
+# defaults are taken from the g class, which still holds the default settings 
+# of the model and can still be changed to run the model interactively.
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ScenarioConfig:
+    sim_duration: float = g.sim_duration
+    number_of_runs: int = g.number_of_runs
+    warm_up_period: float = g.warm_up_period
+    patient_inter_day: float = g.patient_inter_day
+    patient_inter_night: float = g.patient_inter_night
+    window_opening_arrivals: bool = g.window_opening_arrivals
+    number_of_nurses: int = g.number_of_nurses
+    mean_n_consult_time: float = g.mean_n_consult_time
+    mean_n_ct_time: float = g.mean_n_ct_time
+    number_of_ctp: int = g.number_of_ctp
+    sdec_beds: int = g.sdec_beds
+    mean_n_sdec_time: float = g.mean_n_sdec_time
+    number_of_ward_beds: int = g.number_of_ward_beds
+
+    mean_n_i_ward_time_mrs_0: float = g.mean_n_i_ward_time_mrs_0
+    mean_n_i_ward_time_mrs_1: float = g.mean_n_i_ward_time_mrs_1
+    mean_n_i_ward_time_mrs_2: float = g.mean_n_i_ward_time_mrs_2
+    mean_n_i_ward_time_mrs_3: float = g.mean_n_i_ward_time_mrs_3
+    mean_n_i_ward_time_mrs_4: float = g.mean_n_i_ward_time_mrs_4
+    mean_n_i_ward_time_mrs_5: float = g.mean_n_i_ward_time_mrs_5
+    mean_n_i_ward_time_mrs_6: float = g.mean_n_i_ward_time_mrs_6
+
+    mean_n_ich_ward_time_mrs_0: float = g.mean_n_ich_ward_time_mrs_0
+    mean_n_ich_ward_time_mrs_1: float = g.mean_n_ich_ward_time_mrs_1
+    mean_n_ich_ward_time_mrs_2: float = g.mean_n_ich_ward_time_mrs_2
+    mean_n_ich_ward_time_mrs_3: float = g.mean_n_ich_ward_time_mrs_3
+    mean_n_ich_ward_time_mrs_4: float = g.mean_n_ich_ward_time_mrs_4
+    mean_n_ich_ward_time_mrs_5: float = g.mean_n_ich_ward_time_mrs_5
+    mean_n_ich_ward_time_mrs_6: float = g.mean_n_ich_ward_time_mrs_6
+
+    mean_n_non_stroke_ward_time: float = g.mean_n_non_stroke_ward_time
+    mean_n_tia_ward_time: float = g.mean_n_tia_ward_time
+    ward_los_adjustments: tuple = g.ward_los_adjustments
+
+    thrombolysis_los_save: float = g.thrombolysis_los_save
+    sdec_dr_cost_min: float = g.sdec_dr_cost_min
+    inpatient_bed_cost: float = g.inpatient_bed_cost
+    inpatient_bed_cost_thrombolysis: float = g.inpatient_bed_cost_thrombolysis
+
+    ich: float = g.ich
+    i: float = g.i
+    tia: float = g.tia
+    stroke_mimic: float = g.stroke_mimic
+
+    mrs_i_0: float = g.mrs_i_0
+    mrs_i_1: float = g.mrs_i_1
+    mrs_i_2: float = g.mrs_i_2
+    mrs_i_3: float = g.mrs_i_3
+    mrs_i_4: float = g.mrs_i_4
+    mrs_i_5: float = g.mrs_i_5
+
+    mrs_ich_0: float = g.mrs_ich_0
+    mrs_ich_1: float = g.mrs_ich_1
+    mrs_ich_2: float = g.mrs_ich_2
+    mrs_ich_3: float = g.mrs_ich_3
+    mrs_ich_4: float = g.mrs_ich_4
+    mrs_ich_5: float = g.mrs_ich_5
+
+    tia_admission: float = g.tia_admission
+    stroke_mimic_admission: float = g.stroke_mimic_admission
+
+    sdec_unav_time: float = g.sdec_unav_time
+    sdec_unav_freq: float = g.sdec_unav_freq
+    ctp_unav_time: float = g.ctp_unav_time
+    ctp_unav_freq: float = g.ctp_unav_freq
+    sdec_open_percent: float = g.sdec_open_percent
+    ctp_open_percent: float = g.ctp_open_percent
+
+    write_to_csv: bool = g.write_to_csv
+    gen_graph: bool = g.gen_graph
+    therapy_sdec: bool = g.therapy_sdec
+    trials_run_counter: int = g.trials_run_counter
+    output_folder: str = g.output_folder
+
+    number_of_workers: int = g.number_of_workers
+    master_seed: int = g.master_seed
+    common_random_numbers: bool = g.common_random_numbers
+    target_half_width: float = g.target_half_width
+    precision_results: tuple = g.precision_results
+    max_number_of_runs: int = g.max_number_of_runs
+    ward_bed_polling: bool = g.ward_bed_polling
+    spill_results: bool = g.spill_results
+    auto_warm_up: bool = g.auto_warm_up
+    result_cache_folder: str = g.result_cache_folder
+    result_cache_size: int = g.result_cache_size
+    cache_patient_results: bool = g.cache_patient_results
+    profile_stages: bool = g.profile_stages
+    share_warm_up: bool = g.share_warm_up
+    graph_files: bool = g.graph_files
+    graph_point_budget: int = g.graph_point_budget
+    fast_engine: bool = g.fast_engine
+    arrival_trace: str = g.arrival_trace
+    bootstrap_trace: bool = g.bootstrap_trace
+
+    # Creates a config from the current values in the g class.
+
+    @classmethod
+    def from_g(cls):
+        return cls(**{field.name: getattr(g, field.name) 
+                      for field in dataclasses.fields(cls)})
+
+    # Returns the names of all of the settings in a config.
+
+    @classmethod
+    def setting_names(cls):
+        return [field.name for field in dataclasses.fields(cls)]
+
+    # Returns a copy of the config with some of its settings changed. The 
+    # percentage of the day the SDEC and CTP are open is converted to the 
+    # values used by their generators. The LOS adjustments and precision 
+    # results are stored as tuples so the config can still be hashed when 
+    # they are read from a scenario file as lists.
+
+    def with_settings(self, **settings):
+        if settings.get("ward_los_adjustments") is not None:
+            settings["ward_los_adjustments"] = tuple(
+                tuple(row) for row in settings["ward_los_adjustments"])
+        if settings.get("precision_results") is not None:
+            settings["precision_results"] = tuple(
+                settings["precision_results"])
+        if settings.get("sdec_open_percent") is not None:
+            settings["sdec_unav_freq"], settings["sdec_unav_time"] = \
+                open_percent_to_unav(settings["sdec_open_percent"])
+        if settings.get("ctp_open_percent") is not None:
+            settings["ctp_unav_freq"], settings["ctp_unav_time"] = \
+                open_percent_to_unav(settings["ctp_open_percent"])
+        return dataclasses.replace(self, **settings)
+
+# This function converts the percentage of the day the SDEC or CTP is open into
+# the values used by their generators. The generator uses the open time as the
+# frequency and the rest of the day as the time they are closed for.
+
+def open_percent_to_unav(percent):
+    unav_freq = 1440 * (percent / 100)
+    return unav_freq, 1440 - unav_freq
+
+# Patient table to store the patient attributes that are used throughout the 
+# model. Rather than an object for every patient, each attribute is a NumPy 
+# array with one row per patient, indexed by the patient's ID. The model's 
+# generators only pass the patient ID around, which keeps the memory used per
+# patient small for long runs. As with the results recorder the arrays grow in
+# chunks. The random values for the patient are drawn in advance by the 
+# model's sampler (see PatientSampler) and added when the patient arrives.
+
+class PatientTable:
+
+    # The attributes of a patient and the type of data they hold, in the order
+    # the sampler draws them followed by the attributes set during the run.
+    #
+    # onset_type: 0 = known onset, 1 = unknown onset (in ctp range), 
+    # 2 = unknown (out of ctp range)
+    # mrs_type: MRS values goes 0 to 6 with 7 being used for Non Stroke 
+    # patients.
+    # diagnosis: the value between 0 and 100 used to find the patient 
+    # diagnosis (see PatientLookupTables).
+    # sampled_ward_time: the ward LOS for the patient's diagnosis and MRS.
+
+    columns = [("onset_type", np.int8),
+               ("mrs_type", np.int8),
+               ("diagnosis", np.int8),
+               ("patient_diagnosis", np.int8),
+               ("non_admission", np.int8),
+               ("nurse_time_draw", np.float64),
+               ("ct_time_draw", np.float64),
+               ("sdec_time_draw", np.float64),
+               ("sampled_ward_time", np.float64),
+               ("admission_chance_noise", (np.float64, 4)),
+               ("q_time_nurse", np.float64),
+               ("q_time_ward", np.float64),
+               ("clock_start", np.float64),
+               ("priority", np.int8),
+               ("advanced_ct_pathway", np.bool_),
+               ("sdec_pathway", np.bool_),
+               ("thrombolysis", np.bool_),
+               ("thrombectomy", np.bool_),
+               ("admission_avoidance", np.bool_),
+               ("sdec_yield_count", np.float64),
+               ("sdec_admission_time_out", np.bool_)]
+
+    initial_rows = 1024
+
+    # The number of columns drawn by the sampler, the columns after them are
+    # set during the run.
+
+    sampled_columns = 10
+
+    # Normally each patient's row is their ID. If rows are recycled a patient
+    # is given the row of a patient that has completed their journey (see 
+    # free) if there is one, otherwise the next unused row.
+
+    def __init__(self, recycle_rows=False):
+        self.capacity = self.initial_rows
+        for column, dtype in self.columns:
+            setattr(self, column, self.empty_column(dtype, self.capacity))
+        self.recycle_rows = recycle_rows
+        self.free_rows = []
+        self.rows_used = 1
+
+    def empty_column(self, dtype, rows):
+        if isinstance(dtype, tuple):
+            return np.zeros((rows, dtype[1]), dtype=dtype[0])
+        return np.zeros(rows, dtype=dtype)
+
+    # Doubles the number of rows available in every column.
+
+    def grow(self):
+        new_capacity = self.capacity * 2
+        for column, dtype in self.columns:
+            new_column = self.empty_column(dtype, new_capacity)
+            new_column[:self.capacity] = getattr(self, column)
+            setattr(self, column, new_column)
+        self.capacity = new_capacity
+
+    # Adds a patient with the values drawn for them by the sampler, and 
+    # returns their row. All other attributes start at 0 / False, apart from
+    # the priority which starts at 1.
+
+    def add(self, p_id, samples):
+        if self.recycle_rows == False:
+            row = p_id
+        elif len(self.free_rows) > 0:
+            row = self.free_rows.pop()
+            for column, _ in self.columns[self.sampled_columns:]:
+                getattr(self, column)[row] = 0
+        else:
+            row = self.rows_used
+            self.rows_used += 1
+
+        while row >= self.capacity:
+            self.grow()
+        for (column, _), value in zip(self.columns, samples):
+            getattr(self, column)[row] = value
+        self.priority[row] = 1
+        return row
+
+    # Frees the row of a patient that has completed their journey, if rows 
+    # are recycled.
+
+    def free(self, row):
+        if self.recycle_rows == True:
+            self.free_rows.append(row)
+
+# Monitor class that stores a value over time, such as the ward occupancy, for
+# graphs and results. Adding rows to a pandas DataFrame one at a time gets 
+# slower as the DataFrame grows, so the times and values are held in NumPy 
+# arrays that grow in chunks, and the DataFrame is only built when it is 
+# asked for. The time weighted mean and the maximum of the value are kept up 
+# to date as values are recorded, the value is taken to stay the same between
+# one recorded time and the next.
+#
+# Values can be recorded at any time, but only values after the warm up period
+# are stored and used for the mean and maximum. The value at the end of the 
+# warm up period is carried into the mean, so it isn't taken as 0.
+#
+# If max_rows is given, the stored rows are cut down by half (keeping the 
+# shape of the series, see lttb_indices) whenever there are more than that,
+# so the memory used doesn't grow with the length of the run. The mean and 
+# maximum are still found from every value, but the stored rows are then only
+# good for graphs.
+
+class TimeSeriesMonitor:
+
+    initial_rows = 1024
+
+    # The first row of the monitor is the start value at time 0, as with the 
+    # graph DataFrames this replaced.
+
+    def __init__(self, value_name, warm_up_period=0.0, start_value=0.0,
+                 max_rows=None):
+        self.value_name = value_name
+        self.warm_up_period = warm_up_period
+        self.max_rows = max_rows
+        self.capacity = self.initial_rows
+        self.times = np.zeros(self.capacity)
+        self.values = np.zeros(self.capacity)
+        self.values[0] = start_value
+        self.count = 1
+        self.last_time = 0.0
+        self.last_value = start_value
+        self.area = 0.0
+        self.max_value = start_value
+
+    # Doubles the number of rows available.
+
+    def grow(self):
+        new_capacity = self.capacity * 2
+        for name in ["times", "values"]:
+            new_column = np.zeros(new_capacity)
+            new_column[:self.capacity] = getattr(self, name)
+            setattr(self, name, new_column)
+        self.capacity = new_capacity
+
+    # Cuts the stored rows down to half of max_rows.
+
+    def downsample(self):
+        kept = lttb_indices(self.times[:self.count], self.values[:self.count],
+                            self.max_rows // 2)
+        self.count = len(kept)
+        self.times[:self.count] = self.times[kept]
+        self.values[:self.count] = self.values[kept]
+
+    # If store is False the value is used for the time weighted mean and the 
+    # maximum, but isn't stored as a row of the series.
+
+    def record(self, time, value, store=True):
+        if time > self.warm_up_period:
+            if store == True:
+                if self.max_rows is not None and \
+                    self.count >= self.max_rows:
+                    self.downsample()
+                if self.count == self.capacity:
+                    self.grow()
+                self.times[self.count] = time
+                self.values[self.count] = value
+                self.count += 1
+
+            # The first value after the warm up period starts the maximum from
+            # the value carried over from the warm up period.
+
+            if self.last_time <= self.warm_up_period:
+                self.max_value = self.last_value
+            self.area += self.last_value * \
+                (time - max(self.last_time, self.warm_up_period))
+            if value > self.max_value:
+                self.max_value = value
+
+        self.last_time = time
+        self.last_value = value
+
+    # Records a series of values at once, in time order. This gives the same
+    # results as recording them one at a time, it is used by the fast engine.
+    # If store is given, only the values where it is True are stored as rows.
+
+    def record_many(self, times, values, store=None):
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if len(times) == 0:
+            return
+        if store is None:
+            store = np.ones(len(times), dtype=bool)
+
+        previous_times = np.concatenate(([self.last_time], times[:-1]))
+        previous_values = np.concatenate(([self.last_value], values[:-1]))
+        stored = times > self.warm_up_period
+        if stored.any():
+            first = np.argmax(stored)
+            if previous_times[first] <= self.warm_up_period:
+                self.max_value = previous_values[first]
+            self.max_value = max(self.max_value, values[stored].max())
+            self.area += (previous_values[stored] * 
+                          (times[stored] - np.maximum(previous_times[stored],
+                                                      self.warm_up_period))
+                          ).sum()
+
+            stored = stored & store
+            while self.capacity < self.count + stored.sum():
+                self.grow()
+            new_count = self.count + stored.sum()
+            self.times[self.count:new_count] = times[stored]
+            self.values[self.count:new_count] = values[stored]
+            self.count = new_count
+            if self.max_rows is not None and self.count > self.max_rows:
+                self.downsample()
+
+        self.last_time = times[-1]
+        self.last_value = values[-1]
+
+    # Returns the time weighted mean of the value from the end of the warm up 
+    # period up to the end time given.
+
+    def time_weighted_mean(self, end_time):
+        duration = end_time - self.warm_up_period
+        if duration <= 0:
+            return self.last_value
+        return (self.area + self.last_value * 
+                (end_time - max(self.last_time, self.warm_up_period))) / \
+            duration
+
+    # Returns the time weighted mean of the value over each interval of the 
+    # length given, from time 0 up to the end time. Only stored rows are used,
+    # so the intervals in the warm up period are only correct if the monitor 
+    # has no warm up period (as in the warm up pilot run).
+
+    def interval_means(self, interval, end_time):
+        times = self.times[:self.count]
+        values = self.values[:self.count]
+        areas = np.concatenate(([0.0], 
+                                np.cumsum(values[:-1] * np.diff(times))))
+
+        edges = np.arange(int(end_time // interval) + 1) * interval
+        rows = np.searchsorted(times, edges, side="right") - 1
+        edge_areas = areas[rows] + values[rows] * (edges - times[rows])
+        return np.diff(edge_areas) / interval
+
+    # Builds a DataFrame of the recorded times and values.
+
+    def to_frame(self):
+        return pd.DataFrame({"Time": self.times[:self.count].copy(),
+                             self.value_name: 
+                             self.values[:self.count].copy()})
+
+# Lookup tables used to turn the values drawn for a patient into their 
+# diagnosis, MRS and ward LOS. The tables are built once from a config, so
+# a whole block of patients can be classified with NumPy rather than running
+# through a chain of if statements for every patient. New diagnosis groups or 
+# MRS bands only need adding to the tables here rather than to the model.
+
+class PatientLookupTables:
+
+    # The MRS given to patients whose diagnosis has no MRS bands (TIA, stroke 
+    # mimic and non stroke).
+
+    no_mrs_type = 7
+
+    def __init__(self, config):
+
+        # The upper value of each diagnosis range, a patient whose value is 
+        # above every range is a non stroke (diagnosis 4).
+
+        self.diagnosis_thresholds = np.array([config.ich, config.i, config.tia,
+                                              config.stroke_mimic], dtype=float)
+
+        # The upper value of each MRS band for the diagnosis with MRS bands, a
+        # patient whose value is above every band has an MRS of 6.
+
+        self.mrs_thresholds = {
+            0: np.array([getattr(config, f"mrs_ich_{mrs}") 
+                         for mrs in range(6)], dtype=float),
+            1: np.array([getattr(config, f"mrs_i_{mrs}") 
+                         for mrs in range(6)], dtype=float)}
+
+        # The ward LOS table holds the (mean, rate factor, cap) for every
+        # diagnosis and MRS. Combinations that can't happen are left as NaN.
+
+        self.ward_los = np.full((len(self.diagnosis_thresholds) + 1,
+                                 self.no_mrs_type + 1, 3), np.nan)
+        for mrs in range(7):
+            self.ward_los[0, mrs] = (getattr(config, 
+                f"mean_n_ich_ward_time_mrs_{mrs}"), 1.0, np.inf)
+            self.ward_los[1, mrs] = (getattr(config, 
+                f"mean_n_i_ward_time_mrs_{mrs}"), 1.0, np.inf)
+        self.ward_los[2, 7] = (config.mean_n_tia_ward_time, 1.0, np.inf)
+        self.ward_los[3, 7] = (config.mean_n_non_stroke_ward_time, 1.0, np.inf)
+        self.ward_los[4, 7] = (config.mean_n_non_stroke_ward_time, 1.0, np.inf)
+
+        for diagnosis, mrs, rate_factor, cap_days in \
+            config.ward_los_adjustments:
+            self.ward_los[diagnosis, mrs, 1] = rate_factor
+            if cap_days is not None:
+                self.ward_los[diagnosis, mrs, 2] = 1440 * cap_days
+
+    # Finds the diagnosis of a block of patients. This introduces a slight 
+    # element of randomness into each patient's diagnosis, as the noise drawn
+    # for the patient is added to each range. A range can't be lower than the
+    # one before it, and the diagnosis is the number of ranges the patient's 
+    # value is above.
+
+    def diagnose(self, diagnosis_values, range_noise):
+        ranges = np.maximum.accumulate(self.diagnosis_thresholds + range_noise,
+                                       axis=1)
+        return (diagnosis_values[:, None] > ranges).sum(axis=1)
+
+    # Finds the MRS of a block of patients from their diagnosis. Unlike the 
+    # diagnosis there is no randomness in the MRS bands.
+
+    def assign_mrs(self, diagnosis, mrs_values):
+        mrs_type = np.full(len(mrs_values), self.no_mrs_type)
+        for group, thresholds in self.mrs_thresholds.items():
+            in_group = diagnosis == group
+            mrs_type[in_group] = np.searchsorted(thresholds, 
+                                                 mrs_values[in_group])
+        return mrs_type
+
+    # Turns the LOS drawn for a block of patients (from an exponential 
+    # distribution with a mean of 1) into the ward LOS for their diagnosis 
+    # and MRS.
+
+    def ward_time(self, diagnosis, mrs_type, ward_time_draws):
+        los = self.ward_los[diagnosis, mrs_type]
+        return np.minimum(ward_time_draws * los[:, 0] / los[:, 1], los[:, 2])
+
+# The lookup tables only depend on the config, so they are only built once for
+# each config (each scenario) and shared by every run of it in a process.
+
+@functools.lru_cache(maxsize=None)
+def patient_lookup_tables(config):
+    return PatientLookupTables(config)
+
+# An arrival log of real patients, replayed by the model in place of the 
+# arrivals and patients it would draw (see arrival_trace in the g class). The
+# log is converted once from a CSV file into a folder with a NumPy file for 
+# each column, which every run opens memory mapped and read only. Only the 
+# rows of the days a run replays are read from the files, and the operating 
+# system shares the pages that have been read between every process, so 
+# runs in worker processes don't each hold a copy of the log.
+#
+# Arrival times are in minutes from the midnight before the first arrival, so
+# the days of the log line up with the days of the model. The onset type, 
+# diagnosis (0 = ICH, 1 = I, 2 = TIA, 3 = stroke mimic, 4 = non stroke) and 
+# MRS have the same values as in the patient table.
+
+class ArrivalTrace:
+
+    columns = [("arrival_time", np.float64),
+               ("onset_type", np.int8),
+               ("diagnosis", np.int8),
+               ("mrs_type", np.int8)]
+
+    day_length = 1440
+
+    def __init__(self, folder):
+        self.folder = folder
+        for column, _ in self.columns:
+            setattr(self, column, np.load(
+                os.path.join(folder, f"{column}.npy"), mmap_mode="r"))
+        with open(os.path.join(folder, "trace.json")) as info_file:
+            self.info = json.load(info_file)
+
+        # The first row of each day of the log, followed by the number of 
+        # rows. As the rows are in time order only a few rows are read to 
+        # find them.
+
+        self.number_of_days = self.info["days"]
+        self.day_starts = np.searchsorted(
+            self.arrival_time, 
+            self.day_length * np.arange(self.number_of_days + 1))
+
+    # Converts a CSV file with a row per patient and the columns above into a
+    # trace folder. The arrival times can be dates and times or numbers of 
+    # minutes. Patients with a diagnosis that has no MRS bands (TIA, stroke 
+    # mimic and non stroke) are given an MRS of 7, so their MRS can be left 
+    # empty.
+
+    @classmethod
+    def convert(cls, csv_path, folder):
+        df = pd.read_csv(csv_path)
+        missing = [column for column, _ in cls.columns 
+                   if column not in df.columns]
+        if len(missing) > 0:
+            raise ValueError(f"The arrival log is missing the columns "
+                             f"{missing}")
+        if len(df) == 0:
+            raise ValueError("The arrival log has no patients")
+
+        if pd.api.types.is_numeric_dtype(df["arrival_time"]) == True:
+            minutes = df["arrival_time"].to_numpy(dtype=float)
+        else:
+            arrival_times = pd.to_datetime(df["arrival_time"])
+            minutes = ((arrival_times - arrival_times.min().normalize()) 
+                       / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+        minutes = minutes - cls.day_length * np.floor(
+            minutes.min() / cls.day_length)
+        order = np.argsort(minutes, kind="stable")
+
+        values = {"arrival_time": minutes[order]}
+        for column in ["onset_type", "diagnosis", "mrs_type"]:
+            values[column] = df[column].to_numpy(dtype=float)[order]
+        no_mrs = values["diagnosis"] >= 2
+        values["mrs_type"][no_mrs] = PatientLookupTables.no_mrs_type
+
+        valid = {"arrival_time": np.isfinite(values["arrival_time"]),
+                 "onset_type": np.isin(values["onset_type"], range(3)),
+                 "diagnosis": np.isin(values["diagnosis"], range(5)),
+                 "mrs_type": np.isin(values["mrs_type"], range(7)) | no_mrs}
+        for column, valid_rows in valid.items():
+            if valid_rows.all() == False:
+                row = order[np.argmin(valid_rows)] + 2
+                raise ValueError(f"Row {row} of the arrival log has an "
+                                 f"invalid {column}")
+
+        os.makedirs(folder, exist_ok=True)
+        fingerprint = hashlib.sha256()
+        for column, dtype in cls.columns:
+            column_values = values[column].astype(dtype)
+            fingerprint.update(column_values.tobytes())
+            np.save(os.path.join(folder, f"{column}.npy"), column_values)
+        info = {"source": os.path.abspath(csv_path),
+                "rows": len(df),
+                "days": int(values["arrival_time"][-1] // cls.day_length) + 1,
+                "sha256": fingerprint.hexdigest()}
+        with open(os.path.join(folder, "trace.json"), "w") as info_file:
+            json.dump(info, info_file, indent=2)
+        return cls(folder)
+
+    # Returns the rows of the given days of the log, in order, and their 
+    # arrival times moved to the days of the run they are replayed on. The 
+    # days are replayed one after another from first_run_day.
+
+    def replay_days(self, days, first_run_day):
+        starts = self.day_starts[days]
+        counts = self.day_starts[days + 1] - starts
+        rows = np.repeat(starts - (np.cumsum(counts) - counts), counts) + \
+            np.arange(counts.sum())
+        run_days = first_run_day + np.arange(len(days))
+        times = self.arrival_time[rows] + np.repeat(
+            self.day_length * (run_days - days), counts)
+        return rows, times
+
+# Each process only opens a trace once, and shares it between all of its runs.
+
+@functools.lru_cache(maxsize=None)
+def arrival_trace(folder):
+    return ArrivalTrace(folder)
+
+# Sampler class that draws the random values used by a run. Drawing values one
+# at a time is slow in Python, so the values are drawn from NumPy in blocks 
+# and handed out one patient at a time. Each purpose (eg nurse time, ward LOS)
+# has its own stream, all made from the run's seed, so changing how many values
+# one part of the model uses doesn't change the values drawn for the others.
+#
+# Times are drawn from an exponential distribution with a mean of 1 and the
+# diagnosis and admission chance noise from a normal distribution with a mean
+# of 0 and a standard deviation of 1, these are then scaled by the model with
+# the means in the config.
+#
+# If an arrival log is replayed (see ArrivalTrace), the arrival times and the
+# onset type, diagnosis and MRS of each patient are taken from the log. The 
+# other values are still drawn, as are the values that are replaced, so the 
+# streams stay the same. New streams are added to the end of the list, which
+# leaves the streams before them unchanged.
+
+class PatientSampler:
+
+    stream_names = ["arrivals", "onset", "mrs", "diagnosis", "non_admission",
+                    "diagnosis_ranges", "nurse", "ct", "sdec", "ward",
+                    "admission_chance", "trace_days", "window_arrivals"]
+
+    # The number of days of the log added to the run at a time.
+
+    trace_block_days = 64
+
+    def __init__(self, lookup_tables, seed=None, block_size=1024, trace=None,
+                 bootstrap_trace=False):
+        self.lookup_tables = lookup_tables
+        self.block_size = block_size
+        children = np.random.SeedSequence(seed).spawn(len(self.stream_names))
+        self.streams = {name: np.random.default_rng(child) for name, child 
+                        in zip(self.stream_names, children)}
+        
+        self.patient_rows = []
+        self.next_patient_row = 0
+        self.arrival_work = []
+        self.next_arrival = 0
+
+        # When each arrival window opens with an arrival, each window has its
+        # own stream of work (see next_window_arrival_work), made from the 
+        # seed of the window arrivals stream.
+
+        self.window_arrival_seed = children[
+            self.stream_names.index("window_arrivals")]
+        self.window_streams = {}
+        self.window_arrival_work = {}
+
+        # The rows of the log replayed in the run and their arrival times, 
+        # the number of days of the run they cover, the next arrival and the
+        # number of rows given to patients so far.
+
+        self.trace = trace
+        self.bootstrap_trace = bootstrap_trace
+        self.trace_rows = np.zeros(0, dtype=np.int64)
+        self.trace_times = np.zeros(0)
+        self.trace_run_days = 0
+        self.next_trace_row = 0
+        self.trace_patients = 0
+
+    # Each row holds every value that is drawn for a single patient, in the 
+    # order of the columns of the patient table. The diagnosis, MRS and ward 
+    # LOS of the whole block are found using the lookup tables. The admission
+    # chances have 4 values per patient (2 for the SDEC and 2 for once the 
+    # patient leaves the SDEC).
+
+    def draw_patient_block(self):
+        columns = self.draw_patient_columns()
+        self.patient_rows = list(zip(*[column.tolist() for column 
+                                       in columns]))
+        self.next_patient_row = 0
+
+    # Draws the values of a block of patients as one array per column, the 
+    # fast engine (see FastModel) uses the columns as they are.
+
+    def draw_patient_columns(self):
+        size = self.block_size
+        streams = self.streams
+        lookup_tables = self.lookup_tables
+
+        diagnosis_values = streams["diagnosis"].integers(0, 101, size)
+
+        # Five values are drawn for the diagnosis ranges although only the
+        # first four are used, this keeps the stream the same as before the
+        # lookup tables were used.
+
+        range_noise = streams["diagnosis_ranges"].standard_normal((size, 5))
+        diagnosis = lookup_tables.diagnose(diagnosis_values, range_noise[:, :4])
+        mrs_type = lookup_tables.assign_mrs(
+            diagnosis, streams["mrs"].integers(0, 101, size))
         
-        self.mrs_type = random.randint(0, 100)        
-        self.diagnosis = random.randint(0, 100)
-        self.patient_diagnosis = 0
-        self.priority = 1
-        self.non_admission = random.randint(0, 100)
-        self.advanced_ct_pathway = False
-        self.sdec_pathway = False
-        self.thrombolysis = False
-        self.thrombectomy = False
-        self.admission_avoidance = False
-        self.sdec_yield_count = 0
-        self.sdec_admission_time_out = False
+        onset_type = streams["onset"].integers(0, 3, size)
+        if self.trace is not None:
+            rows = self.next_trace_rows(size)
+            onset_type = self.trace.onset_type[rows].astype(np.int64)
+            diagnosis = self.trace.diagnosis[rows].astype(np.int64)
+            mrs_type = self.trace.mrs_type[rows].astype(np.int64)
+
+        non_admission = streams["non_admission"].integers(0, 101, size)
+        nurse_time = streams["nurse"].standard_exponential(size)
+        ct_time = streams["ct"].standard_exponential(size)
+        sdec_time = streams["sdec"].standard_exponential(size)
+        ward_time = lookup_tables.ward_time(
+            diagnosis, mrs_type, streams["ward"].standard_exponential(size))
+        admission_chance = streams["admission_chance"].standard_normal(
+            (size, 4))
+
+        return [onset_type, mrs_type, diagnosis_values, diagnosis, 
+                non_admission, nurse_time, ct_time, sdec_time, ward_time,
+                admission_chance]
+
+    def next_patient(self):
+        if self.next_patient_row == len(self.patient_rows):
+            self.draw_patient_block()
+        row = self.patient_rows[self.next_patient_row]
+        self.next_patient_row += 1
+        return row
+
+    # The arrival generator uses an amount of "work" drawn from an 
+    # exponential distribution with a mean of 1 for each arrival.
+
+    def next_arrival_work(self):
+        if self.next_arrival == len(self.arrival_work):
+            self.arrival_work = self.draw_arrival_block().tolist()
+            self.next_arrival = 0
+        work = self.arrival_work[self.next_arrival]
+        self.next_arrival += 1
+        return work
+
+    def draw_arrival_block(self):
+        return self.streams["arrivals"].standard_exponential(self.block_size)
+
+    # The work of the next arrival of an arrival window, for when each window
+    # has its own arrival generator. Each window's stream is the one spawn 
+    # would give as the window's child of the window arrivals seed, so the 
+    # values of a window don't depend on the order the windows draw them in.
+
+    def next_window_arrival_work(self, window):
+        if window not in self.window_streams:
+            seed = self.window_arrival_seed
+            self.window_streams[window] = np.random.default_rng(
+                np.random.SeedSequence(seed.entropy, 
+                                       spawn_key=seed.spawn_key + (window,)))
+            self.window_arrival_work[window] = collections.deque()
+        work = self.window_arrival_work[window]
+        if len(work) == 0:
+            work.extend(self.window_streams[window].standard_exponential(
+                self.block_size).tolist())
+        return work.popleft()
+
+    # Adds the next block of days of the log to the run. The days are 
+    # replayed in order, starting again from the first day once the log runs
+    # out, or drawn at random if the log is bootstrapped.
+
+    def extend_trace(self):
+        if self.bootstrap_trace == True:
+            days = self.streams["trace_days"].integers(
+                0, self.trace.number_of_days, self.trace_block_days)
+        else:
+            days = (self.trace_run_days + np.arange(self.trace_block_days)) \
+                % self.trace.number_of_days
+        rows, times = self.trace.replay_days(days, self.trace_run_days)
+        self.trace_rows = np.concatenate([self.trace_rows, rows])
+        self.trace_times = np.concatenate([self.trace_times, times])
+        self.trace_run_days += self.trace_block_days
+
+    def next_trace_arrival(self):
+        while self.next_trace_row == len(self.trace_times):
+            self.extend_trace()
+        time = float(self.trace_times[self.next_trace_row])
+        self.next_trace_row += 1
+        return time
+
+    # Returns every arrival time before the end time, used by the fast 
+    # engine.
+
+    def trace_arrivals_before(self, end_time):
+        while self.trace_run_days * self.trace.day_length < end_time:
+            self.extend_trace()
+        return self.trace_times[self.trace_times < end_time]
+
+    # Returns the rows of the log for the next block of patients.
+
+    def next_trace_rows(self, size):
+        while len(self.trace_rows) < self.trace_patients + size:
+            self.extend_trace()
+        rows = self.trace_rows[self.trace_patients:self.trace_patients + size]
+        self.trace_patients += size
+        return rows
+
+# Sketch of the distribution of a waiting time (or stay), used to find its 
+# percentiles (eg the time 95% of patients are assessed within) without 
+# keeping every patient's value. Each value is counted in a bucket, the 
+# buckets get wider as the values get larger so every bucket covers the same
+# relative range (as in an HDR histogram). Any percentile is then within 1% of
+# the true value, and the memory used is the same however many patients there
+# are. Values under 0.01 minutes (eg no wait) are counted as 0. Sketches of 
+# different runs, or from different processes, are merged by adding their 
+# counts together.
+
+class WaitTimeSketch:
+
+    relative_accuracy = 0.01
+    min_value = 0.01
+    max_value = 1e7
+
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    log_gamma = math.log(gamma)
+    number_of_buckets = int(math.ceil(math.log(max_value / min_value) / 
+                                      log_gamma)) + 1
+
+    def __init__(self):
+        self.counts = np.zeros(self.number_of_buckets, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    # Bucket i holds the values above min_value * gamma ** (i - 1), up to 
+    # min_value * gamma ** i. Values above max_value go in the last bucket.
+
+    def add(self, value):
+        if value != value:
+            return
+        if value < self.min_value:
+            self.zero_count += 1
+        else:
+            bucket = math.ceil(math.log(value / self.min_value) / 
+                               self.log_gamma)
+            self.counts[min(bucket, self.number_of_buckets - 1)] += 1
+        self.count += 1
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    # Adds an array of values at once, NaN values are left out.
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        above_zero = values[values >= self.min_value]
+        buckets = np.ceil(np.log(above_zero / self.min_value) / 
+                          self.log_gamma).astype(np.int64)
+        self.counts += np.bincount(np.minimum(buckets, 
+                                              self.number_of_buckets - 1),
+                                   minlength=self.number_of_buckets)
+        self.zero_count += len(values) - len(above_zero)
+        self.count += len(values)
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    # Returns the value at the quantile given (eg 0.95). The value given for
+    # a bucket is the one with the same relative error to both of its edges,
+    # kept within the smallest and largest values added.
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        bucket = int(np.searchsorted(self.zero_count + np.cumsum(self.counts),
+                                     rank, side="right"))
+        value = self.min_value * 2 * self.gamma ** bucket / (self.gamma + 1)
+        return min(max(value, self.minimum), self.maximum)
+
+    # The sketch as a dictionary that can be written to JSON, only the 
+    # buckets that have values are kept.
+
+    def to_dict(self):
+        buckets = np.flatnonzero(self.counts)
+        return {"buckets": buckets.tolist(), 
+                "counts": self.counts[buckets].tolist(),
+                "zero_count": self.zero_count, "count": self.count,
+                "minimum": self.minimum, "maximum": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.counts[data["buckets"]] = data["counts"]
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.minimum = data["minimum"]
+        sketch.maximum = data["maximum"]
+        return sketch
+
+# The per patient results that are sketched, with the name and unit their 
+# percentiles are given in and the number of minutes in that unit.
+
+sketch_columns = [("Q Time Nurse", "Nurse Queue Time (Mins)", 1),
+                  ("Q Time Ward", "Ward Queue Time (Hours)", 60),
+                  ("Time in SDEC", "SDEC Time (Mins)", 1),
+                  ("Ward LOS", "Ward LOS (Hours)", 60)]
+
+# The percentiles reported for each sketched result.
+
+sketch_percentiles = [50, 90, 95, 99]
+
+# Recorder class that stores the per patient results of a run. Writing single
+# values into a pandas DataFrame is slow as the DataFrame has to be enlarged
+# for every new patient, so instead each column is held as a NumPy array that
+# grows in chunks. The DataFrame is only built once, when the run has finished.
+#
+# If a log path is given the results of each patient are written to a results
+# log once the patient has completed their journey, rather than being kept 
+# until the end of the run. The completed patients are written in chunks of a
+# fixed number of rows and their rows are reused, so the memory used stays the
+# same however long the run is. The log can be read back with 
+# read_results_log.
+#
+# The waiting times and stays in sketch_columns are also added to a sketch as
+# they are recorded (see WaitTimeSketch), for their percentiles.
+#
+# If the recorder is given the model's environment, values recorded before the
+# end of the warm up period are not stored. This is the only place the warm up
+# period is applied to the per patient results, so the model can record its 
+# values without checking the time itself.
+
+class ResultsRecorder:
+
+    # The columns of the results DataFrame, in the order they are output, and
+    # the type of data they hold. "float" columns are stored as floats, "int"
+    # and "bool" columns are stored as integer codes and "text" columns are
+    # stored as a code pointing at the list of labels below.
+
+    columns = [("Q Time Nurse", "float"),
+               ("Time with Nurse", "float"),
+               ("Q Time Ward", "float"),
+               ("Ward LOS", "float"),
+               ("Time with CTP", "float"),
+               ("Time with CT", "float"),
+               ("Time in SDEC", "float"),
+               ("CTP Status", "bool"),
+               ("SDEC Status", "bool"),
+               ("Thrombolysis", "bool"),
+               ("SDEC Occupancy", "float"),
+               ("Admission Avoidance", "bool"),
+               ("SDEC Savings", "float"),
+               ("MRS Type", "float"),
+               ("Onset Type", "float"),
+               ("Diagnosis Type", "text"),
+               ("Diangosis Value", "int"),
+               ("Patient Flow Check 1", "text"),
+               ("Patient Flow Check 2", "text"),
+               ("Thrombolysis Savings", "float"),
+               ("Ward Occupancy", "float"),
+               ("Arrival Time", "float"),
+               ("Patient Gen 1 Status", "bool"),
+               ("Patient Gen 2 Status", "bool"),
+               ("SDEC Yield Count", "float"),
+               ("Sampled LOS", "float")]
+
+    text_labels = ["ICH", "I", "TIA", "Stroke Mimic", "Non Stroke", "Yes"]
+
+    # The columns whose last recorded value is read during the run (see 
+    # last_valid).
+
+    tracked_columns = {"SDEC Savings"}
+
+    # The number of rows the arrays start with, each time they are full the
+    # number of rows is doubled. The number of completed patients written to
+    # the results log at a time.
+
+    initial_rows = 1024
+    chunk_rows = 4096
+
+    def __init__(self, log_path=None, env=None, warm_up_period=0.0):
+        self.env = env
+        self.warm_up_period = warm_up_period
+        self.kinds = dict(self.columns)
+        self.text_codes = {label: code for code, label in
+                           enumerate(self.text_labels)}
+        self.capacity = self.initial_rows
+        self.rows = {}
+        self.used_rows = 0
+        self.free_rows = []
+        self.next_order = 0
+        self.patient_ids = np.zeros(self.capacity, dtype=np.int64)
+        self.row_order = np.zeros(self.capacity, dtype=np.int64)
+        self.data = {}
+        for column, kind in self.columns:
+            self.data[column] = self.empty_column(kind, self.capacity)
+        self.last_values = {}
+        self.sketches = {column: WaitTimeSketch() 
+                         for column, _, _ in sketch_columns}
+
+        self.log_path = None
+        self.log_file = None
+        if log_path is not None:
+            self.start_log(log_path)
+
+    # Starts writing completed patients to a results log. This can also be 
+    # done part way through a run, as long as no patients have been recorded
+    # yet (eg at the end of the warm up period).
+
+    def start_log(self, log_path):
+        self.log_path = log_path
+        self.log_file = open(log_path, "wb")
+        self.chunk = np.zeros(self.chunk_rows, dtype=self.log_dtype())
+        self.chunk_count = 0
+
+    # Missing values are NaN for float columns and -1 for the coded columns,
+    # this matches the blanks pandas leaves when a value is never written.
+
+    @classmethod
+    def empty_value(cls, kind):
+        if kind == "float":
+            return np.nan
+        return -1
+
+    @classmethod
+    def column_dtype(cls, kind):
+        if kind == "float":
+            return np.float64
+        elif kind == "int":
+            return np.int64
+        return np.int8
+
+    def empty_column(self, kind, rows):
+        return np.full(rows, self.empty_value(kind), 
+                       dtype=self.column_dtype(kind))
+
+    # The results log holds the patient ID, the order the patient was first
+    # recorded in (so the rows can be put back in the same order as the 
+    # DataFrame) and every column.
+
+    @classmethod
+    def log_dtype(cls):
+        return np.dtype([("Patient ID", np.int64), ("Row Order", np.int64)] +
+                        [(column, cls.column_dtype(kind)) 
+                         for column, kind in cls.columns])
+
+    # Doubles the number of rows available in every column.
+
+    def grow(self):
+        new_capacity = self.capacity * 2
+        for name in ["patient_ids", "row_order"]:
+            new_column = np.zeros(new_capacity, dtype=np.int64)
+            new_column[:self.capacity] = getattr(self, name)
+            setattr(self, name, new_column)
+        for column, kind in self.columns:
+            new_column = self.empty_column(kind, new_capacity)
+            new_column[:self.capacity] = self.data[column]
+            self.data[column] = new_column
+        self.capacity = new_capacity
+
+    # Patients are given a row the first time a value is recorded for them, so
+    # the row order is the same as the order the old DataFrame was enlarged 
+    # in. Rows of patients that have been written to the results log are 
+    # reused.
+
+    def new_row(self, patient_id):
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            row = self.used_rows
+            if row == self.capacity:
+                self.grow()
+            self.used_rows += 1
+        self.rows[patient_id] = row
+        self.patient_ids[row] = patient_id
+        self.row_order[row] = self.next_order
+        self.next_order += 1
+        return row
+
+    # Checks if values recorded now are stored, ie the warm up period has 
+    # passed.
+
+    def recording(self):
+        return self.env is None or self.env.now > self.warm_up_period
+
+    # Records a single value for a patient, if the warm up period has passed.
+
+    def record(self, patient_id, column, value):
+        if self.env is not None and self.env.now <= self.warm_up_period:
+            return
+
+        row = self.rows.get(patient_id)
+        if row is None:
+            row = self.new_row(patient_id)
+
+        kind = self.kinds[column]
+        if kind == "text":
+            value = self.text_codes[value]
+        self.data[column][row] = value
+
+        sketch = self.sketches.get(column)
+        if sketch is not None:
+            sketch.add(value)
+
+        if column in self.tracked_columns:
+            order = self.row_order[row]
+            last = self.last_values.get(column)
+            if last is None or order >= last[0]:
+                self.last_values[column] = (order, value)
+
+    # Returns the value of a tracked column in the last row that has a value
+    # recorded, or the default if no values have been recorded yet.
+
+    def last_valid(self, column, default=0.0):
+        last = self.last_values.get(column)
+        if last is None:
+            return default
+        return last[1]
+
+    # Tells the recorder a patient has completed their journey, so no more 
+    # values will be recorded for them. If there is a results log the 
+    # patient's row is moved into the current chunk and the row is freed.
+
+    def complete(self, patient_id):
+        if self.log_file is None:
+            return
+        row = self.rows.pop(patient_id, None)
+        if row is None:
+            return
+
+        chunk_row = self.chunk[self.chunk_count]
+        chunk_row["Patient ID"] = self.patient_ids[row]
+        chunk_row["Row Order"] = self.row_order[row]
+        for column, kind in self.columns:
+            values = self.data[column]
+            chunk_row[column] = values[row]
+            values[row] = self.empty_value(kind)
+        self.free_rows.append(row)
+
+        self.chunk_count += 1
+        if self.chunk_count == self.chunk_rows:
+            self.write_chunk()
+
+    # Writes the patients held in memory to a results log at the path given, 
+    # in the order they were first recorded. This is used when there is no 
+    # results log for the run (eg to store the run in the result cache).
+
+    def write_log(self, path):
+        n = self.used_rows
+        rows = np.zeros(n, dtype=self.log_dtype())
+        rows["Patient ID"] = self.patient_ids[:n]
+        rows["Row Order"] = self.row_order[:n]
+        for column, _ in self.columns:
+            rows[column] = self.data[column][:n]
+        with open(path, "wb") as log_file:
+            np.save(log_file, rows)
+
+    # Fills the recorder with the results of every patient at once, this is
+    # used by the fast engine rather than recording one value at a time. The
+    # values are given as a float array per column, with NaN where a value 
+    # wasn't recorded (text columns are given as their codes). The patients 
+    # are given in the order they were first recorded.
+
+    def fill(self, patient_ids, values):
+        n = len(patient_ids)
+        while self.capacity < n:
+            self.grow()
+        self.patient_ids[:n] = patient_ids
+        self.row_order[:n] = np.arange(n)
+        self.used_rows = self.next_order = n
+        self.rows = dict(zip(patient_ids.tolist(), range(n)))
+
+        for column, column_values in values.items():
+            kind = self.kinds[column]
+            if kind != "float":
+                column_values = np.where(np.isnan(column_values), 
+                                         self.empty_value(kind), 
+                                         column_values)
+            self.data[column][:n] = column_values
+            if column in self.sketches:
+                self.sketches[column].add_many(column_values)
+
+    def write_chunk(self):
+        if self.chunk_count > 0:
+            np.save(self.log_file, self.chunk[:self.chunk_count])
+            self.chunk_count = 0
+
+    # Once the run has finished, the patients still in the model are written 
+    # to the results log and the log is closed.
+
+    def close(self):
+        if self.log_file is None:
+            return
+        for patient_id in sorted(self.rows, 
+                                 key=lambda p_id: 
+                                 self.row_order[self.rows[p_id]]):
+            self.complete(patient_id)
+        self.write_chunk()
+        self.log_file.close()
+        self.log_file = None
+
+    # Builds the results DataFrame with the patient ID as the index. The coded
+    # columns are converted back to the values that were recorded. Only the 
+    # columns given are included, by default all of them.
+
+    @classmethod
+    def build_frame(cls, data, patient_ids, columns=None):
+        kinds = dict(cls.columns)
+        if columns is None:
+            columns = [column for column, _ in cls.columns]
+        n = len(patient_ids)
+        frame = {}
+        for column in columns:
+            kind = kinds[column]
+            values = data[column]
+            if kind == "float":
+                frame[column] = values
+                continue
+
+            decoded = np.full(n, np.nan, dtype=object)
+            recorded = values >= 0
+            if kind == "bool":
+                decoded[recorded] = values[recorded] == 1
+            elif kind == "int":
+                decoded[recorded] = [int(value) for value in values[recorded]]
+            else:
+                labels = np.array(cls.text_labels, dtype=object)
+                decoded[recorded] = labels[values[recorded]]
+            frame[column] = decoded
+
+        results_df = pd.DataFrame(frame,
+                                  index=pd.Index(patient_ids,
+                                                 name="Patient ID"))
+        return results_df
+
+    # Builds the results DataFrame, from the results log if there is one.
+
+    def to_frame(self, columns=None):
+        if self.log_path is not None:
+            return read_results_log(self.log_path, columns)
+        n = self.used_rows
+        return self.build_frame({column: values[:n] for column, values 
+                                 in self.data.items()},
+                                self.patient_ids[:n], columns)
+
+# This function reads a results log written by the results recorder back into
+# the same DataFrame the recorder would have built. The log is read a chunk
+# at a time and only the columns given are kept (by default all of them), so
+# a few columns can be read from a large log without loading all of it.
+
+def read_results_log(path, columns=None):
+    if columns is None:
+        columns = [column for column, _ in ResultsRecorder.columns]
+    names = ["Patient ID", "Row Order"] + list(columns)
+    
+    parts = {name: [] for name in names}
+    with open(path, "rb") as log_file:
+        while True:
+            try:
+                chunk = np.load(log_file)
+            except EOFError:
+                break
+            for name in names:
+                parts[name].append(chunk[name].copy())
+            del chunk
+
+    log_dtype = ResultsRecorder.log_dtype()
+    data = {name: np.concatenate(parts[name]) if parts[name] else
+            np.zeros(0, dtype=log_dtype[name]) for name in names}
+
+    order = np.argsort(data["Row Order"], kind="stable")
+    return ResultsRecorder.build_frame({column: data[column][order] 
+                                        for column in columns},
+                                       data["Patient ID"][order], columns)
+
+# Profiler that runs the SimPy environment one step at a time and adds up the
+# wall time and the number of events scheduled by each step against the stage
+# of the model that the step ran. The stage is found from the process the 
+# step resumes: the arrival and obstruct generators are a stage each, and the
+# patient pathway is split into the stages marked with "Profiler stage" 
+# comments in stroke_assessment, using the line the patient's generator is 
+# paused at. Time spent recording results is counted as its own stage. The 
+# profiler is only used when profile_stages is set, so the model runs 
+# without it otherwise.
+
+class StageProfiler:
+
+    process_stages = {"generator_patient_arrivals": "arrival generator",
+                      "generator_window_arrivals": "arrival generator",
+                      "obstruct_ctp": "obstruct_ctp",
+                      "obstruct_sdec": "obstruct_sdec"}
+
+    def __init__(self, model):
+        self.env = model.env
+        self.steps = {}
+        self.events = {}
+        self.times = {}
+        self.write_count = 0
+        self.write_time = 0.0
+
+        # The recorder's record method is timed by replacing it on this 
+        # model's recorder only.
+
+        record = model.recorder.record
+
+        def timed_record(*args):
+            start = time.perf_counter()
+            record(*args)
+            self.write_count += 1
+            self.write_time += time.perf_counter() - start
+
+        model.recorder.record = timed_record
+
+    # Returns the first line of each stage of stroke_assessment and the 
+    # stage names, the code before the first marker is the patient arrival.
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def pathway_stages():
+        lines, first_line = inspect.getsourcelines(Model.stroke_assessment)
+        starts = [first_line]
+        names = ["patient arrival"]
+        for number, line in enumerate(lines, start=first_line):
+            text = line.strip()
+            if text.startswith("# Profiler stage:"):
+                starts.append(number)
+                names.append(text.split(":", 1)[1].strip())
+        return starts, names
+
+    # Finds the stage of the next step from the processes waiting on the 
+    # next event. Steps that don't resume a process (eg an event that is
+    # part of a condition) are counted as "other events".
+
+    def next_stage(self):
+        event = self.env._queue[0][3]
+        for callback in event.callbacks or []:
+            process = getattr(callback, "__self__", None)
+            if not isinstance(process, simpy.Process):
+                continue
+            name = process._generator.__name__
+            if name == "stroke_assessment":
+                starts, names = self.pathway_stages()
+                line = process._generator.gi_frame.f_lineno
+                return "pathway: " + \
+                    names[bisect.bisect_right(starts, line) - 1]
+            return self.process_stages.get(name, name)
+        return "other events"
+
+    # Runs the environment until the time given, in the same way as 
+    # env.run. Events scheduled for the end time itself aren't processed.
+
+    def run(self, until):
+        env = self.env
+        queue = env._queue
+        while queue and queue[0][0] < until:
+            stage = self.next_stage()
+            queued = len(queue)
+            write_time = self.write_time
+
+            start = time.perf_counter()
+            env.step()
+            elapsed = time.perf_counter() - start
+
+            self.steps[stage] = self.steps.get(stage, 0) + 1
+            self.events[stage] = self.events.get(stage, 0) + \
+                len(queue) - queued + 1
+            self.times[stage] = self.times.get(stage, 0.0) + elapsed - \
+                (self.write_time - write_time)
+        env.run(until=until)
+
+    # Builds the profile table, with the stages that took the most time 
+    # first.
+
+    def to_frame(self):
+        rows = [(stage, self.steps[stage], self.events[stage], 
+                 self.times[stage]) for stage in self.steps]
+        rows.append(("results writes", self.write_count, 0, self.write_time))
+        profile_df = pd.DataFrame(rows, columns=["Stage", "Steps", 
+                                                 "Events Scheduled", 
+                                                 "Wall Time (s)"])
+        total_time = profile_df["Wall Time (s)"].sum()
+        profile_df["Time per Step (us)"] = \
+            profile_df["Wall Time (s)"] / profile_df["Steps"] * 1e6
+        profile_df["Share of Time (%)"] = \
+            profile_df["Wall Time (s)"] / total_time * 100
+        return profile_df.sort_values("Wall Time (s)", ascending=False, 
+                                      ignore_index=True)
 
 # Class representing the model of the stroke assessment / treatment process
 
 class Model:
     # Constructor to set up the model for a run. We pass in a run number when
-    # we create a new model.
-    def __init__(self, run_number):
+    # we create a new model, along with the config to run and a seed for the
+    # model's sampler. If no config is passed in, one is made
+    # from the current values in the g class.
+    def __init__(self, run_number, config=None, seed=None):
+
+        if config is None:
+            config = ScenarioConfig.from_g()
+        self.config = config
+
+        # Each model has its own sampler, so models don't affect each other's
+        # results. The sampler replays the arrival log if there is one.
+        trace = None
+        if self.config.arrival_trace is not None:
+            trace = arrival_trace(self.config.arrival_trace)
+        self.sampler = PatientSampler(
+            patient_lookup_tables(self.config), seed, trace=trace,
+            bootstrap_trace=self.config.bootstrap_trace)
  
         # Create a SimPy environment
         self.env = simpy.Environment()
@@ -174,52 +1719,46 @@ class Model:
         # Create a patient counter for the first patient Generator
         self.patient_counter = 0
 
+        # These flags are changed by the generators while the model runs, they
+        # show if the CTP and SDEC are currently unavailable and which arrival
+        # window the latest patient arrived in.
+        self.ctp_unav = False
+        self.sdec_unav = False
+        self.patient_arrival_gen_1 = False
+        self.patient_arrival_gen_2 = False
+
         # Create a SimPy resources to represent stroke nurses, ctp scanners,
-        # sdec beds, and ward beds. Set in class g
+        # sdec beds, and ward beds. Set in the config
         self.nurse = simpy.Resource(self.env, 
-                                              capacity=g.number_of_nurses)
+                                    capacity=self.config.number_of_nurses)
 
         self.ctp_scanner = simpy.PriorityResource(self.env,
-                                              capacity=g.number_of_ctp)
+                                    capacity=self.config.number_of_ctp)
         
-        self.sdec_bed = simpy.PriorityResource(self.env, capacity=g.sdec_beds)
+        self.sdec_bed = simpy.PriorityResource(self.env, 
+                                    capacity=self.config.sdec_beds)
 
-        self.ward_bed = simpy.Resource(self.env, capacity=g.number_of_ward_beds)
+        self.ward_bed = simpy.Resource(self.env, 
+                                    capacity=self.config.number_of_ward_beds)
 
         # Store the passed in run number
         self.run_number = run_number
 
-        # Create a Pandas DataFrame that will store a majority of the results 
-        # with the patient ID as the index.
-        self.results_df = pd.DataFrame()
-        self.results_df["Patient ID"] = [1]
-        self.results_df["Q Time Nurse"] = [0.0]
-        self.results_df["Time with Nurse"] = [0.0]
-        self.results_df["Q Time Ward"] = [0.0]
-        self.results_df["Ward LOS"] = [0.0]
-        self.results_df["Time with CTP"] = [0.0]
-        self.results_df["Time with CT"] = [0.0]
-        self.results_df["Time in SDEC"] = [0.0]  
-        self.results_df["CTP Status"] = [""]
-        self.results_df["SDEC Status"] = [""]
-        self.results_df["Thrombolysis"] = [""]
-        self.results_df["SDEC Occupancy"] = [0.0]
-        self.results_df["Admission Avoidance"] = [""]
-        self.results_df["SDEC Savings"] = [0.0]
-        self.results_df["MRS Type"] = [0.0]
-        self.results_df["Onset Type"] = [0.0]
-        self.results_df["Diagnosis Type"] = [""]
-        self.results_df["Diangosis Value"] = [""]
-        self.results_df["Patient Flow Check 1"] = [""]
-        self.results_df["Patient Flow Check 2"] = [""]
-        self.results_df["Thrombolysis Savings"] = [0.0]
-        self.results_df["Ward Occupancy"] = [0.0]
-        self.results_df["Arrival Time"] = [0.0]
-        self.results_df["Patient Gen 1 Status"] = [""]
-        self.results_df["Patient Gen 2 Status"] = [""]
-        self.results_df["SDEC Yield Count"] = [0.0]
-        self.results_df["Sampled LOS"] = [0.0]
-        self.results_df.set_index("Patient ID", inplace=True)
+        # Create a results recorder that will store a majority of the results 
+        # with the patient ID as the key. The DataFrame is only built from the
+        # recorder once the run has finished (see calculate_run_results). If
+        # the results are spilled to a results log, the results DataFrame is
+        # not kept.
+        self.results_log_path = None
+        self.recorder = ResultsRecorder(None, self.env,
+                                        self.config.warm_up_period)
+        self.start_results_log()
+        self.results_df = None
+
+        # The profiler and the time and events of each stage of the run, if 
+        # it is profiled
+        self.profiler = None
+        self.stage_profile = None
 
         # A variable to count the number of SDEC freezes
         self.sdec_freeze_counter = 0
@@ -236,105 +1775,183 @@ class Model:
         # Create a variable to store the mean number of thrombolysis savings
         self.thrombolysis_savings = 0
 
-        # set up a list to store the queue for stroke nurse assessment
-        self.q_for_assessment = []
-
-        # a PD dataframe for the assessment queue graph
-        self.nurse_q_graph_df = pd.DataFrame()
-        self.nurse_q_graph_df["Time"] = [0.0]
-        self.nurse_q_graph_df["Patients in Assessment Queue"] = [0.0]
+        # The table that stores the attributes of every patient in the run.
+        # If the results are spilled the rows of patients that have 
+        # completed their journey are reused, so the table only holds the 
+        # patients in the system.
+        self.patients = PatientTable(
+            recycle_rows=self.config.spill_results == True)
+
+        # Counter for the number of patients in the queue for stroke nurse 
+        # assessment
+        self.q_for_assessment = 0
+
+        # If the results are spilled the monitors only keep enough rows for
+        # the graphs, four times the points drawn, so their memory doesn't 
+        # grow with the length of the run either.
+        monitor_rows = None
+        if self.config.spill_results == True:
+            monitor_rows = max(4 * self.config.graph_point_budget, 1024)
+
+        # a monitor for the assessment queue graph
+        self.nurse_q_monitor = TimeSeriesMonitor(
+            "Patients in Assessment Queue", self.config.warm_up_period,
+            max_rows=monitor_rows)
+
+        # Counter for the number of patients in the SDEC
+        self.sdec_occupancy = 0
+
+        # Counter for the number of admissions avoided
+        self.admission_avoidance = 0
+
+        # Counter for the number of patients in the ward
+        self.ward_occupancy = 0
+
+        # a monitor for the ward occupancy graph
+        self.ward_occupancy_monitor = TimeSeriesMonitor(
+            "Ward Occupancy", self.config.warm_up_period, 
+            max_rows=monitor_rows)
+
+        # An event that is triggered when a ward bed is released, patients 
+        # waiting in the SDEC for a ward bed wait on this event rather than 
+        # checking the ward every minute. A new event is created each time it
+        # is triggered.
+        self.ward_bed_released = self.env.event()
+
+    # The patient arrival rate changes over the day, with one rate in hours 
+    # (00:00 to 16:00) and a lower rate out of hours (16:00 to 24:00). This 
+    # method returns the rate table for a single day, each row gives the start
+    # and end of a window in minutes, the arrival rate (patients per minute) in
+    # that window and the generator number recorded against the patient.
+
+    def arrival_rate_table(self):
+        return [(0, 960, 1.0 / self.config.patient_inter_day, 1),
+                (960, 1440, 0.25 / self.config.patient_inter_night, 2)]
+
+    # A generator function for the patient arrivals. Arrivals follow a Poisson
+    # process with a rate that changes with the time of day, the time of the 
+    # next arrival is found by sampling an amount of "work" from an exponential
+    # distribution and using it up window by window at each window's rate. This
+    # means the generator only wakes up when a patient arrives, rather than 
+    # every minute while it is outside of its window. If an arrival log is 
+    # replayed the arrival times are taken from the log instead, and the 
+    # window is the one the arrival time falls in.
 
-        # a list that will store the number of patients in the SDEC
-        self.sdec_occupancy = []
-
-        # A list that will store the number of admissions avoided
-        self.admission_avoidance = []
-
-        # A list that will store the number of patients in the ward
-        self.ward_occupancy = []
-        
-        # A list to store the number of patients avoiding admission
-        self.non_admissions = []
+    def generator_patient_arrivals(self):
 
-        self.occupancy_graph_df = pd.DataFrame()
-        self.occupancy_graph_df["Time"] = [0.0]
-        self.occupancy_graph_df["Ward Occupancy"] = [0.0]
+        rate_table = self.arrival_rate_table()
+        day_length = rate_table[-1][1]
+        replay_trace = self.config.arrival_trace is not None
 
-    # A generator function for the patient arrivals in hours.
-    def generator_patient_arrivals(self):
+        if replay_trace == False and \
+            not any(rate > 0 for _, _, rate, _ in rate_table):
+            return
 
         while True:
 
-            if 0 <= self.env.now % 1440 < 960:
+            if replay_trace == True:
+                time = self.sampler.next_trace_arrival()
+                for start, end, rate, generator in rate_table:
+                    if end > time % day_length:
+                        break
+
+            else:
+                work = self.sampler.next_arrival_work()
+                time = self.env.now
+
+                while True:
+                    day_start = time - time % day_length
+                    for start, end, rate, generator in rate_table:
+                        if day_start + end > time:
+                            break
+                    
+                    window_end = day_start + end
+                    if rate > 0 and work <= rate * (window_end - time):
+                        time += work / rate
+                        break
 
-                # Change the Global Class variable for the generator to TRUE
-                g.patient_arrival_gen_1 = True
-                g.patient_arrival_gen_2 = False
+                    work -= rate * (window_end - time)
+                    time = window_end
 
-                # Increment the patient counter by 1 for each new patient
-                self.patient_counter += 1
-                
-                # Create a new patient - an instance of the Patient Class we
-                # defined above. patient counter ID passed from above to patient 
-                # class.
-                p = Patient(self.patient_counter)
+            # Freeze this instance of this function in place until the
+            # arrival time has been reached.
+            yield self.env.timeout(time - self.env.now)
 
-                # Tell SimPy to start the stroke assessment function with
-                # this patient (the generator function that will model the
-                # patient's journey through the system)
-                self.env.process(self.stroke_assessment(p))
+            self.add_patient(generator)
 
-                sampled_inter = random.expovariate(1.0 / g.patient_inter_day)
+    # A generator function for the arrivals of a single window of the rate 
+    # table, used when each window opens with an arrival (see 
+    # window_opening_arrivals in the g class). As in the original model's 
+    # generators, the window has an arrival as soon as the generator finds 
+    # it open, and the next arrival is drawn at the window's rate. An arrival
+    # that falls outside of the window is lost, and the generator waits for 
+    # the window to open again in steps of whole minutes.
 
-                # Freeze this instance of this function in place until the
-                # inter-arrival time has elapsed.
-                yield self.env.timeout(sampled_inter)
+    def generator_window_arrivals(self, window):
 
-            else:
-                yield self.env.timeout(1)
-                
-    # A generator function for the patient arrivals out of hours. 
-    def generator_patient_arrivals_ooh(self):
+        rate_table = self.arrival_rate_table()
+        day_length = rate_table[-1][1]
+        start, end, rate, generator = rate_table[window]
 
         while True:
+            wait = self.window_wait(self.env.now, start, end, day_length)
+            if wait > 0:
+                yield self.env.timeout(wait)
 
-            if 960 <= self.env.now % 1440 < 1440:
+            self.add_patient(generator)
 
-                # Change the Global Class variable for the generator to TRUE
-                g.patient_arrival_gen_1 = False
-                g.patient_arrival_gen_2 = True
+            yield self.env.timeout(
+                self.sampler.next_window_arrival_work(window) / rate)
 
-                # Increment the patient counter by 1 for each new patient
-                self.patient_counter += 1
-                
-                # Create a new patient - an instance of the Patient Class we
-                # defined above. patient counter ID passed from above to patient 
-                # class.
-                p = Patient(self.patient_counter)
+    # Returns how long, from the time given, the generator of a window waits
+    # to find it open. The original generators checked the window once a 
+    # minute, so the wait is the whole minutes it takes to reach the window.
 
-                # Tell SimPy to start the stroke assessment function with
-                # this patient (the generator function that will model the
-                # patient's journey through the system)
-                self.env.process(self.stroke_assessment(p))
+    @staticmethod
+    def window_wait(time, start, end, day_length):
+        wait = 0
+        while not start <= (time + wait) % day_length < end:
+            wait += math.ceil((start - (time + wait)) % day_length)
+        return wait
 
-                sampled_inter = random.expovariate(0.25 / 
-                                                   g.patient_inter_night)
+    # Adds a new patient that arrived in the window with the generator number
+    # given, and starts their pathway.
 
-                # Freeze this instance of this function in place until the
-                # inter-arrival time has elapsed.
-                yield self.env.timeout(sampled_inter)
+    def add_patient(self, generator):
 
-            else:
-                yield self.env.timeout(1)
+        # Change the model's generator variables to show 
+        # which window the patient arrived in.
+        self.patient_arrival_gen_1 = generator == 1
+        self.patient_arrival_gen_2 = generator == 2
+
+        # Increment the patient counter by 1 for each new patient
+        self.patient_counter += 1
+        
+        # Add a new patient to the patient table, the patient counter is
+        # used as the patient ID.
+        row = self.patients.add(self.patient_counter, 
+                                self.sampler.next_patient())
+
+        # Tell SimPy to start the stroke assessment function with
+        # this patient's ID and row (the generator function that will model
+        # the patient's journey through the system)
+        self.env.process(self.stroke_assessment(self.patient_counter, row))
                 
     def obstruct_ctp(self):
-        while True:
-            yield self.env.timeout(g.ctp_unav_freq)
+
+        # If the CTP scanner is never closed there is nothing for this 
+        # generator to do. This also stops the generator looping forever 
+        # without time passing when both of its values are zero. The check is
+        # made every day, as the config can be changed at the end of a shared
+        # warm up (see change_config).
+        
+        while self.config.ctp_unav_time != 0:
+            yield self.env.timeout(self.config.ctp_unav_freq)
             # Once elapsed, this generator requests the ctp scanner with
             # a priority of -1. As the patient priority is set at 1
             # the scanner will take priority over any patients waiting. 
             # This method also means that the scanner won't stop mid scan. 
-            g.ctp_unav = True    
+            self.ctp_unav = True    
             with self.ctp_scanner.request(priority=-1) as req:
                 yield req
                     
@@ -342,16 +1959,23 @@ class Model:
                 # time, in the model this means patients admitted in this time 
                 # will not have a ctp scan.  
                 # freq and unav times are set in the g class
-                yield self.env.timeout(g.ctp_unav_time)
-                g.ctp_unav = False
+                yield self.env.timeout(self.config.ctp_unav_time)
+                self.ctp_unav = False
     
     def obstruct_sdec(self):
-        while True:
-            yield self.env.timeout(g.sdec_unav_freq)
+
+        # If the SDEC is never closed there is nothing for this generator 
+        # to do. This also stops the generator looping forever without time 
+        # passing when both of its values are zero. The check is made every 
+        # day, as the config can be changed at the end of a shared warm up (see
+        # change_config).
+        
+        while self.config.sdec_unav_time != 0:
+            yield self.env.timeout(self.config.sdec_unav_freq)
             # Once elapsed, this generator requests the SDEC with
             # a priority of -1. As the patient priority is set at 1
             # the SDEC will take priority over any patients waiting.  
-            g.sdec_unav = True  
+            self.sdec_unav = True  
             with self.sdec_bed.request(priority=-1) as req:
                 yield req
                     
@@ -359,9 +1983,9 @@ class Model:
                 # time, in the model this means patients admitted in this time 
                 # will not have passed through the SDEC.  
                 # freq and unav times are set in the g class
-                yield self.env.timeout(g.sdec_unav_time)
-                g.sdec_unav = False
-                if self.env.now > g.warm_up_period:
+                yield self.env.timeout(self.config.sdec_unav_time)
+                self.sdec_unav = False
+                if self.recorder.recording() == True:
                     self.sdec_freeze_counter += 1
     
     # A generator function that represents the pathway for a patient going
@@ -369,96 +1993,52 @@ class Model:
     # The patient object is passed in to the generator function so we can 
     # extract information from / record information to it
 
-    def stroke_assessment(self, patient):
+    def stroke_assessment(self, patient, row):
 
-        # This code introduces a slight element of randomness into the patient's
-        # diagnosis.
+        # The patient is passed in as their ID, their attributes are stored in
+        # the given row of the patient table.
 
-        self.ich_range = random.normalvariate(g.ich, 1)
-        self.i_range = max(random.normalvariate(g.i, 1), self.ich_range)
-        self.tia_range = max(random.normalvariate(g.tia, 1), self.i_range)
-        self.stroke_mimic_range = max(random.normalvariate(g.stroke_mimic, 1), 
-                                      self.tia_range)
-        self.non_stroke_range = max(random.normalvariate(g.stroke_mimic, 1), 
-                                    self.stroke_mimic_range)
-        
-        if patient.diagnosis <= self.ich_range:
-            patient.patient_diagnosis = 0
-        elif patient.diagnosis <= self.i_range:
-            patient.patient_diagnosis = 1
-        elif patient.diagnosis <= self.tia_range:
-            patient.patient_diagnosis = 2
-        elif patient.diagnosis <= self.stroke_mimic_range:
-            patient.patient_diagnosis = 3
-        else: patient.patient_diagnosis = 4
-
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diangosis Value"] = (
-                patient.diagnosis)
-
-
-        # This block of code assigns the patient a MRS based on the range set 
-        # in the patient class. This currently differs from the above which 
-        # uses an element of randomness to assign a diangois, this code looks
-        # only at the G class.
-
-        if patient.patient_diagnosis == 1:
-
-            if patient.mrs_type <= g.mrs_i_0:
-                patient.mrs_type = 0
-            elif patient.mrs_type <= g.mrs_i_1:
-                patient.mrs_type = 1
-            elif patient.mrs_type <= g.mrs_i_2:
-                patient.mrs_type = 2
-            elif patient.mrs_type <= g.mrs_i_3:
-                patient.mrs_type = 3
-            elif patient.mrs_type <= g.mrs_i_4:
-                patient.mrs_type = 4
-            elif patient.mrs_type <= g.mrs_i_5:
-                patient.mrs_type = 5                
-            else: patient.mrs_type = 6
-
-        elif patient.patient_diagnosis == 0:
-
-            if patient.mrs_type <= g.mrs_ich_0:
-                patient.mrs_type = 0
-            elif patient.mrs_type <= g.mrs_ich_1:
-                patient.mrs_type = 1
-            elif patient.mrs_type <= g.mrs_ich_2:
-                patient.mrs_type = 2
-            elif patient.mrs_type <= g.mrs_ich_3:
-                patient.mrs_type = 3
-            elif patient.mrs_type <= g.mrs_ich_4:
-                patient.mrs_type = 4
-            elif patient.mrs_type <= g.mrs_ich_5:
-                patient.mrs_type = 5
-            else: patient.mrs_type = 6
-
-        elif patient.patient_diagnosis > 1:
-
-            patient.mrs_type = 7
+        patients = self.patients
+
+        # The patient's diagnosis and MRS were found from the lookup tables 
+        # when their values were drawn (see PatientLookupTables), they don't 
+        # change during the patient's journey so they are kept in variables.
+
+        patient_diagnosis = int(patients.patient_diagnosis[row])
+        mrs_type = int(patients.mrs_type[row])
+
+        # Values are only stored by the recorder once the warm up period has
+        # passed (see ResultsRecorder).
+
+        self.recorder.record(patient, "Diangosis Value", 
+                             patients.diagnosis[row])
 
         # Record the time the patient started queuing for a nurse
         start_q_nurse = self.env.now
 
-        self.q_for_assessment.append(patient)
+        # The queue length on arrival is used for the time weighted queue 
+        # length, but as in the original model the graph series only has the
+        # queue length when a patient starts with a nurse.
+
+        self.q_for_assessment += 1
+        self.nurse_q_monitor.record(self.env.now, self.q_for_assessment, 
+                                    store=False)
 
         # Add the arrival time to the main DF, this is mainly to test if the 
         # patinet arrival times mirror the real world data 
 
-        patient.clock_start = self.env.now
-
+        patients.clock_start[row] = self.env.now
 
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Arrival Time"] = (
-                patient.clock_start)
-            
-            self.results_df.at[patient.id, "Patient Gen 1 Status"] = (
-                g.patient_arrival_gen_1)
-            
-            self.results_df.at[patient.id, "Patient Gen 2 Status"] = (
-                g.patient_arrival_gen_2)
+        self.recorder.record(patient, "Arrival Time",
+            patients.clock_start[row])
+        
+        self.recorder.record(patient, "Patient Gen 1 Status",
+            self.patient_arrival_gen_1)
+        
+        self.recorder.record(patient, "Patient Gen 2 Status",
+            self.patient_arrival_gen_2)
 
+        # Profiler stage: nurse queue
         # This code says request a nurse resource, and do all of the following
         # block of code with that nurse resource held in place (and therefore
         # not usable by another patient)
@@ -469,61 +2049,57 @@ class Model:
 
             # Control is passed back to the generator function once the request
             # is met for a nurse. As the queue for the nurse is finished 
-            # the patient then leaves the assessment queue list.
+            # the patient then leaves the assessment queue count.
             
             end_q_nurse = self.env.now
 
-            self.q_for_assessment.remove(patient)
+            self.q_for_assessment -= 1
 
-            # The code below checks if the warm up period has passed before 
-            # entering data into the df, this code exists when ever data is 
-            # recorded  
+            # The monitor only stores values once the warm up period has 
+            # passed.
 
-            if self.env.now > g.warm_up_period:
-                self.nurse_q_graph_df.loc[len(self.nurse_q_graph_df)] = [
-                    self.env.now,
-                    len(self.q_for_assessment)]
+            self.nurse_q_monitor.record(self.env.now, self.q_for_assessment)
 
             # Calculate the time this patient was queuing for the nurse, and
             # record it in the patient's attribute
-            patient.q_time_nurse = end_q_nurse - start_q_nurse
+            patients.q_time_nurse[row] = end_q_nurse - start_q_nurse
 
             # The below code creates a random action time for the nurse based 
             # on the mean in g class, and assigns it ot a variable. Currently 
             # using a Exponential distribution but might need to switch to 
             # a Log normal one (though the intense variation in the real life
             # consult time might mean a exponetial distribution is better)
-            sampled_nurse_act_time = random.expovariate(1.0 / 
-                                                        g.mean_n_consult_time)
+            sampled_nurse_act_time = (self.config.mean_n_consult_time *
+                                      patients.nurse_time_draw[row])
                 
+            # Profiler stage: nurse assessment
             # Freeze this function in place for the activity time we sampled
             # above.  This is the patient spending time with the nurse.
             yield self.env.timeout(sampled_nurse_act_time)
 
-            # In the .at function below, the first value is the row, the second
-            # value is the column in which to add data. The final value is the 
-            # the data that is to be added to the DF, in this case the Nurse 
-            # Q time
+            # The first value below is the patient, the second is the column
+            # in which to add data. The final value is the data that is to be 
+            # added, in this case the Nurse Q time
 
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "Q Time Nurse"] = (
-                    patient.q_time_nurse)
-                self.results_df.at[patient.id, "Time with Nurse"] = (
-                    sampled_nurse_act_time)
+            self.recorder.record(patient, "Q Time Nurse",
+                patients.q_time_nurse[row])
+            self.recorder.record(patient, "Time with Nurse",
+                sampled_nurse_act_time)
 
+        # Profiler stage: CT / CTP
         # The if formula below checks to see if the CTP scanner is active 
         # and if it is the following code is followed including updating the 
         # patient advanced CT pathway attribute
         
-        if g.ctp_unav == False:
+        if self.ctp_unav == False:
         
-            patient.advanced_ct_pathway = True
+            patients.advanced_ct_pathway[row] = True
         
             # Randomly sample the mean ct time, as with above this may need to 
             # be updated to a log normal distribution 
 
-            sampled_ctp_act_time = random.expovariate(1.0 / 
-                                                        g.mean_n_ct_time)
+            sampled_ctp_act_time = (self.config.mean_n_ct_time *
+                                    patients.ct_time_draw[row])
             
             # Freeze this function in place for the activity time that was 
             # sampled above.
@@ -531,8 +2107,7 @@ class Model:
 
             # Add data to the DF afer the warm up period.
 
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "Time with CTP"] = (
+            self.recorder.record(patient, "Time with CTP",
                 sampled_ctp_act_time)
 
         # If the CTP pathway is not active the below code runs, it is the same 
@@ -541,183 +2116,114 @@ class Model:
 
         else:
 
-            sampled_ct_act_time = random.expovariate(1.0 / 
-                                                        g.mean_n_ct_time)
+            sampled_ct_act_time = (self.config.mean_n_ct_time *
+                                   patients.ct_time_draw[row])
                 
             yield self.env.timeout(sampled_ct_act_time)    
 
-
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "Time with CT"] = (
+            self.recorder.record(patient, "Time with CT",
                 sampled_ct_act_time)   
 
         # The below code records the status of both the CTP pathway.
         # Both exist as generators and this data is record to ensure they are 
         # operating as expected.
 
-        if self.env.now > g.warm_up_period: 
-            self.results_df.at[patient.id, "CTP Status"] = (
-            g.ctp_unav)
+        self.recorder.record(patient, "CTP Status",
+            self.ctp_unav)
 
         # The below code checks the patient's attributes to see if the 
         # thrombolysis attribute should be changed to True, this is based off 
         # the patient diagnosis, onset type and mrs type. There are different 
         # conditions depending on if CTP is available or not.
 
-        if patient.patient_diagnosis == 1 and patient.onset_type == 0 \
-            and patient.mrs_type > 0:
-            patient.thrombolysis = True
+        if patient_diagnosis == 1 and patients.onset_type[row] == 0 \
+            and mrs_type > 0:
+            patients.thrombolysis[row] = True
 
-        if patient.patient_diagnosis == 1 and patient.onset_type == 1 and\
-              patient.advanced_ct_pathway == True and patient.mrs_type > 0:
-            patient.thrombolysis = True
+        if patient_diagnosis == 1 and patients.onset_type[row] == 1 and\
+              patients.advanced_ct_pathway[row] == True and mrs_type > 0:
+            patients.thrombolysis[row] = True
 
         # Thrombolysis status is added to the DF, this is mainly used to check 
         # if it is being applied correctly.
 
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Thrombolysis"] = (
-                patient.thrombolysis)
+        self.recorder.record(patient, "Thrombolysis",
+            patients.thrombolysis[row])
+
+        # The ward LOS for the patient's diagnosis and MRS was found from the
+        # lookup tables when their values were drawn.
+
+        sampled_ward_act_time = float(patients.sampled_ward_time[row])
 
         # The below code records the status of both the SDEC pathway.
         # Both exist as generators and this data is record to ensure they are 
         # operating as expected.
-
-        if patient.patient_diagnosis == 0 and patient.mrs_type == 0:
-            sampled_ward_act_time = random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_0)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 1:
-            sampled_ward_act_time = random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_1)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 2:
-            sampled_ward_act_time = random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_2)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 3:
-            sampled_ward_act_time = min(random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_3), 1440 * 81)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 4:
-            sampled_ward_act_time = min(random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_4), 1440 * 120)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 5:
-            sampled_ward_act_time = min(random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_5), 1440 * 130)
-
-        elif patient.patient_diagnosis == 0 and patient.mrs_type == 6:
-            sampled_ward_act_time = random.expovariate\
-                (1.0 / g.mean_n_ich_ward_time_mrs_6)
-
-        # The below code checks the patients diagnosis and MRS,
-        # adjusting LOS baised on these. This code is 
-        # for I patients amd also checks for thrombolysis and adjusts 
-        # LOS and associated savings accordingly. 
-        
-        if patient.patient_diagnosis == 1 and patient.mrs_type == 0:
-            sampled_ward_act_time = random.expovariate\
-                (1.0/ g.mean_n_i_ward_time_mrs_0)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 1:
-            sampled_ward_act_time = random.expovariate\
-            (1.0 / g.mean_n_i_ward_time_mrs_1)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 2:
-            sampled_ward_act_time = random.expovariate\
-            (1.0 / g.mean_n_i_ward_time_mrs_2)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 3:
-            sampled_ward_act_time = min(random.expovariate\
-            (3.0 / g.mean_n_i_ward_time_mrs_3), 1440 * 70)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 4:
-            sampled_ward_act_time = min(random.expovariate\
-            (1.0 / g.mean_n_i_ward_time_mrs_4), 1440 * 140)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 5:
-            sampled_ward_act_time = random.expovariate\
-            (2.0 / g.mean_n_i_ward_time_mrs_5)
-
-        elif patient.patient_diagnosis == 1 and patient.mrs_type == 6:
-            sampled_ward_act_time = random.expovariate\
-            (1.0 / g.mean_n_i_ward_time_mrs_6)
-
-    # The below code is for the non stroke diagnosis.
-
-        elif patient.patient_diagnosis == 2:
-            sampled_ward_act_time = random.expovariate\
-                (3.0 / g.mean_n_tia_ward_time)
-        
-        elif patient.patient_diagnosis > 2:
-            sampled_ward_act_time = random.expovariate\
-                (3.0 / g.mean_n_non_stroke_ward_time)
             
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "SDEC Status"] = (
-            g.sdec_unav)
+        self.recorder.record(patient, "SDEC Status",
+            self.sdec_unav)
 
         # This code is used to check the flow of patients through the model, to 
         # ensure no patients are being lost.
 
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Patient Flow Check 1"] = ("Yes")
+        self.recorder.record(patient, "Patient Flow Check 1", "Yes")
 
+        # Profiler stage: SDEC stay
         # The if statement below checks if the SDEC pathway is active at this 
         # given time and if there is space in the SDEC itself.
         
-        if g.sdec_unav == False and len(self.sdec_occupancy) < g.sdec_beds:
+        if self.sdec_unav == False and \
+            self.sdec_occupancy < self.config.sdec_beds:
                 
             # If the conditions above are met the patient attribute for the SDEC
             # are changed to True and the patient is added to the SDEC occupancy
-            # list.
+            # count.
 
-            self.sdec_occupancy.append(patient)
+            self.sdec_occupancy += 1
 
             # The below code record the SDEC Occupancy as the patient passes 
             # this point to ensure it is working as expected.
 
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "SDEC Occupancy"] = (
-                len(self.sdec_occupancy))
+            self.recorder.record(patient, "SDEC Occupancy",
+                self.sdec_occupancy)
 
-            patient.sdec_pathway = True
+            patients.sdec_pathway[row] = True
 
             # This code checks if the patient is eligible for admission  
             # avoidance depending on if therapy support is enabled.
 
-            if g.therapy_sdec == False:  
+            if self.config.therapy_sdec == False:  
             
-                if patient.patient_diagnosis < 2  and patient.mrs_type < 2\
-                      and patient.thrombolysis == False:
+                if patient_diagnosis < 2  and mrs_type < 2\
+                      and patients.thrombolysis[row] == False:
                 
-                    patient.admission_avoidance = True
+                    patients.admission_avoidance[row] = True
 
-            elif g.therapy_sdec == True:
+            elif self.config.therapy_sdec == True:
             
-                if patient.patient_diagnosis < 2 and patient.mrs_type <= 3\
-                      and patient.thrombolysis == False:
+                if patient_diagnosis < 2 and mrs_type <= 3\
+                      and patients.thrombolysis[row] == False:
                 
-                    patient.admission_avoidance = True
+                    patients.admission_avoidance[row] = True
             
             # This code applies a non stroke admission avoidance variable to the
             # patient.
 
-            self.tia_admission_chance = random.normalvariate(g.tia_admission, 1)
-            self.stroke_mimic_admission_chance = random.normalvariate(
-                g.stroke_mimic_admission, 1)
+            self.tia_admission_chance = (self.config.tia_admission + 
+                patients.admission_chance_noise[row, 0])
+            self.stroke_mimic_admission_chance = (
+                self.config.stroke_mimic_admission + 
+                patients.admission_chance_noise[row, 1])
 
-            if patient.non_admission >= self.tia_admission_chance and \
-                patient.patient_diagnosis == 2:
-                patient.admission_avoidance = True
+            if patients.non_admission[row] >= \
+                self.tia_admission_chance and patient_diagnosis == 2:
+                patients.admission_avoidance[row] = True
 
-            elif patient.non_admission >= self.stroke_mimic_admission_chance\
-                  and patient.patient_diagnosis > 2:
-                patient.admission_avoidance = True           
+            elif patients.non_admission[row] >= \
+                self.stroke_mimic_admission_chance and patient_diagnosis > 2:
+                patients.admission_avoidance[row] = True           
 
-            sampled_sdec_stay_time = random.expovariate(1.0 / 
-                                                        g.mean_n_sdec_time)
+            sampled_sdec_stay_time = (self.config.mean_n_sdec_time *
+                                      patients.sdec_time_draw[row])
             
             # Freeze this function in place for the activity time we sampled
             # above.
@@ -726,126 +2232,146 @@ class Model:
             # This code checks if the ward is full, if this is the case the 
             # patient will not be released from the SDEC, thus impeding it use  
 
-            # Need to add a new block of code for discharging patients from the
-            # SDEC when the ward is full (thinking of measuring the amount of 
-            # time the patient is "yield" and subtracting that from the LOS)
+            # Profiler stage: SDEC yield loop
+            # The time the patient is held in the SDEC is measured and taken 
+            # off their ward LOS. The patient waits until a ward bed is 
+            # released or until they have been held for their whole LOS, 
+            # whichever happens first. The old method of checking the ward 
+            # every minute can still be used by setting g.ward_bed_polling.
+
+            # The time out for the whole LOS is made once, when the patient 
+            # starts to be held, and is waited on again each time a ward bed 
+            # is released while the ward is still full.
+
+            if patients.admission_avoidance[row] != True:
 
-            if patient.admission_avoidance != True:
+                if self.config.ward_bed_polling != True and \
+                    self.ward_occupancy >= self.config.number_of_ward_beds:
+                    yield_time_out = self.env.timeout(sampled_ward_act_time -
+                        patients.sdec_yield_count[row])
 
-                while len(self.ward_occupancy) >= g.number_of_ward_beds and \
-                    patient.sdec_yield_count < sampled_ward_act_time:
-                    yield self.env.timeout(1)
-                    patient.sdec_yield_count += 1
+                while self.ward_occupancy >= \
+                    self.config.number_of_ward_beds and \
+                    patients.sdec_yield_count[row] < sampled_ward_act_time:
+
+                    if self.config.ward_bed_polling == True:
+                        yield self.env.timeout(1)
+                        patients.sdec_yield_count[row] += 1
+                        continue
+
+                    start_yield = self.env.now
+                    
+                    yield self.ward_bed_released | yield_time_out
+
+                    if yield_time_out.processed:
+                        patients.sdec_yield_count[row] = \
+                            sampled_ward_act_time
+                    else:
+                        patients.sdec_yield_count[row] += \
+                            self.env.now - start_yield
             
-            if patient.sdec_yield_count >= sampled_ward_act_time:
-                patient.sdec_admission_time_out = True
+            if patients.sdec_yield_count[row] >= sampled_ward_act_time:
+                patients.sdec_admission_time_out[row] = True
 
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "SDEC Yield Count"] = (
-                    patient.sdec_yield_count)
-                self.results_df.at[patient.id, "Sampled LOS"] = \
-                      (sampled_ward_act_time)
+            self.recorder.record(patient, "SDEC Yield Count",
+                patients.sdec_yield_count[row])
+            self.recorder.record(patient, "Sampled LOS",
+                sampled_ward_act_time)
 
             # Once the above code is complete the patient is removed from the 
-            # SDEC occupancy list.
+            # SDEC occupancy count.
 
-            self.sdec_occupancy.remove(patient)
+            self.sdec_occupancy -= 1
 
             # Code to record the SDEC stay time in the results DataFrame.
 
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "Time in SDEC"] =\
-                      (sampled_sdec_stay_time)
+            self.recorder.record(patient, "Time in SDEC",
+                sampled_sdec_stay_time)
 
         sampled_ward_act_time = sampled_ward_act_time - \
-                patient.sdec_yield_count
+                patients.sdec_yield_count[row]
 
         # The below code records the patients diagnosis attribute, this is added
         # to the DF to check the diagnosis code is working correctly.
 
-        if patient.patient_diagnosis == 0 and self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diagnosis Type"] = "ICH"
-        elif patient.patient_diagnosis == 1 and self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diagnosis Type"] = "I"
-        elif patient.patient_diagnosis == 2 and self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diagnosis Type"] = "TIA"
-        elif patient.patient_diagnosis == 3 and self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diagnosis Type"] = "Stroke Mimic"
-        elif patient.patient_diagnosis == 4 and self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Diagnosis Type"] = "Non Stroke"
+        if patient_diagnosis == 0:
+            self.recorder.record(patient, "Diagnosis Type", "ICH")
+        elif patient_diagnosis == 1:
+            self.recorder.record(patient, "Diagnosis Type", "I")
+        elif patient_diagnosis == 2:
+            self.recorder.record(patient, "Diagnosis Type", "TIA")
+        elif patient_diagnosis == 3:
+            self.recorder.record(patient, "Diagnosis Type", "Stroke Mimic")
+        elif patient_diagnosis == 4:
+            self.recorder.record(patient, "Diagnosis Type", "Non Stroke")
         
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Onset Type"] = (
-            patient.onset_type)
+        self.recorder.record(patient, "Onset Type",
+            patients.onset_type[row])
 
         # This code add information regarding the patients admission avoidance.
   
-        if patient.admission_avoidance == True and patient.patient_diagnosis\
+        if patients.admission_avoidance[row] == True and patient_diagnosis\
               < 2:
             
-            if self.env.now > g.warm_up_period:
-                self.results_df.at[patient.id, "Admission Avoidance"] = (
-                patient.sdec_pathway)
+            if self.recorder.recording() == True:
+                self.recorder.record(patient, "Admission Avoidance",
+                patients.sdec_pathway[row])
 
-                last_index = self.results_df\
-                    ["SDEC Savings"].last_valid_index()
-                last_value = self.results_df.loc[last_index, "SDEC Savings"]
-                if last_index > 0 and pd.notnull:
-                    self.results_df.at[patient.id, "SDEC Savings"] = \
-                        (last_value + g.inpatient_bed_cost)
+                # The SDEC savings column is a running total, so the last 
+                # recorded value is carried forward and the bed cost added.
 
-                else:
-                    self.results_df.at[patient.id, "SDEC Savings"] = \
-                        (g.inpatient_bed_cost)
+                last_value = self.recorder.last_valid("SDEC Savings")
+                self.recorder.record(patient, "SDEC Savings",
+                    last_value + self.config.inpatient_bed_cost)
 
         # This code adds the Patient's MRS to the DF, this can be used to check
         # all code that interacts with this runs correctly.
 
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "MRS Type"] = (
-            patient.mrs_type)
+        self.recorder.record(patient, "MRS Type",
+            mrs_type)
 
         # This code is used to check the flow of patients through the model, to 
         # ensure no patients are being lost.
 
-        if self.env.now > g.warm_up_period:
-            self.results_df.at[patient.id, "Patient Flow Check 2"] = ("Yes")
+        self.recorder.record(patient, "Patient Flow Check 2", "Yes")
 
-        # Patients with a True admission avoidance are added to a list that is 
+        # Patients with a True admission avoidance are added to a count that is 
         # used to calculate the savings from the avoided admissions. 
 
-        if patient.admission_avoidance == True and patient.patient_diagnosis \
-              < 2 and self.env.now > g.warm_up_period:
-            self.admission_avoidance.append(patient)
+        if patients.admission_avoidance[row] == True and patient_diagnosis \
+              < 2 and self.recorder.recording() == True:
+            self.admission_avoidance += 1
 
         # This code introduces a small element of randomness into the admission
         # rates for the non stroke, tia and stroke mimic patients.
 
-        self.tia_admission_chance = random.normalvariate(g.tia_admission, 1)
-        self.stroke_mimic_admission_chance = random.normalvariate(
-            g.stroke_mimic_admission, 1)
+        self.tia_admission_chance = (self.config.tia_admission + 
+            patients.admission_chance_noise[row, 2])
+        self.stroke_mimic_admission_chance = (
+            self.config.stroke_mimic_admission + 
+            patients.admission_chance_noise[row, 3])
         
         # This code exists after the admission avoidance code so they are not 
-        # added to the admission avoidance list, as that should only be for 
+        # added to the admission avoidance count, as that should only be for 
         # SDEC patients who avoid admission. This code checks if TIA, non stroke
         # and stroke mimic patients should be admitted based on the values 
         # established in the previous code and g class.
 
-        if patient.non_admission >= self.tia_admission_chance and \
-            patient.patient_diagnosis == 2:
-            patient.admission_avoidance = True
+        if patients.non_admission[row] >= self.tia_admission_chance and \
+            patient_diagnosis == 2:
+            patients.admission_avoidance[row] = True
 
-        elif patient.non_admission >= self.stroke_mimic_admission_chance and \
-            patient.patient_diagnosis > 2:
-            patient.admission_avoidance = True            
+        elif patients.non_admission[row] >= \
+            self.stroke_mimic_admission_chance and patient_diagnosis > 2:
+            patients.admission_avoidance[row] = True            
 
         # once all the above code has been run all patients who will not admit
         # have a True admission avoidance attribute. For all the patients that 
         # remain false, the below code will run simulating the admission to the 
         # ward.
 
-        if patient.admission_avoidance != True and \
-              patient.sdec_admission_time_out != True:
+        if patients.admission_avoidance[row] != True and \
+              patients.sdec_admission_time_out[row] != True:
 
             # These code assigns a time to the start q variable. In stroke care
             # delays can have serious consequence so modeling this is very
@@ -853,6 +2379,7 @@ class Model:
 
             start_q_ward = self.env.now
 
+            # Profiler stage: ward queue
             # Request the ward bed and hold the patient in a queue until this 
             # is met.
 
@@ -860,112 +2387,159 @@ class Model:
 
                 yield req
 
-                # Add patient to the ward list
+                # Add patient to the ward count
 
-                self.ward_occupancy.append(patient)
+                self.ward_occupancy += 1
 
-                if self.env.now > g.warm_up_period:
-                    self.results_df.at[patient.id, "Ward Occupancy"] = (
-                    len(self.ward_occupancy))
+                self.recorder.record(patient, "Ward Occupancy",
+                    self.ward_occupancy)
 
-                if self.env.now > g.warm_up_period:
-                    self.occupancy_graph_df.loc[len(self.occupancy_graph_df)] =\
-                        [self.env.now,
-                    len(self.ward_occupancy)]
+                self.ward_occupancy_monitor.record(self.env.now,
+                                                   self.ward_occupancy)
 
                 # The patient attribute for the queuing time in the ward is 
                 # assigned here.
 
                 end_q_ward = self.env.now
 
-                patient.q_time_ward = end_q_ward - start_q_ward
+                patients.q_time_ward[row] = end_q_ward - start_q_ward
 
+                # Profiler stage: ward stay
                 # The below code checks the patients diagnosis and MRS,
                 # adjusting LOS baised on these. This code is 
                 # for ICH patients. 
 
-                if patient.thrombolysis == True:
+                if patients.thrombolysis[row] == True:
                     sampled_ward_act_time_thrombolysis = \
-                            sampled_ward_act_time * g.thrombolysis_los_save
+                            sampled_ward_act_time * \
+                            self.config.thrombolysis_los_save
                     yield self.env.timeout(\
                         sampled_ward_act_time_thrombolysis)
-                    if self.env.now > g.warm_up_period and\
-                            patient.advanced_ct_pathway == True:
-                        self.results_df.at[patient.id,\
-                        "Thrombolysis Savings"] = (((sampled_ward_act_time\
+                    if patients.advanced_ct_pathway[row] == True:
+                        self.recorder.record(patient,\
+                        "Thrombolysis Savings", (((sampled_ward_act_time\
                         - sampled_ward_act_time_thrombolysis)/60)/24)*\
-                        g.inpatient_bed_cost_thrombolysis
-                    self.ward_occupancy.remove(patient)
+                        self.config.inpatient_bed_cost_thrombolysis)
+                    self.ward_occupancy -= 1
                 else:
                     yield self.env.timeout(sampled_ward_act_time)
-                    self.ward_occupancy.remove(patient)                
+                    self.ward_occupancy -= 1                
+
+                # The ward occupancy is also recorded when the patient leaves,
+                # so the monitor follows the occupancy between admissions.
+
+                self.ward_occupancy_monitor.record(self.env.now,
+                                                   self.ward_occupancy)
+
+            # The bed has now been released, so any patients waiting in the 
+            # SDEC are told. This is done after the bed is released so patients
+            # already queuing for a bed are given it first.
+
+            self.release_ward_bed()
 
             # Relevent information is recorded in the results DataFrame.
 
-            if self.env.now > g.warm_up_period:
-                    self.results_df.at[patient.id, "Q Time Ward"] = (
-                    patient.q_time_ward)
-                    self.results_df.at[patient.id, "Ward LOS"] = (
-                    sampled_ward_act_time)
+            self.recorder.record(patient, "Q Time Ward",
+                patients.q_time_ward[row])
+            self.recorder.record(patient, "Ward LOS",
+                sampled_ward_act_time)
+
+        # The patient has completed their journey, so their results can be 
+        # written to the results log.
+
+        self.recorder.complete(patient)
+        self.patients.free(row)
+
+    # This method triggers the ward bed released event for any patients waiting
+    # in the SDEC. If no patients are waiting there is nothing to trigger.
+
+    def release_ward_bed(self):
+        if self.ward_bed_released.callbacks:
+            self.ward_bed_released.succeed()
+            self.ward_bed_released = self.env.event()
+
+    # The columns of the results DataFrame used to calculate the results of
+    # a run.
+
+    result_columns = ["Q Time Nurse", "Q Time Ward", "Ward Occupancy", 
+                      "Ward LOS", "Thrombolysis Savings"]
 
     # This method calculates results over a single run.
     
     def calculate_run_results(self):
        
-        # Drop the first row of the results DataFrame, as this is just a dummy
-        # and will take on the value of zero.
-        self.results_df.drop([1], inplace=True)
+        # Build the results DataFrame from the recorder, this is the only point
+        # in the run where the per patient results are turned into pandas. If
+        # the results were written to a results log, only the columns needed
+        # for the results below are read back.
+        if self.results_log_path is None:
+            self.results_df = self.recorder.to_frame()
+            results_df = self.results_df
+        else:
+            results_df = self.recorder.to_frame(self.result_columns)
 
         # The below code calculates the average or cumulative values the model 
         # is concerned with.
 
-        self.mean_q_time_nurse = round(self.results_df["Q Time Nurse"].mean(),0)
+        self.mean_q_time_nurse = round(results_df["Q Time Nurse"].mean(),0)
 
-        self.number_of_admissions_avoided = len(self.admission_avoidance)
+        self.number_of_admissions_avoided = self.admission_avoidance
 
-        self.mean_q_time_ward = round(self.results_df["Q Time Ward"].mean()/\
+        self.mean_q_time_ward = round(results_df["Q Time Ward"].mean()/\
                                       60, 0)
 
-        self.mean_ward_occupancy = round(self.results_df["Ward Occupancy"].\
-                                         mean())
+        self.mean_ward_occupancy = round(results_df["Ward Occupancy"].\
+                                         mean(), 0)
 
-        self.admission_delays = len(self.results_df\
-                                    [self.results_df["Q Time Ward"] > 0])
+        self.admission_delays = len(results_df\
+                                    [results_df["Q Time Ward"] > 0])
 
-        self.mean_los_ward = round(self.results_df["Ward LOS"].mean()/60, 0)
+        self.mean_los_ward = round(results_df["Ward LOS"].mean()/60, 0)
 
-        self.sdec_financial_savings = len(self.admission_avoidance) * \
-            g.inpatient_bed_cost
+        self.sdec_financial_savings = self.admission_avoidance * \
+            self.config.inpatient_bed_cost
         
         # The below code ensures that the SDEC incurs no cost if it is not 
         # running at all in the model. This was introduced as a bug was causing
         # it to return small values even if the SDEC was not running. This is 
         # now fixed, but the code works so I have left it in place.
 
-        if g.sdec_unav_freq == 0:
+        if self.config.sdec_unav_freq == 0:
             self.medical_staff_cost = 0
         else:
             self.medical_staff_cost = round(
-            g.sdec_dr_cost_min * (g.sim_duration ) - \
-            g.sdec_dr_cost_min * self.sdec_freeze_counter * g.sdec_unav_time, 0)
+            self.config.sdec_dr_cost_min * (self.config.sim_duration ) - \
+            self.config.sdec_dr_cost_min * self.sdec_freeze_counter * \
+            self.config.sdec_unav_time, 0)
         
         self.savings_sdec = round(self.sdec_financial_savings - \
             self.medical_staff_cost, 0)
         
-        self.thrombolysis_savings = round(self.results_df\
+        self.thrombolysis_savings = round(results_df\
                                           ["Thrombolysis Savings"].sum(),0)
         self.total_savings = self.thrombolysis_savings + self.savings_sdec
 
+        # Time weighted results from the monitors, these give the average 
+        # over the whole run rather than the average seen by each patient.
+
+        end_time = self.config.sim_duration + self.config.warm_up_period
+        self.time_weighted_ward_occupancy = \
+            self.ward_occupancy_monitor.time_weighted_mean(end_time)
+        self.max_ward_occupancy = self.ward_occupancy_monitor.max_value
+        self.time_weighted_nurse_q = \
+            self.nurse_q_monitor.time_weighted_mean(end_time)
+
     # This method plots the stroke nurse assessment queue graph, as it is after
     # the run method it will appear after the run has completed in the output.
     # Might need to change this...
 
     def plot_stroke_run_graphs(self):  
         
-        if g.gen_graph == True:
+        if self.config.gen_graph == True:
         
             # Queue for Nurse Assessment Graph (Currently Commented Out)
 
+            #self.nurse_q_graph_df = self.nurse_q_monitor.to_frame()
             #self.nurse_q_graph_df.drop([0], inplace=True)
                 
             #fig, ax = plt.subplots()
@@ -987,32 +2561,17 @@ class Model:
 
             # Ward Occupancy Graph
 
-            self.occupancy_graph_df.drop([0], inplace=True)
-
-            fig, ax = plt.subplots()
+            plot_ward_occupancy(self.occupancy_graph_series(), 
+                                self.run_number,
+                                self.config.trials_run_counter, self.config)
 
-            ax.set_xlabel("Time")
-            ax.set_ylabel("Stroke Ward Occupancy")
-            ax.set_title(f"Trial "f"{g.trials_run_counter}\
-                         Ward Occupancy Over Time "f"{self.run_number}")
+    # The ward occupancy series for the graph, cut down to the point budget.
 
-            ax.plot(self.occupancy_graph_df["Time"],
-                    self.occupancy_graph_df["Ward Occupancy"],
-                    color="b",
-                    linestyle="-",
-                    label="Ward Occupancy")
-            
-            # Add trend line 
-            x = self.occupancy_graph_df["Time"]
-            y = self.occupancy_graph_df["Ward Occupancy"]
-            z = np.polyfit(x, y, 1)  # 1 = linear fit
-            p = np.poly1d(z)
-            ax.plot(x, p(x), color="b", linestyle="--", label="Trend Line")
- 
-            ax.legend(loc="upper right")
-            
-            fig.show()
-            
+    def occupancy_graph_series(self):
+        monitor = self.ward_occupancy_monitor
+        return occupancy_graph_series(monitor.times[:monitor.count],
+                                      monitor.values[:monitor.count],
+                                      self.config.graph_point_budget)
         
     # The run method starts up the DES entity generators, runs the simulation,
     # and in turns calls anything we need to generate results for the run
@@ -1021,13 +2580,85 @@ class Model:
         
         # starts up the generators in the model, of which there are three.
 
-        self.env.process(self.generator_patient_arrivals())
-        self.env.process(self.generator_patient_arrivals_ooh())
+        self.start_generators()
+
+        # Run the model for the duration specified in the config
+        self.advance(self.config.sim_duration + self.config.warm_up_period)
+
+        self.finish_run()
+
+    # Each arrival window has its own generator if the windows open with an
+    # arrival, a replayed arrival log always uses the one arrival generator.
+
+    def start_generators(self):
+        if self.config.window_opening_arrivals == True and \
+            self.config.arrival_trace is None:
+            for window, (_, _, rate, _) in enumerate(
+                self.arrival_rate_table()):
+                if rate > 0:
+                    self.env.process(self.generator_window_arrivals(window))
+        else:
+            self.env.process(self.generator_patient_arrivals())
         self.env.process(self.obstruct_ctp())
         self.env.process(self.obstruct_sdec())
 
-        # Run the model for the duration specified in g class
-        self.env.run(until=(g.sim_duration + g.warm_up_period))
+    # Runs the model up to the time given, through the profiler if the run is
+    # being profiled. A run can be advanced in more than one step (eg to the
+    # end of the warm up and then to the end of the run), it gives the same 
+    # results as advancing it in one step.
+
+    def advance(self, until):
+        if self.config.profile_stages == True:
+            if self.profiler is None:
+                self.profiler = StageProfiler(self)
+            self.profiler.run(until)
+        else:
+            self.env.run(until=until)
+
+    # Starts the results log for the run if the results are spilled.
+
+    def start_results_log(self):
+        if self.config.spill_results == True:
+            self.results_log_path = os.path.join(self.config.output_folder,
+                f"trial {self.config.trials_run_counter} output "
+                f"{self.run_number}.results")
+            self.recorder.start_log(self.results_log_path)
+
+    # Changes the config of a model part way through a run, this is used to 
+    # run a scenario from a warm up shared with other scenarios. Only the 
+    # settings in warm_start_settings (and settings that only change the 
+    # output) can be changed. The settings are used from the next time they 
+    # are read, so the new SDEC and CTP hours start from the next day of 
+    # their cycle and patients already in the ward keep their LOS. If the 
+    # SDEC or CTP was open all the time its generator is started again.
+
+    def change_config(self, config):
+        check_warm_start_config(self.config, config)
+        old_config = self.config
+        self.config = config
+
+        if old_config.ctp_unav_time == 0 and config.ctp_unav_time != 0:
+            self.env.process(self.obstruct_ctp())
+        if old_config.sdec_unav_time == 0 and config.sdec_unav_time != 0:
+            self.env.process(self.obstruct_sdec())
+
+        if self.results_log_path is None:
+            self.start_results_log()
+
+    # Finishes a run once the model has been advanced to the end, the 
+    # results are calculated and the output files and graphs are written.
+
+    def finish_run(self):
+
+        if self.profiler is not None:
+            self.stage_profile = self.profiler.to_frame()
+            self.stage_profile.to_csv(os.path.join(self.config.output_folder,
+                f"trial {self.config.trials_run_counter} profile "
+                f"{self.run_number}.csv"), index=False)
+
+        # Write the patients still in the model to the results log, if there
+        # is one.
+        self.recorder.close()
 
         # Now the simulation run has finished, call the method that calculates
         # run results
@@ -1039,21 +2670,1262 @@ class Model:
         #print (f"Run Number {self.run_number}")
         #print (self.results_df)
 
-        if g.write_to_csv == True:
-            self.results_df.to_csv\
-                (f"trial {g.trials_run_counter} output {self.run_number}.csv", 
+        if self.config.write_to_csv == True and self.results_df is not None:
+            self.results_df.to_csv(os.path.join(self.config.output_folder,
+                f"trial {self.config.trials_run_counter} output "
+                f"{self.run_number}.csv"), 
                                index=False)
 
         self.plot_stroke_run_graphs()
+
+    # Returns the key results of the run in the same order as the columns of 
+    # the trial results DataFrame.
+
+    def run_results(self):
+        return [self.mean_q_time_nurse,
+                self.number_of_admissions_avoided,
+                self.mean_q_time_ward,
+                self.mean_ward_occupancy,
+                self.admission_delays,
+                self.mean_los_ward,
+                self.sdec_financial_savings,
+                self.medical_staff_cost,
+                self.savings_sdec,
+                self.thrombolysis_savings,
+                self.total_savings]
     
+# The fast engine. The nurse assessment is a first come first served queue 
+# and the CT / CTP scanners are never queued for, so the arrivals, nurse 
+# queue and scan times of a whole run can be found at once with NumPy rather
+# than with a SimPy process for every patient. The arrival times are found 
+# from the same "work" the arrival generator uses, the nurse queue with the 
+# Lindley recursion (or a heap of the times each nurse is next free when 
+# there is more than one nurse), and the CTP and SDEC hours from their 
+# daily cycle. Only the SDEC and ward, where patients wait for each other, 
+# are stepped through one event at a time with a heap of events in the 
+# same order SimPy would process them.
+#
+# The model draws the same values from the same streams as the normal model,
+# so a run sees the same patients, and the per patient results are filled 
+# into the results recorder at the time they would have been recorded. The 
+# results, output files and graphs of the run are then made in the same way
+# as the normal model. validate_fast_engine checks the two against each 
+# other.
+
+class FastModel(Model):
+
+    # The kinds of event in the SDEC and ward, the order they are listed in
+    # doesn't matter as events are ordered by time and then by when they 
+    # were scheduled.
+
+    decide, sdec_end, hold_time_out, ward_admit, ward_leave, bed_released = \
+        range(6)
+
+    def __init__(self, run_number, config=None, seed=None):
+        super().__init__(run_number, config, seed)
+        if self.config.ward_bed_polling == True or \
+            self.config.profile_stages == True:
+            raise ValueError("The fast engine can't be used with "
+                             "ward_bed_polling or profile_stages")
+
+    def run(self):
+        self.run_stages()
+        self.finish_run()
+
+    # Returns True for the times the SDEC or CTP is closed. Each cycle starts
+    # with the unit open for the unavailability frequency, it is then closed
+    # for the unavailability time.
+
+    @staticmethod
+    def closed_at(times, unav_freq, unav_time):
+        if unav_time == 0:
+            return np.zeros(len(times), dtype=bool)
+        return np.mod(times, unav_freq + unav_time) >= unav_freq
+
+    # Finds the arrival times before the end time, and the arrival window of
+    # each patient. The total work up to each arrival is turned into a time by
+    # finding the day and then the window of the day it is used up in. When 
+    # each window opens with an arrival, the arrivals of each window are 
+    # found one after another as in generator_window_arrivals.
+
+    def arrival_times(self, end_time):
+        rate_table = self.arrival_rate_table()
+        day_length = rate_table[-1][1]
+        starts = np.array([row[0] for row in rate_table], dtype=float)
+        ends = np.array([row[1] for row in rate_table], dtype=float)
+        rates = np.array([row[2] for row in rate_table], dtype=float)
+        generators = np.array([row[3] for row in rate_table])
+
+        if self.config.arrival_trace is not None:
+            times = self.sampler.trace_arrivals_before(end_time)
+            windows = np.minimum(np.searchsorted(ends, times % day_length,
+                                                 side="right"),
+                                 len(rate_table) - 1)
+            return times, generators[windows]
+
+        if self.config.window_opening_arrivals == True:
+            times = []
+            window_generators = []
+            for window, (start, end, rate, generator) in enumerate(
+                rate_table):
+                if rate <= 0:
+                    continue
+                time = 0.0
+                while True:
+                    time += self.window_wait(time, start, end, day_length)
+                    if time >= end_time:
+                        break
+                    times.append(time)
+                    window_generators.append(generator)
+                    time += self.sampler.next_window_arrival_work(window) / \
+                        rate
+            times = np.array(times)
+            order = np.argsort(times, kind="stable")
+            return times[order], np.array(window_generators, dtype=int)[order]
+
+        window_work = rates * (ends - starts)
+        work_ends = np.cumsum(window_work)
+        work_starts = work_ends - window_work
+        day_work = work_ends[-1]
+        if day_work <= 0:
+            return np.zeros(0), np.zeros(0, dtype=int)
+
+        blocks = [self.sampler.draw_arrival_block()]
+        while True:
+            total_work = np.cumsum(np.concatenate(blocks))
+            days = np.floor(total_work / day_work)
+            work_in_day = total_work - days * day_work
+            windows = np.minimum(np.searchsorted(work_ends, work_in_day),
+                                 len(rate_table) - 1)
+            window_rates = rates[windows]
+            times = days * day_length + starts[windows] + np.divide(
+                work_in_day - work_starts[windows], window_rates,
+                out=np.zeros(len(windows)), where=window_rates > 0)
+            if times[-1] >= end_time:
+                break
+            blocks.append(self.sampler.draw_arrival_block())
+
+        arrived = times < end_time
+        return times[arrived], generators[windows][arrived]
+
+    # Draws the values of the given number of patients, in the same order as
+    # the normal model.
+
+    def patient_columns(self, number_of_patients):
+        blocks = [self.sampler.draw_patient_columns()]
+        while len(blocks) * self.sampler.block_size < number_of_patients:
+            blocks.append(self.sampler.draw_patient_columns())
+        return [np.concatenate([block[position] for block in blocks])
+                [:number_of_patients] for position in range(len(blocks[0]))]
+
+    # Returns the time each patient starts with a nurse. With one nurse this
+    # is the Lindley recursion, each patient starts at the later of their 
+    # arrival and the time the patient before them finished, which is found 
+    # for every patient at once from the running totals of the nurse times.
+
+    def nurse_start_times(self, arrivals, nurse_times):
+        if self.config.number_of_nurses == 1:
+            before = np.cumsum(nurse_times) - nurse_times
+            return before + np.maximum.accumulate(arrivals - before)
+
+        free_times = [0.0] * self.config.number_of_nurses
+        start_times = []
+        for arrival, nurse_time in zip(arrivals.tolist(), 
+                                       nurse_times.tolist()):
+            start = max(arrival, free_times[0])
+            heapq.heapreplace(free_times, start + nurse_time)
+            start_times.append(start)
+        return np.array(start_times)
+
+    # Steps through the SDEC and ward one event at a time. Each patient 
+    # reaches the SDEC at their decide time, the other arrays give for each 
+    # patient if the SDEC is open then, their SDEC stay and ward LOS, if they 
+    # avoid admission at the SDEC, if they are admitted after the SDEC or 
+    # without it, and their ward stay as a fraction of their LOS.
+    #
+    # As in the normal model the ward occupancy only goes up once an admitted
+    # patient takes their bed, so when a bed is released the patient queuing
+    # for it takes it first, and every patient held in the SDEC that sees a 
+    # free bed leaves the SDEC and queues for the ward. Returns the times and
+    # values each patient's results are recorded with.
+
+    def run_sdec_and_ward(self, decide_times, sdec_open, sdec_stays, 
+                          ward_times, avoids_at_sdec, admitted_after_sdec,
+                          admitted_without_sdec, stay_fractions, end_time):
+        number_of_patients = len(decide_times)
+        sdec_beds = self.config.sdec_beds
+        ward_beds = self.config.number_of_ward_beds
+        occupancy_times = []
+        occupancy_values = []
+
+        sdec_open = sdec_open.tolist()
+        sdec_stays = sdec_stays.tolist()
+        ward_times = ward_times.tolist()
+        avoids_at_sdec = avoids_at_sdec.tolist()
+        admitted_after_sdec = admitted_after_sdec.tolist()
+        admitted_without_sdec = admitted_without_sdec.tolist()
+        stay_fractions = stay_fractions.tolist()
+
+        sdec_occupancy_at_entry = [math.nan] * number_of_patients
+        leave_times = [math.nan] * number_of_patients
+        yield_counts = [0.0] * number_of_patients
+        admit_times = [math.nan] * number_of_patients
+        ward_occupancy_at_admit = [math.nan] * number_of_patients
+        ward_leave_times = [math.nan] * number_of_patients
+        queue_start_times = [math.nan] * number_of_patients
+        ward_los = [math.nan] * number_of_patients
+        timed_out = [False] * number_of_patients
+        hold_starts = [0.0] * number_of_patients
+        hold_tokens = [0] * number_of_patients
+
+        # Events are (time, order scheduled, kind, patient, value).
+
+        events = [(decide_time, patient, self.decide, patient, None) 
+                  for patient, decide_time in enumerate(decide_times.tolist())
+                  if decide_time < end_time]
+        heapq.heapify(events)
+        order = itertools.count(number_of_patients)
+
+        sdec_occupancy = 0
+        ward_occupancy = 0
+        beds_taken = 0
+        ward_queue = collections.deque()
+        held = []
+
+        def queue_for_ward(patient, now, los):
+            nonlocal beds_taken
+            queue_start_times[patient] = now
+            ward_los[patient] = los
+            if beds_taken < ward_beds:
+                beds_taken += 1
+                heapq.heappush(events, (now, next(order), self.ward_admit, 
+                                        patient, None))
+            else:
+                ward_queue.append(patient)
+
+        # A held patient waits for a bed to be released or for their whole 
+        # LOS to pass, the token marks which hold a time out belongs to.
+
+        def hold(patient, now):
+            hold_starts[patient] = now
+            hold_tokens[patient] = token = next(order)
+            held.append(patient)
+            heapq.heappush(events, (now + ward_times[patient] - 
+                                    yield_counts[patient], next(order),
+                                    self.hold_time_out, patient, token))
+
+        def leave_sdec(patient, now):
+            nonlocal sdec_occupancy
+            sdec_occupancy -= 1
+            leave_times[patient] = now
+            if timed_out[patient] == False and \
+                admitted_after_sdec[patient] == True:
+                queue_for_ward(patient, now, 
+                               ward_times[patient] - yield_counts[patient])
+
+        while events:
+            now, _, kind, patient, value = heapq.heappop(events)
+            if now >= end_time:
+                break
+
+            if kind == self.decide:
+                if sdec_open[patient] == True and sdec_occupancy < sdec_beds:
+                    sdec_occupancy += 1
+                    sdec_occupancy_at_entry[patient] = sdec_occupancy
+                    heapq.heappush(events, (now + sdec_stays[patient], 
+                                            next(order), self.sdec_end, 
+                                            patient, None))
+                elif admitted_without_sdec[patient] == True:
+                    queue_for_ward(patient, now, ward_times[patient])
+
+            elif kind == self.sdec_end:
+                if avoids_at_sdec[patient] == False and \
+                    ward_occupancy >= ward_beds and ward_times[patient] > 0:
+                    hold(patient, now)
+                else:
+                    leave_sdec(patient, now)
+
+            elif kind == self.hold_time_out:
+                if hold_tokens[patient] != value:
+                    continue
+                hold_tokens[patient] = 0
+                if patient in held:
+                    held.remove(patient)
+                yield_counts[patient] = ward_times[patient]
+                timed_out[patient] = True
+                leave_sdec(patient, now)
+
+            elif kind == self.ward_admit:
+                ward_occupancy += 1
+                admit_times[patient] = now
+                ward_occupancy_at_admit[patient] = ward_occupancy
+                occupancy_times.append(now)
+                occupancy_values.append(ward_occupancy)
+                heapq.heappush(events, (now + ward_los[patient] * 
+                                        stay_fractions[patient], next(order),
+                                        self.ward_leave, patient, None))
+
+            elif kind == self.ward_leave:
+                ward_occupancy -= 1
+                ward_leave_times[patient] = now
+                occupancy_times.append(now)
+                occupancy_values.append(ward_occupancy)
+                if ward_queue:
+                    heapq.heappush(events, (now, next(order), self.ward_admit,
+                                            ward_queue.popleft(), None))
+                else:
+                    beds_taken -= 1
+                if held:
+                    heapq.heappush(events, (now, next(order), 
+                                            self.bed_released, -1, held))
+                    held = []
+
+            elif kind == self.bed_released:
+                for patient in value:
+                    if hold_tokens[patient] == 0:
+                        continue
+                    hold_tokens[patient] = 0
+                    yield_counts[patient] += now - hold_starts[patient]
+                    if ward_occupancy >= ward_beds and \
+                        yield_counts[patient] < ward_times[patient]:
+                        hold(patient, now)
+                    else:
+                        leave_sdec(patient, now)
+
+        self.ward_occupancy_monitor.record_many(occupancy_times, 
+                                                occupancy_values)
+        return {name: np.array(values, dtype=float) for name, values in 
+                [("sdec_occupancy_at_entry", sdec_occupancy_at_entry),
+                 ("leave_times", leave_times), 
+                 ("yield_counts", yield_counts),
+                 ("admit_times", admit_times),
+                 ("ward_occupancy_at_admit", ward_occupancy_at_admit),
+                 ("ward_leave_times", ward_leave_times),
+                 ("queue_start_times", queue_start_times),
+                 ("ward_los", ward_los), ("timed_out", timed_out)]}
+
+    # Carries out the run. The per patient results, the admission avoidance 
+    # and SDEC closure counters and the monitors are filled in as the normal
+    # model would have left them, ready for finish_run.
+
+    def run_stages(self):
+        config = self.config
+        end_time = config.sim_duration + config.warm_up_period
+
+        arrivals, generators = self.arrival_times(end_time)
+        number_of_patients = len(arrivals)
+        self.patient_counter = number_of_patients
+        (onset_type, mrs_type, diagnosis_values, diagnosis, non_admission, 
+         nurse_draws, ct_draws, sdec_draws, ward_times, 
+         admission_chance) = self.patient_columns(number_of_patients)
+
+        # Nurse assessment and CT / CTP.
+
+        nurse_times = config.mean_n_consult_time * nurse_draws
+        nurse_starts = self.nurse_start_times(arrivals, nurse_times)
+        nurse_ends = nurse_starts + nurse_times
+        ctp_closed = self.closed_at(nurse_ends, config.ctp_unav_freq,
+                                    config.ctp_unav_time)
+        advanced_ct = ~ctp_closed
+        ct_times = config.mean_n_ct_time * ct_draws
+        decide_times = nurse_ends + ct_times
+        sdec_closed = self.closed_at(decide_times, config.sdec_unav_freq, 
+                                     config.sdec_unav_time)
+
+        thrombolysis = (diagnosis == 1) & (mrs_type > 0) & \
+            ((onset_type == 0) | ((onset_type == 1) & advanced_ct))
+
+        # Admission avoidance in the SDEC, and the second check of the TIA,
+        # stroke mimic and non stroke patients once they leave the SDEC (or 
+        # pass it by).
+
+        if config.therapy_sdec == True:
+            mrs_limit = 3
+        else:
+            mrs_limit = 1
+        avoids_at_sdec = np.where(
+            diagnosis < 2, (mrs_type <= mrs_limit) & ~thrombolysis,
+            np.where(diagnosis == 2, 
+                     non_admission >= config.tia_admission + 
+                     admission_chance[:, 0],
+                     non_admission >= config.stroke_mimic_admission + 
+                     admission_chance[:, 1]))
+        avoids_after = np.where(
+            diagnosis == 2, 
+            non_admission >= config.tia_admission + admission_chance[:, 2],
+            (diagnosis > 2) & (non_admission >= config.stroke_mimic_admission
+                               + admission_chance[:, 3]))
+
+        stay_fractions = np.where(thrombolysis, config.thrombolysis_los_save,
+                                  1.0)
+        stages = self.run_sdec_and_ward(
+            decide_times, ~sdec_closed, config.mean_n_sdec_time * sdec_draws,
+            ward_times, avoids_at_sdec, ~(avoids_at_sdec | avoids_after),
+            ~avoids_after, stay_fractions, end_time)
+
+        in_sdec = ~np.isnan(stages["sdec_occupancy_at_entry"])
+        after_sdec_times = np.where(in_sdec, stages["leave_times"], 
+                                    decide_times)
+        ward_stays = stages["ward_los"] * stay_fractions
+
+        # Values are recorded after the warm up period and before the end of
+        # the run.
+
+        def recorded(times):
+            return (times > config.warm_up_period) & (times < end_time)
+
+        avoided = in_sdec & avoids_at_sdec & (diagnosis < 2)
+        self.admission_avoidance = int((avoided & 
+                                        recorded(after_sdec_times)).sum())
+
+        if config.sdec_unav_time != 0:
+            cycle = config.sdec_unav_freq + config.sdec_unav_time
+            closure_ends = np.arange(1, int(end_time // cycle) + 2) * cycle
+            self.sdec_freeze_counter = int(recorded(closure_ends).sum())
+
+        # The nurse queue goes up by one when a patient arrives and down by 
+        # one when they start with a nurse. Only the queue lengths when a 
+        # patient starts with a nurse are stored in the graph series, as in 
+        # the normal model.
+
+        queue_times = np.concatenate([arrivals, nurse_starts])
+        queue_changes = np.concatenate([np.ones(number_of_patients), 
+                                        -np.ones(number_of_patients)])
+        queue_starts = np.concatenate([np.zeros(number_of_patients, dtype=bool),
+                                       np.ones(number_of_patients, dtype=bool)])
+        in_time_order = np.argsort(queue_times, kind="stable")
+        queue_lengths = np.cumsum(queue_changes[in_time_order])
+        queue_times = queue_times[in_time_order]
+        queue_starts = queue_starts[in_time_order]
+        self.nurse_q_monitor.record_many(queue_times[queue_times < end_time],
+                                         queue_lengths[queue_times < end_time],
+                                         queue_starts[queue_times < end_time])
+
+        # The per patient results, each with the time it is recorded at.
+
+        codes = self.recorder.text_codes
+        thrombolysis_savings = np.where(
+            thrombolysis & advanced_ct, (stages["ward_los"] - ward_stays) / 
+            60 / 24 * config.inpatient_bed_cost_thrombolysis, np.nan)
+        sdec_savings = np.full(number_of_patients, np.nan)
+        avoided_in_order = np.flatnonzero(avoided & 
+                                          recorded(after_sdec_times))
+        avoided_in_order = avoided_in_order[np.argsort(
+            after_sdec_times[avoided_in_order], kind="stable")]
+
+        # As in the normal model each saving is added to the value of the 
+        # latest patient (by ID) with a saving so far, which isn't always the
+        # last saving recorded when patients leave the SDEC out of order.
+
+        last_patient, last_value = -1, 0.0
+        for patient in avoided_in_order.tolist():
+            value = last_value + config.inpatient_bed_cost
+            sdec_savings[patient] = value
+            if patient > last_patient:
+                last_patient, last_value = patient, value
+
+        columns = [
+            (arrivals, {"Diangosis Value": diagnosis_values,
+                        "Arrival Time": arrivals,
+                        "Patient Gen 1 Status": generators == 1,
+                        "Patient Gen 2 Status": generators == 2}),
+            (nurse_ends, {"Q Time Nurse": nurse_starts - arrivals,
+                          "Time with Nurse": nurse_times}),
+            (decide_times, {"Time with CTP": np.where(advanced_ct, ct_times,
+                                                      np.nan),
+                            "Time with CT": np.where(ctp_closed, ct_times, 
+                                                     np.nan),
+                            "CTP Status": self.closed_at(
+                                decide_times, config.ctp_unav_freq, 
+                                config.ctp_unav_time),
+                            "Thrombolysis": thrombolysis,
+                            "SDEC Status": sdec_closed,
+                            "Patient Flow Check 1": codes["Yes"],
+                            "SDEC Occupancy": 
+                                stages["sdec_occupancy_at_entry"]}),
+            (np.where(in_sdec, stages["leave_times"], np.nan),
+             {"SDEC Yield Count": stages["yield_counts"],
+              "Sampled LOS": ward_times,
+              "Time in SDEC": config.mean_n_sdec_time * sdec_draws}),
+            (after_sdec_times, {"Diagnosis Type": diagnosis, 
+                                "Onset Type": onset_type,
+                                "Admission Avoidance": np.where(avoided, 1, 
+                                                                np.nan),
+                                "SDEC Savings": sdec_savings,
+                                "MRS Type": mrs_type,
+                                "Patient Flow Check 2": codes["Yes"]}),
+            (stages["admit_times"], 
+             {"Ward Occupancy": stages["ward_occupancy_at_admit"]}),
+            (stages["ward_leave_times"], 
+             {"Q Time Ward": stages["admit_times"] - 
+                             stages["queue_start_times"],
+              "Ward LOS": stages["ward_los"],
+              "Thrombolysis Savings": thrombolysis_savings})]
+
+        # Patients are given a row in the order they were first recorded.
+
+        first_recorded = np.full(number_of_patients, np.inf)
+        values = {}
+        for times, group in columns:
+            is_recorded = recorded(times)
+            first_recorded = np.where(is_recorded, 
+                                      np.minimum(first_recorded, times), 
+                                      first_recorded)
+            for column, column_values in group.items():
+                values[column] = np.where(is_recorded, column_values, np.nan)
+
+        rows = np.flatnonzero(first_recorded < np.inf)
+        rows = rows[np.argsort(first_recorded[rows], kind="stable")]
+        self.recorder.fill(rows + 1, {column: column_values[rows] for 
+                                      column, column_values in values.items()})
+
+# Largest-Triangle-Three-Buckets downsampling. The points between the first 
+# and last are split into buckets and from each bucket the point that makes 
+# the largest triangle with the point kept from the bucket before and the 
+# average of the bucket after is kept. This keeps the peaks and dips of the 
+# series, which taking every nth point can miss. Returns the positions of the
+# points to keep.
+
+def lttb_indices(x, y, points):
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    edges = (np.arange(points - 1) * ((n - 2) / (points - 2))).astype(int) + 1
+    edges[-1] = n - 1
+
+    kept = np.zeros(points, dtype=np.int64)
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[previous] - average_x) * 
+                       (y[start:end] - y[previous]) - 
+                       (x[previous] - x[start:end]) * 
+                       (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+# Builds the data for the ward occupancy graph of a run from the times and 
+# values of the monitor. The first row (the start value) isn't drawn. The 
+# trend line is fitted to the whole series, then the series is cut down to 
+# the point budget. As the trend is a straight line it is still drawn 
+# correctly from the points that are kept.
+
+def occupancy_graph_series(times, values, point_budget):
+    x = np.asarray(times, dtype=float)[1:]
+    y = np.asarray(values, dtype=float)[1:]
+    if len(x) > 1:
+        trend = np.poly1d(np.polyfit(x, y, 1))  # 1 = linear fit
+    else:
+        trend = np.poly1d([0, y[0] if len(y) else 0])
+    kept = lttb_indices(x, y, point_budget)
+    return pd.DataFrame({"Time": x[kept], "Ward Occupancy": y[kept],
+                         "Trend": trend(x[kept])})
+
+# Makes a figure for a graph. Graphs that are saved to a file are drawn on a
+# figure that isn't part of pyplot, so they are drawn off screen (with the Agg
+# renderer) and can be drawn in worker processes.
+
+def graph_figure(config):
+    if config.graph_files == True:
+        fig = matplotlib.figure.Figure()
+        return fig, fig.subplots()
+    return plt.subplots()
+
+# Shows a graph, or saves it to a file in the output folder.
+
+def finish_graph(fig, config, file_name):
+    if config.graph_files == True:
+        fig.savefig(os.path.join(config.output_folder, file_name))
+    else:
+        fig.show()
+
+# This function plots the ward occupancy graph for a single run. It is kept 
+# outside of the Model class so the graph can also be drawn from the results 
+# of runs that were carried out in a worker process.
+
+def plot_ward_occupancy(occupancy_graph_df, run_number, trial_number, 
+                        config=None):
+    if config is None:
+        config = ScenarioConfig.from_g()
+
+    fig, ax = graph_figure(config)
+
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Stroke Ward Occupancy")
+    ax.set_title(f"Trial "f"{trial_number}\
+                 Ward Occupancy Over Time "f"{run_number}")
+
+    ax.plot(occupancy_graph_df["Time"],
+            occupancy_graph_df["Ward Occupancy"],
+            color="b",
+            linestyle="-",
+            label="Ward Occupancy")
+    
+    # Add trend line 
+    ax.plot(occupancy_graph_df["Time"], occupancy_graph_df["Trend"], 
+            color="b", linestyle="--", label="Trend Line")
+
+    ax.legend(loc="upper right")
+    
+    finish_graph(fig, config, 
+                 f"trial {trial_number} ward occupancy {run_number}.png")
+
+# This function plots the ward occupancy of every run of a trial on one 
+# graph, so the runs can be compared.
+
+def plot_ward_occupancy_overlay(occupancy_graph_dfs, trial_number, 
+                                config=None):
+    if config is None:
+        config = ScenarioConfig.from_g()
+
+    fig, ax = graph_figure(config)
+
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Stroke Ward Occupancy")
+    ax.set_title(f"Trial {trial_number} Ward Occupancy Over Time, All Runs")
+
+    for run_number, occupancy_graph_df in sorted(occupancy_graph_dfs.items()):
+        ax.plot(occupancy_graph_df["Time"],
+                occupancy_graph_df["Ward Occupancy"],
+                linestyle="-", linewidth=0.8, alpha=0.6,
+                label=f"Run {run_number}")
+
+    if len(occupancy_graph_dfs) <= 10:
+        ax.legend(loc="upper right")
+    
+    finish_graph(fig, config, 
+                 f"trial {trial_number} ward occupancy all runs.png")
+
+# These functions set how much of each day the SDEC and CTP are open for in
+# the g class, as a percentage.
+
+def set_sdec_open_percent(percent):
+    g.sdec_open_percent = percent
+    g.sdec_unav_freq, g.sdec_unav_time = open_percent_to_unav(percent)
+
+def set_ctp_open_percent(percent):
+    g.ctp_open_percent = percent
+    g.ctp_unav_freq, g.ctp_unav_time = open_percent_to_unav(percent)
+
+# Each run is given its own seed, these are all created from the master seed
+# so a trial can be repeated exactly. If no master seed is set a new one is 
+# created every trial.
+
+def run_seeds(master_seed, number_of_runs):
+    return [int(seed.generate_state(1)[0]) for seed in 
+            np.random.SeedSequence(master_seed).spawn(number_of_runs)]
+
+# Cache of the results of runs that have already been carried out. Each run is
+# stored under a hash of its config, seed and the model code, so a run is only
+# reused if nothing that could change its results has changed. Settings that 
+# only change how the results are output (eg the output folder or the number 
+# of workers) are left out of the hash. A run is stored as a JSON file of its
+# key results (and the ward occupancy graph data if graphs are on) and, if 
+# the per patient results are cached, a results log. When the cache is larger
+# than its size limit the least recently used runs are removed.
+
+class ResultCache:
+
+    output_settings = {"number_of_runs", "write_to_csv", "gen_graph", 
+                       "trials_run_counter", "output_folder", 
+                       "number_of_workers", "master_seed", 
+                       "common_random_numbers", "target_half_width", 
+                       "precision_results", "max_number_of_runs", 
+                       "spill_results", "auto_warm_up", "result_cache_folder",
+                       "result_cache_size", "cache_patient_results",
+                       "profile_stages", "share_warm_up", "graph_files",
+                       "graph_point_budget"}
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    # A hash of the model file, so results from older versions of the model
+    # aren't reused.
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def model_version():
+        with open(os.path.abspath(__file__), "rb") as model_file:
+            return hashlib.sha256(model_file.read()).hexdigest()
+
+    # The settings of a config that change its results. The arrival log is
+    # identified by its contents rather than its folder, so a log converted 
+    # again with new data isn't given the old results.
+
+    def run_settings(self, config):
+        settings = {name: value for name, value 
+                    in dataclasses.asdict(config).items() 
+                    if name not in self.output_settings}
+        if config.arrival_trace is not None:
+            settings["arrival_trace"] = \
+                arrival_trace(config.arrival_trace).info["sha256"]
+        return settings
+
+    # A run that finishes a warm up shared with other scenarios (see 
+    # run_warm_start_group) is stored under the config its warm up was run
+    # with as well as its own, as its results differ from a run of its own.
+
+    def key(self, config, seed, warm_config=None):
+        key_values = [self.run_settings(config), seed, self.model_version()]
+        if warm_config is not None:
+            key_values.append(self.run_settings(warm_config))
+        text = json.dumps(key_values, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def paths(self, key):
+        return (os.path.join(self.folder, f"{key}.json"),
+                os.path.join(self.folder, f"{key}.results"))
+
+    # Returns the stored run, or None if the run isn't in the cache or is 
+    # missing the per patient results or graph data that are needed. A run 
+    # that is used is marked as recently used.
+
+    def load(self, config, seed, need_patients=False, need_graph=False,
+             warm_config=None):
+        entry_path, log_path = self.paths(self.key(config, seed, 
+                                                   warm_config))
+        try:
+            with open(entry_path) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        if need_patients == True and not os.path.exists(log_path):
+            return None
+        if need_graph == True and entry.get("occupancy") is None:
+            return None
+
+        os.utime(entry_path)
+        entry["log_path"] = log_path
+        return entry
+
+    # Stores a run that has just been carried out. The files are written 
+    # under a temporary name and then renamed, so a worker process reading 
+    # the cache never sees half a file.
+
+    def store(self, config, seed, model, warm_config=None):
+        entry_path, log_path = self.paths(self.key(config, seed, 
+                                                   warm_config))
+        temporary = f".{os.getpid()}.tmp"
+
+        if config.cache_patient_results == True:
+            if model.results_log_path is not None:
+                shutil.copyfile(model.results_log_path, log_path + temporary)
+            else:
+                model.recorder.write_log(log_path + temporary)
+            os.replace(log_path + temporary, log_path)
+
+        entry = {"results": [float(value) for value in model.run_results()],
+                 "occupancy": None,
+                 "sketches": {column: sketch.to_dict() for column, sketch
+                              in model.recorder.sketches.items()}}
+        if config.gen_graph == True:
+            monitor = model.ward_occupancy_monitor
+            entry["occupancy"] = [monitor.times[:monitor.count].tolist(),
+                                  monitor.values[:monitor.count].tolist()]
+        with open(entry_path + temporary, "w") as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(entry_path + temporary, entry_path)
+
+        self.evict()
+
+    # Removes the least recently used runs until the cache is within its 
+    # size limit.
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json"):
+                continue
+            entry_path, log_path = self.paths(name[:-len(".json")])
+            try:
+                size = os.path.getsize(entry_path)
+                last_used = os.path.getmtime(entry_path)
+                if os.path.exists(log_path):
+                    size += os.path.getsize(log_path)
+            except OSError:
+                continue
+            entries.append((last_used, size, entry_path, log_path))
+            total_size += size
+
+        for _, size, entry_path, log_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for path in [entry_path, log_path]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+
+# Returns the result cache for a config, or None if the config doesn't use 
+# one. Runs are only cached when the trial has a master seed, as otherwise the
+# same seed is never used twice. Profiled runs are always run.
+
+def result_cache(config):
+    if config.result_cache_folder is None or config.master_seed is None or \
+        config.profile_stages == True:
+        return None
+    return ResultCache(config.result_cache_folder, config.result_cache_size)
+
+# Returns the model class a config is run with, the fast engine if the config
+# asks for it.
+
+def model_class(config):
+    if config.fast_engine == True:
+        return FastModel
+    return Model
+
+# This function carries out a single run of the model. It is used by the Trial
+# class for every run, and is kept outside of the class so it can be sent to a
+# worker process. As the config and seed are passed in to the model, a run 
+# gives the same results whether it is carried out in this process or in a 
+# worker process.
+
+def run_replication(run_number, seed, config, in_worker=False):
+
+    # Graphs can't be shown from a worker process, so the data for the graph
+    # is sent back and the graph is drawn once the run has been collected.
+    # Graphs saved to files are drawn where the run is carried out. The data 
+    # for the graph is always sent back when graphs are on, for the graph of 
+    # all the runs of the trial.
+
+    if in_worker == True and config.graph_files == False:
+        run_config = config.with_settings(gen_graph=False)
+    else:
+        run_config = config
+
+    # If the run is in the result cache it isn't run again, the files the run
+    # would have written are written from the cache instead.
+
+    cache = result_cache(config)
+    if cache is not None:
+        entry = cache.load(config, seed, 
+                           need_patients=config.write_to_csv == True or 
+                           config.spill_results == True,
+                           need_graph=config.gen_graph == True)
+        if entry is not None:
+            return cached_run_outputs(run_number, config, entry, in_worker)
+
+    my_model = model_class(run_config)(run_number, run_config, seed)
+    my_model.run()
+
+    if cache is not None:
+        cache.store(config, seed, my_model)
+
+    occupancy_graph_df = None
+    if config.gen_graph == True:
+        occupancy_graph_df = my_model.occupancy_graph_series()
+
+    return my_model.run_results(), occupancy_graph_df, \
+        my_model.recorder.sketches
+
+# Checks if the graph of a run is drawn in this process, rather than sent
+# back to be drawn by the main process.
+
+def draws_graph_here(config, in_worker):
+    return config.gen_graph == True and \
+        (in_worker == False or config.graph_files == True)
+
+# This function gives the same outputs as run_replication for a run that was 
+# read from the result cache, including the per run CSV file, results log and
+# ward occupancy graph.
+
+def cached_run_outputs(run_number, config, entry, in_worker=False):
+    file_name = os.path.join(config.output_folder,
+                             f"trial {config.trials_run_counter} output "
+                             f"{run_number}")
+    if config.spill_results == True:
+        shutil.copyfile(entry["log_path"], f"{file_name}.results")
+    elif config.write_to_csv == True:
+        read_results_log(entry["log_path"]).to_csv(f"{file_name}.csv", 
+                                                   index=False)
+
+    occupancy_graph_df = None
+    if config.gen_graph == True:
+        times, values = entry["occupancy"]
+        occupancy_graph_df = occupancy_graph_series(times, values,
+                                                    config.graph_point_budget)
+        if draws_graph_here(config, in_worker) == True:
+            plot_ward_occupancy(occupancy_graph_df, run_number,
+                                config.trials_run_counter, config)
+
+    sketches = {column: WaitTimeSketch.from_dict(sketch) for column, sketch
+                in entry["sketches"].items()}
+    return entry["results"], occupancy_graph_df, sketches
+
+# The settings that can be changed at the end of a shared warm up. They are 
+# only read when they are used, so changing them part way through a run 
+# changes the model from that point on. Settings that change the patients 
+# drawn (eg the ward LOS) or the resources can't be changed.
+
+warm_start_settings = {"thrombolysis_los_save", "sdec_open_percent",
+                       "ctp_open_percent", "sdec_unav_freq", "sdec_unav_time",
+                       "ctp_unav_freq", "ctp_unav_time", "therapy_sdec",
+                       "inpatient_bed_cost", "inpatient_bed_cost_thrombolysis",
+                       "sdec_dr_cost_min", "tia_admission", 
+                       "stroke_mimic_admission", "mean_n_consult_time", 
+                       "mean_n_ct_time", "mean_n_sdec_time"}
+
+# Returns the settings of a config that have to be the same for scenarios to 
+# share a warm up, configs with the same key can share one.
+
+def warm_start_key(config):
+    return tuple((name, value) for name, value 
+                 in dataclasses.asdict(config).items()
+                 if name not in warm_start_settings and 
+                 (name not in ResultCache.output_settings or 
+                  name in ["master_seed", "number_of_runs"]))
+
+def check_warm_start_config(config, new_config):
+    if warm_start_key(config) != warm_start_key(new_config):
+        raise ValueError("Only the settings in warm_start_settings can be "
+                         "changed after the warm up")
+
+# This function carries out one run for each of a group of configs that share
+# a warm up. The warm up is simulated once, then a copy of the warmed up model
+# is made with a fork for each config and runs the results period with that
+# config. The copies share the memory of the warmed up model until they 
+# change it. Up to max_children copies are run at a time. Where processes 
+# can't be forked each config runs its own warm up, which gives the same 
+# results. Returns the same outputs as run_replication for each config.
+
+def run_warm_start_group(run_number, seed, configs, in_worker=False, 
+                         max_children=1):
+    for config in configs[1:]:
+        check_warm_start_config(configs[0], config)
+    outputs = [None] * len(configs)
+
+    # The warm up is always run with the first config, without any output,
+    # so the results of the group don't depend on which runs are cached.
+
+    warm_config = configs[0].with_settings(
+        write_to_csv=False, gen_graph=False, spill_results=False,
+        profile_stages=False)
+
+    # Runs that are in the result cache don't need to be run again. They are
+    # cached under the warm up config, so they are only reused by a group 
+    # that shares the same warm up.
+
+    missing = []
+    for position, config in enumerate(configs):
+        cache = result_cache(config)
+        entry = None
+        if cache is not None:
+            entry = cache.load(config, seed, 
+                               need_patients=config.write_to_csv == True or 
+                               config.spill_results == True,
+                               need_graph=config.gen_graph == True,
+                               warm_config=warm_config)
+        if entry is not None:
+            outputs[position] = cached_run_outputs(run_number, config, entry,
+                                                   in_worker)
+        else:
+            missing.append(position)
+    if len(missing) == 0:
+        return outputs
+
+    warm_model = Model(run_number, warm_config, seed)
+    warm_model.start_generators()
+    warm_model.advance(warm_config.warm_up_period)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        waiting = list(missing)
+        running = []
+        while waiting or running:
+            while waiting and len(running) < max_children:
+                position = waiting.pop(0)
+                receiver, sender = context.Pipe(duplex=False)
+                child = context.Process(target=finish_warm_start, 
+                                        args=(warm_model, configs[position],
+                                              seed, warm_config, sender))
+                child.start()
+                sender.close()
+                running.append((position, child, receiver))
+
+            position, child, receiver = running.pop(0)
+            outputs[position] = receiver.recv()
+            child.join()
+    else:
+        for position in missing:
+            model = Model(run_number, warm_config, seed)
+            model.start_generators()
+            model.advance(warm_config.warm_up_period)
+            outputs[position] = finish_warm_start(model, configs[position], 
+                                                  seed, warm_config)
+
+    # Graphs are drawn here rather than in the copies of the model.
+
+    for position in missing:
+        config = configs[position]
+        if draws_graph_here(config, in_worker) == True:
+            plot_ward_occupancy(outputs[position][1], run_number,
+                                config.trials_run_counter, config)
+    return outputs
+
+# Carries out one run of each config in a group, sharing the warm up if there
+# is more than one config. The fast engine finds a whole run at once, so its
+# configs each run their own warm up. Returns the outputs of run_replication 
+# for each.
+
+def run_group(run_number, seed, configs, in_worker=False, max_children=1):
+    if len(configs) == 1 or configs[0].fast_engine == True:
+        return [run_replication(run_number, seed, config, in_worker) 
+                for config in configs]
+    return run_warm_start_group(run_number, seed, configs, in_worker, 
+                                max_children)
+
+# Runs the results period of a model warmed up with the warm up config, with
+# the config given. In a forked copy of the model the outputs are sent back 
+# through the connection.
+
+def finish_warm_start(model, config, seed, warm_config, connection=None):
+    model.change_config(config.with_settings(gen_graph=False))
+    model.advance(config.sim_duration + config.warm_up_period)
+    model.finish_run()
+
+    cache = result_cache(config)
+    if cache is not None:
+        cache.store(config, seed, model, warm_config)
+
+    occupancy_graph_df = None
+    if config.gen_graph == True:
+        occupancy_graph_df = model.occupancy_graph_series()
+
+    outputs = (model.run_results(), occupancy_graph_df, 
+               model.recorder.sketches)
+    if connection is not None:
+        connection.send(outputs)
+        connection.close()
+    return outputs
+
+# MSER-5 warm up estimator. The values (in time order) are averaged in 
+# batches of 5, then the number of batches deleted from the start is chosen to
+# give the smallest standard error of the mean of the batches that are left. 
+# At most half of the batches can be deleted. Returns the number of values to
+# delete.
+
+def mser_truncation(values, batch_size=5):
+    number_of_batches = len(values) // batch_size
+    if number_of_batches < 2:
+        return 0
+
+    batches = np.asarray(values[:number_of_batches * batch_size], 
+                         dtype=float).reshape(number_of_batches, 
+                                              batch_size).mean(axis=1)
+
+    # The sums are taken from the end of the values, so position k - 1 gives
+    # the statistic for keeping the last k batches.
+
+    kept = np.arange(1, number_of_batches + 1)
+    sums = np.cumsum(batches[::-1])
+    squares = np.cumsum(batches[::-1] ** 2)
+    statistic = (squares - sums ** 2 / kept) / kept ** 2
+
+    deleted = np.argmin(statistic[::-1][:number_of_batches // 2 + 1])
+    return int(deleted) * batch_size
+
+# This function estimates the warm up period of a config from a pilot run with
+# no warm up period. The MSER-5 point is found for the daily mean ward 
+# occupancy and for the ward queue times of the patients in the order they 
+# arrived, the warm up period is the later of these, rounded up to a whole 
+# day. The nurse queue is left out as it settles within hours, its day to day
+# noise only makes the estimate less stable. The pilot run's seed is made from
+# the master seed with a spawn key none of the runs use, so the pilot doesn't
+# see the same patients as run 0.
+
+def estimate_warm_up(config):
+    day = 1440
+    run_length = config.sim_duration + config.warm_up_period
+    pilot_config = config.with_settings(sim_duration=run_length, 
+                                        warm_up_period=0, auto_warm_up=False,
+                                        write_to_csv=False, gen_graph=False,
+                                        spill_results=False)
+    
+    pilot_seed = None
+    if config.master_seed is not None:
+        pilot_seed = int(np.random.SeedSequence(
+            config.master_seed, spawn_key=(2 ** 32 - 1,)).generate_state(1)[0])
+
+    pilot = model_class(pilot_config)(0, pilot_config, pilot_seed)
+    pilot.run()
+
+    daily_means = pilot.ward_occupancy_monitor.interval_means(day, run_length)
+    warm_up_end = mser_truncation(daily_means) * day
+
+    arrival_times = pilot.results_df["Arrival Time"].to_numpy(dtype=float)
+    q_times = pilot.results_df["Q Time Ward"].to_numpy(dtype=float)
+    recorded = ~np.isnan(q_times)
+    deleted = mser_truncation(q_times[recorded])
+    if deleted > 0:
+        warm_up_end = max(warm_up_end, arrival_times[recorded][deleted])
+
+    return math.ceil(warm_up_end / day) * day
+
+# This function checks the fast engine against the normal model. Each run is
+# carried out with both models and the same seed, as both draw the same 
+# patients the difference between them is compared run by run (a paired 
+# comparison), which shows any difference between them with far fewer runs 
+# than comparing two sets of runs. The engines agree on a result if the 
+# confidence interval of the mean difference includes 0. Returns a 
+# DataFrame with a row for each result, and prints it with the time each 
+# engine took.
+
+def validate_fast_engine(config=None, number_of_runs=30, confidence=0.95):
+    if config is None:
+        config = ScenarioConfig.from_g()
+    config = config.with_settings(write_to_csv=False, gen_graph=False, 
+                                  spill_results=False, fast_engine=False)
+    master_seed = config.master_seed
+    if master_seed is None:
+        master_seed = common_master_seed()
+
+    results = {Model: [], FastModel: []}
+    seconds = {Model: 0.0, FastModel: 0.0}
+    for run, seed in enumerate(run_seeds(master_seed, number_of_runs)):
+        for engine in [Model, FastModel]:
+            start = time.perf_counter()
+            model = engine(run, config, seed)
+            model.run()
+            seconds[engine] += time.perf_counter() - start
+            results[engine].append(model.run_results())
+
+    columns = list(Trial(config).df_trial_results.columns)
+    model_results = np.array(results[Model], dtype=float)
+    fast_results = np.array(results[FastModel], dtype=float)
+    differences = fast_results - model_results
+    if number_of_runs > 1:
+        half_widths = t_quantile((1 + confidence) / 2, number_of_runs - 1) * \
+            differences.std(axis=0, ddof=1) / math.sqrt(number_of_runs)
+    else:
+        half_widths = np.full(len(columns), np.nan)
+
+    df_validation = pd.DataFrame({
+        "Result": columns,
+        "Model Mean": model_results.mean(axis=0),
+        "Fast Engine Mean": fast_results.mean(axis=0),
+        "Mean Difference": differences.mean(axis=0),
+        "CI Half Width": half_widths,
+        "Agrees": np.abs(differences.mean(axis=0)) <= half_widths})
+
+    print(df_validation.to_string(index=False))
+    print(f"Model: {seconds[Model]:.2f}s, fast engine: "
+          f"{seconds[FastModel]:.2f}s "
+          f"({seconds[Model] / seconds[FastModel]:.1f} times faster)")
+    return df_validation
+
+# Running statistics of the results of a trial's runs. The mean and variance
+# of each result are updated as each run is added (Welford's method), so they
+# are available part way through a trial without going back over the stored 
+# runs. Two sets of statistics, eg from runs carried out in different 
+# processes, can be merged into the statistics of all of their runs (Chan's 
+# method). Missing results (NaN) are left out of their column.
+
+class RunningStatistics:
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.count = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.sum_of_squares = np.zeros(size)
+        self.minimum = np.full(size, np.nan)
+        self.maximum = np.full(size, np.nan)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        present = ~np.isnan(values)
+        self.count += present
+        delta = np.where(present, values - self.mean, 0.0)
+        self.mean += np.divide(delta, self.count, out=np.zeros_like(delta),
+                               where=present)
+        self.sum_of_squares += np.where(present, delta * (values - self.mean),
+                                        0.0)
+        self.minimum = np.fmin(self.minimum, values)
+        self.maximum = np.fmax(self.maximum, values)
+
+    def merge(self, other):
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + np.divide(delta * other.count, count, 
+                                          out=np.zeros_like(delta),
+                                          where=count > 0)
+        self.sum_of_squares = self.sum_of_squares + other.sum_of_squares + \
+            np.divide(delta ** 2 * self.count * other.count, count, 
+                      out=np.zeros_like(delta), where=count > 0)
+        self.count = count
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+
+    def standard_deviation(self):
+        return np.sqrt(np.divide(self.sum_of_squares, self.count - 1, 
+                                 out=np.full(len(self.columns), np.nan),
+                                 where=self.count > 1))
+
+    # The half width of the confidence interval of each mean, from Student's
+    # t distribution.
+
+    def half_width(self, confidence=0.95):
+        t_values = np.array([t_quantile((1 + confidence) / 2, count - 1) 
+                             if count > 1 else np.nan 
+                             for count in self.count])
+        return t_values * self.standard_deviation() / \
+            np.sqrt(np.maximum(self.count, 1))
+
+    # Returns a DataFrame with a row for each result.
+
+    def to_frame(self, confidence=0.95):
+        half_width = self.half_width(confidence)
+        percent = f"{confidence:.0%}"
+        return pd.DataFrame({"Mean": self.mean, 
+                             "SD": self.standard_deviation(),
+                             f"{percent} CI Lower": self.mean - half_width,
+                             f"{percent} CI Upper": self.mean + half_width,
+                             "Min": self.minimum, "Max": self.maximum,
+                             "Runs": self.count.astype(int)},
+                            index=pd.Index(self.columns, name="Result"))
+
 # Class representing a Trial for our simulation - a batch of simulation runs.
 
 class Trial:
     
     # The constructor sets up a pandas dataframe that will store the key
-    # results from each run with run number as the index.
+    # results from each run with run number as the index. The config for the
+    # trial is passed in, if it isn't one is made from the g class.
     
-    def  __init__(self):
+    def  __init__(self, config=None):
+        if config is None:
+            config = ScenarioConfig.from_g()
+        self.config = config
+
+        # A dictionary that will store the mean of each result over the trial
+        self.trial_means = {}
+
+        # The number of runs that have been carried out
+        self.runs_used = 0
+
+        # The ward occupancy graph data of each run, if graphs are on
+        self.occupancy_graph_dfs = {}
+
+        # The sketches of the waiting times and stays of every run merged 
+        # together, for their percentiles over the whole trial
+        self.wait_sketches = {column: WaitTimeSketch() 
+                              for column, _, _ in sketch_columns}
+
         self.df_trial_results = pd.DataFrame()
         self.df_trial_results["Run Number"] = [0]
         self.df_trial_results["Mean Q Time Nurse (Mins)"] = [0.0]
@@ -1070,48 +3942,200 @@ class Trial:
         self.df_trial_results["Total Savings"] = [0.0]
         self.df_trial_results.set_index("Run Number", inplace=True)
 
+        # A precision result that isn't one of the results above would be 
+        # skipped when checking the target half width, so the names are 
+        # checked.
+        for column in self.config.precision_results:
+            if column not in self.df_trial_results:
+                raise ValueError(f"Unknown result '{column}' in "
+                                 "precision_results")
+
+        # The running statistics of each result. The live statistics are 
+        # updated as soon as each run finishes, so they are up to date while
+        # the rest of a batch runs. The run statistics (and the rows of the 
+        # trial results) are only updated in run number order, so they are 
+        # the same with any number of workers. Runs that finish before the 
+        # runs before them wait in finished_runs.
+        self.live_statistics = RunningStatistics(
+            self.df_trial_results.columns)
+        self.run_statistics = RunningStatistics(self.df_trial_results.columns)
+        self.finished_runs = {}
+        self.runs_in_order = 0
+
     # Method to run a trial
     
     def run_trial(self):
 
-        # Run the simulation for the number of runs specified in g class.
+        # Run the simulation for the number of runs specified in the config.
         # For each run, we create a new instance of the Model class and call its
         # run method, which sets everything else in motion.  Once the run has
         # completed, we grab out the stored run results 
         # and store it against the run number in the trial results dataframe.
-        
-        for run in range(g.number_of_runs):
-            my_model = Model(run)
-            my_model.run()
-            
-            self.df_trial_results.loc[run] = [my_model.mean_q_time_nurse,
-                                              my_model.\
-                                                number_of_admissions_avoided,
-                                                my_model.mean_q_time_ward,
-                                                my_model.mean_ward_occupancy,
-                                                my_model.admission_delays,
-                                                my_model.mean_los_ward,
-                                                my_model.sdec_financial_savings,
-                                                my_model.medical_staff_cost,
-                                                my_model.savings_sdec,
-                                                my_model.thrombolysis_savings,
-                                                my_model.total_savings]
+        # If a target half width is set, more runs are added until the 
+        # results are precise enough.
+
+        config = self.config
+        master_seed = config.master_seed
+
+        # The seeds of the extra runs have to follow on from the first runs, 
+        # so a master seed is made if one isn't set.
+
+        if config.target_half_width is not None and master_seed is None:
+            master_seed = common_master_seed()
+
+        # The warm up period is found from a pilot run before the trial's runs
+        # if the config asks for it.
+
+        if config.auto_warm_up == True:
+            config = self.config = config.with_settings(
+                warm_up_period=estimate_warm_up(config))
+
+        # If more than one worker is set in the config the runs are shared 
+        # between a pool of processes, otherwise they are run one after 
+        # another in this process.
+
+        executor = None
+        if config.number_of_workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=config.number_of_workers)
+
+        try:
+            runs = range(config.number_of_runs)
+            while len(runs) > 0:
+                seeds = run_seeds(master_seed, runs.stop)
+                self.run_batch(runs, seeds, executor)
+                runs = self.next_runs(config.number_of_workers)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.store_trial_results()
+
+    # Method to carry out a batch of runs, in the pool of processes if one is
+    # given. Each run is added as soon as it finishes, so the live statistics
+    # are up to date while the rest of the batch runs (see add_run_results).
+
+    def run_batch(self, runs, seeds, executor=None):
+        if executor is not None:
+            futures = {executor.submit(run_replication, run, seeds[run],
+                                       self.config, True): run 
+                       for run in runs}
+
+            for future in concurrent.futures.as_completed(futures):
+                run = futures[future]
+                results, occupancy_graph_df, sketches = future.result()
+                self.add_run_results(run, results, occupancy_graph_df, 
+                                     sketches)
+                if occupancy_graph_df is not None and \
+                    self.config.graph_files == False:
+                    plot_ward_occupancy(occupancy_graph_df, run,
+                                        self.config.trials_run_counter,
+                                        self.config)
 
-        if g.write_to_csv == True:
-            self.df_trial_results.to_csv\
-                (f"trial {g.trials_run_counter} trial results.csv", 
+        else:
+            for run in runs:
+                self.add_run_results(run, *run_replication(run, seeds[run], 
+                                                           self.config))
+
+    # Stores the results of a run, the data for its ward occupancy graph if
+    # graphs are on, and adds its waiting time sketches to the trial's. Runs
+    # can be added in any order, the results are stored once every run 
+    # before them has been added.
+
+    def add_run_results(self, run, results, occupancy_graph_df=None,
+                        sketches=None):
+        self.live_statistics.add(results)
+        self.finished_runs[run] = results
+        while self.runs_in_order in self.finished_runs:
+            results_in_order = self.finished_runs.pop(self.runs_in_order)
+            self.df_trial_results.loc[self.runs_in_order] = results_in_order
+            self.run_statistics.add(results_in_order)
+            self.runs_in_order += 1
+        self.runs_used = max(self.runs_used, run + 1)
+        if occupancy_graph_df is not None:
+            self.occupancy_graph_dfs[run] = occupancy_graph_df
+        if sketches is not None:
+            for column, sketch in sketches.items():
+                self.wait_sketches[column].merge(sketch)
+
+    # Returns the percentiles of each waiting time and stay over every 
+    # patient of every run so far, in the units of sketch_columns.
+
+    def wait_time_percentiles(self):
+        rows = {}
+        for column, name, minutes in sketch_columns:
+            sketch = self.wait_sketches[column]
+            rows[name] = {f"P{percentile}": sketch.quantile(percentile / 100)
+                          / minutes for percentile in sketch_percentiles}
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    # Returns the mean and the half width of the confidence interval of each
+    # of the results given (the precision results by default) over the runs
+    # so far.
+
+    def confidence_intervals(self, confidence=0.95, columns=None):
+        if columns is None:
+            columns = self.config.precision_results
+        run_statistics = self.run_statistics
+        half_widths = run_statistics.half_width(confidence)
+        positions = {column: position for position, column 
+                     in enumerate(run_statistics.columns)}
+        return {column: (run_statistics.mean[positions[column]], 
+                         half_widths[positions[column]]) 
+                for column in columns}
+
+    # Checks if the trial needs more runs to meet the target half width. 
+
+    def needs_more_runs(self):
+        config = self.config
+        if config.target_half_width is None or \
+            self.runs_used >= config.max_number_of_runs:
+            return False
+        if self.runs_used < 2:
+            return True
+
+        for mean, half_width in self.confidence_intervals().values():
+            if half_width > config.target_half_width * abs(mean):
+                return True
+        return False
+
+    # Returns the runs to carry out next, a batch of the size given, or no 
+    # runs if the trial doesn't need any more.
+
+    def next_runs(self, batch_size):
+        if self.needs_more_runs() == False:
+            return range(0)
+        return range(self.runs_used, min(self.runs_used + max(1, batch_size),
+                                         self.config.max_number_of_runs))
+
+    # Method to store and print the results of a trial once all of its runs 
+    # have been added to the trial results DataFrame.
+
+    def store_trial_results(self):
+
+        config = self.config
+
+        if config.write_to_csv == True:
+            self.df_trial_results.to_csv(os.path.join(config.output_folder,
+                f"trial {config.trials_run_counter} trial results.csv"), 
                                index=False)
 
-        # This code that will store all averages to compare across 
-        # the different trials. It does this by checking if the attribute
-        # exists in the global g class, and if it doesn't it creates it. It 
-        # then stores the mean of each run against the attribute 
-        # (eg "trial_mean_q_time_nurse")
+        # The ward occupancy of every run is drawn on one graph.
 
-        # The mean is stored against the key of g.trials_run_counter.
+        if config.gen_graph == True and len(self.occupancy_graph_dfs) > 0:
+            plot_ward_occupancy_overlay(self.occupancy_graph_dfs, 
+                                        config.trials_run_counter, config)
 
-        for attr, col in [("trial_mean_q_time_nurse",\
-                           "Mean Q Time Nurse (Mins)"),
+        # This code stores the mean of each run against a key in the trial 
+        # means dictionary (eg "trial_mean_q_time_nurse"), so the averages 
+        # can be compared across the different trials. The means are taken 
+        # from the running statistics rather than the stored runs.
+
+        means = dict(zip(self.run_statistics.columns, 
+                         self.run_statistics.mean))
+
+        for key, col in [("trial_mean_q_time_nurse",\
+                          "Mean Q Time Nurse (Mins)"),
             ("trial_number_of_admissions_avoided",\
               "Number of Admissions Avoided In Run"),
             ("trial_mean_q_time_ward", "Mean Q Time Ward (Hour)"),
@@ -1124,184 +4148,1222 @@ class Trial:
             ("trial_thrombolysis_savings", "Thrombolysis Savings (£)"),
             ("trial_total_savings", "Total Savings")]:
 
-        # Checks to see if the attribute already exists and if it doesn't 
-        # create it. Creates a mean of each trial and creates a dictionary 
-        # that can be read later.
-
-            if not hasattr(g, attr):
-                setattr(g, attr, {})
-            getattr(g, attr)[g.trials_run_counter] = \
-                round(self.df_trial_results[col].mean(), 2)
+            self.trial_means[key] = round(means[col], 2)
 
         # Code to store the configuration that was used for this trial.
         
         self.trial_info = (
-            f"Trial {g.trials_run_counter}, SDEC Therapy = {g.therapy_sdec},"\
-                 f" SDEC Open % = {sdec_value}, CTP Open % = {ctp_value}")
+            f"Trial {config.trials_run_counter}, SDEC Therapy = "\
+                 f"{config.therapy_sdec}, SDEC Open % = "\
+                 f"{config.sdec_open_percent}, CTP Open % = "\
+                 f"{config.ctp_open_percent}")
+
+        means = self.trial_means
 
         print ("---------------------------------------------------")
         print(f"{self.trial_info}")
-        print(f"Trial {g.trials_run_counter} Results:")
+        print(f"Trial {config.trials_run_counter} Results:")
         print (" ")
         print(f"Trial Mean Q Time Nurse (Mins):     \
-              {g.trial_mean_q_time_nurse[g.trials_run_counter]}")
+              {means['trial_mean_q_time_nurse']}")
         print(f"Trial Number of Admissions Avoided: \
-              {g.trial_number_of_admissions_avoided[g.trials_run_counter]}")
+              {means['trial_number_of_admissions_avoided']}")
         print(f"Trial Mean Q Time Ward (Hours):     \
-              {g.trial_mean_q_time_ward[g.trials_run_counter]}")
+              {means['trial_mean_q_time_ward']}")
         print(f"Trial Mean Ward Occupancy:          \
-              {g.trial_mean_occupancy[g.trials_run_counter]}")
+              {means['trial_mean_occupancy']}")
         print(f"Trial Number of Admission Delays:   \
-              {g.trial_number_of_admission_delays[g.trials_run_counter]}")
+              {means['trial_number_of_admission_delays']}")
         print(f"Trial SDEC Total Savings (£):       \
-              {g.trial_financial_savings_of_a_a[g.trials_run_counter]}")
+              {means['trial_financial_savings_of_a_a']}")
         print(f"Trial SDEC Medical Cost (£):        \
-              {g.sdec_medical_cost[g.trials_run_counter]}")
+              {means['sdec_medical_cost']}")
         print(f"Trial SDEC Savings - Cost (£):      \
-              {g.trial_sdec_financial_savings[g.trials_run_counter]}")
+              {means['trial_sdec_financial_savings']}")
         print(f"Trial Thrombolysis Savings (£):     \
-              {g.trial_thrombolysis_savings[g.trials_run_counter]}")
+              {means['trial_thrombolysis_savings']}")
         print(f"Trial Total Savings (£):            \
-              {g.trial_total_savings[g.trials_run_counter]}")
-        
-# This code asks the user if they want to generate cvs per run
+              {means['trial_total_savings']}")
+        print(f"Trial Number of Runs:               \
+              {self.runs_used}")
+        if config.auto_warm_up == True:
+            print(f"Trial Warm Up Period (Days):        \
+              {config.warm_up_period / 1440}")
 
-csv_input = False
+        # The spread of every result over the runs, with the 95% confidence
+        # interval of its mean.
 
-while csv_input == False:
+        print(" ")
+        print(self.run_statistics.to_frame().round(2).to_string())
 
-    csv_value = input ("Write results to CSV? Yes / No")
-    if csv_value == "Yes" or csv_value == "yes":
-        g.write_to_csv = True
-        csv_input = True
-    elif csv_value == "No" or csv_value == "no":
-        g.write_to_csv = False
-        csv_input = True
-    else:
-        print ("Invalid Input Please Try Again")
+        # The percentiles of the waiting times and stays of every patient.
 
-#This code asks the user if they want to generate a graph per run
-graph_input = False
+        print(" ")
+        print(self.wait_time_percentiles().round(2).to_string())
+        
+# The columns of the combined results and the trial results column each one
+# is taken from.
+
+combined_result_columns = [
+    ("Mean Q Time Nurse (Mins)", "Mean Q Time Nurse (Mins)"),
+    ("Number of Admissions Avoided In Run", 
+     "Number of Admissions Avoided In Run"),
+    ("Mean Q Time Ward (Hours)", "Mean Q Time Ward (Hour)"),
+    ("Mean Occupancy", "Mean Occupancy"),
+    ("Number of Admission Delays", "Number of Admission Delays"),
+    ("Total SDEC Savings (£)", "Financial Savings of Admissions Avoidance (£)"),
+    ("Total SDEC Staff Cost (£)", "SDEC Medical Staff Cost (£)"),
+    ("SDEC Savings - Costs (£)", "SDEC Savings (£)"),
+    ("Thrombolysis Savings (£)", "Thrombolysis Savings (£)"),
+    ("Total Savings (£)", "Total Savings")]
+
+# Returns the standard deviation, 95% confidence interval half width, minimum 
+# and maximum of each result of a trial over its runs, from its running 
+# statistics.
+
+def trial_spread(trial):
+    df_statistics = trial.run_statistics.to_frame()
+    spread = {}
+    for name, column in combined_result_columns:
+        row = df_statistics.loc[column]
+        spread[f"{name} SD"] = row["SD"]
+        spread[f"{name} CI Half Width"] = row["95% CI Upper"] - row["Mean"]
+        spread[f"{name} Min"] = row["Min"]
+        spread[f"{name} Max"] = row["Max"]
+    return spread
+
+# Returns the percentiles of the waiting times and stays of a trial as 
+# columns of the combined results, eg "Nurse Queue Time (Mins) P95".
+
+def trial_percentiles(trial):
+    df_percentiles = trial.wait_time_percentiles()
+    return {f"{name} {percentile}": value for name, row in 
+            df_percentiles.iterrows() for percentile, value in row.items()}
+
+# This function combines the results of a list of trials into a single 
+# DataFrame, with one row per trial.
+
+def combine_trial_results(trials):
+    combined_results = {
+        trial.config.trials_run_counter: {
+            "Mean Q Time Nurse (Mins)": 
+                trial.trial_means["trial_mean_q_time_nurse"],
+            "Number of Admissions Avoided In Run": \
+                trial.trial_means["trial_number_of_admissions_avoided"],
+            "Mean Q Time Ward (Hours)": 
+                trial.trial_means["trial_mean_q_time_ward"],
+            "Mean Occupancy": trial.trial_means["trial_mean_occupancy"],
+            "Number of Admission Delays": \
+                trial.trial_means["trial_number_of_admission_delays"],
+            "Total SDEC Savings (£)":\
+                trial.trial_means["trial_financial_savings_of_a_a"],
+            "Total SDEC Staff Cost (£)": 
+                trial.trial_means["sdec_medical_cost"],
+            "SDEC Savings - Costs (£)": \
+                trial.trial_means["trial_sdec_financial_savings"],
+            "Thrombolysis Savings (£)":\
+                trial.trial_means["trial_thrombolysis_savings"],
+            "Total Savings (£)": trial.trial_means["trial_total_savings"],
+            "Number of Runs": trial.runs_used,
+            "Warm Up Period (Days)": trial.config.warm_up_period / 1440,
+            **trial_spread(trial), **trial_percentiles(trial)}
+        for trial in trials}
+
+    df_all_trial_results = pd.DataFrame.from_dict(combined_results, 
+                                                  orient='index')
+    df_all_trial_results.index.name = 'Trial Number'
+    return df_all_trial_results
+
+# This function returns the quantile of Student's t distribution, used for the
+# confidence intervals. The model doesn't use SciPy, so for 1 and 2 degrees of
+# freedom the exact formula is used and for more the quantile is found from 
+# the normal quantile with the Cornish-Fisher expansion, which is within 0.2%
+# of the exact value for a 95% interval.
+
+def t_quantile(p, degrees_of_freedom):
+    if degrees_of_freedom == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if degrees_of_freedom == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = statistics.NormalDist().inv_cdf(p)
+    v = degrees_of_freedom
+    return (z + (z**3 + z) / (4 * v) + 
+            (5 * z**5 + 16 * z**3 + 3 * z) / (96 * v**2) +
+            (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * v**3) +
+            (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 
+            (92160 * v**4))
+
+# This function returns the master seed shared by the trials when common 
+# random numbers are used and no master seed has been set.
+
+def common_master_seed():
+    return int(np.random.SeedSequence().entropy)
+
+# This function compares each trial with the first trial, run by run. With 
+# common random numbers run k of each trial sees the same patients, so the 
+# difference between the trials in run k is mostly down to the change in 
+# settings rather than chance. For every result the mean difference and its 
+# confidence interval over the runs are returned, one row per trial and result.
+
+def paired_differences(trials, names=None, confidence=0.95):
+    if names is None:
+        names = [f"Trial {trial.config.trials_run_counter}" 
+                 for trial in trials]
+
+    baseline = trials[0].df_trial_results
+    rows = []
+    for name, trial in zip(names[1:], trials[1:]):
+        runs = baseline.index.intersection(trial.df_trial_results.index)
+        differences = trial.df_trial_results.loc[runs] - baseline.loc[runs]
+        number_of_runs = len(runs)
+
+        for column in differences.columns:
+            mean_difference = differences[column].mean()
+            if number_of_runs > 1:
+                half_width = t_quantile(0.5 + confidence / 2, 
+                                        number_of_runs - 1) * \
+                    differences[column].std() / math.sqrt(number_of_runs)
+            else:
+                half_width = np.nan
 
-while graph_input == False:
+            rows.append({"Trial": name,
+                         "Compared To": names[0],
+                         "Result": column,
+                         "Mean Difference": mean_difference,
+                         "CI Lower": mean_difference - half_width,
+                         "CI Upper": mean_difference + half_width,
+                         "Runs": number_of_runs})
 
-    graph_value = input ("Generate graph per run? Yes / No")
-    if graph_value == "Yes" or graph_value == "yes":
-        g.gen_graph = True
-        graph_input = True
-    elif graph_value == "No" or graph_value == "no":
-        g.gen_graph = False
-        graph_input = True
-    else:
-        print ("Invalid Input Please Try Again")
+    return pd.DataFrame(rows, columns=["Trial", "Compared To", "Result",
+                                       "Mean Difference", "CI Lower", 
+                                       "CI Upper", "Runs"])
 
+# This function runs the model interactively, asking the user for the settings
+# of three trials in turn.
 
-for x in range(3):
+def run_interactive():
 
-    # Code to ask the user how many beds are active on the unit.
+    # This code asks the user if they want to generate cvs per run
 
-    user_ward_beds = False
+    csv_input = False
 
-    while user_ward_beds == False:
+    while csv_input == False:
 
-        g.number_of_ward_beds = int(input("Choose Number of Ward Beds"))
-        if g.number_of_ward_beds > 0:
-            user_ward_beds = True
+        csv_value = input ("Write results to CSV? Yes / No")
+        if csv_value == "Yes" or csv_value == "yes":
+            g.write_to_csv = True
+            csv_input = True
+        elif csv_value == "No" or csv_value == "no":
+            g.write_to_csv = False
+            csv_input = True
         else:
             print ("Invalid Input Please Try Again")
 
-    # This code asks if the user wants to have full therapy support for the SDEC
+    #This code asks the user if they want to generate a graph per run
+    graph_input = False
 
-    therapy_input = False
+    while graph_input == False:
 
-    while therapy_input == False:
-
-        therapy_value = input ("Run SDEC with Full Therapy Support? Yes / No")
-        if therapy_value == "Yes" or therapy_value == "yes":
-            g.therapy_sdec = True
-            therapy_input = True
-        elif therapy_value == "No" or therapy_value == "no":
-            g.therapy_sdec = False
-            therapy_input = True
+        graph_value = input ("Generate graph per run? Yes / No")
+        if graph_value == "Yes" or graph_value == "yes":
+            g.gen_graph = True
+            graph_input = True
+        elif graph_value == "No" or graph_value == "no":
+            g.gen_graph = False
+            graph_input = True
         else:
             print ("Invalid Input Please Try Again")
 
-    # This code asks the user how long the SDEC should be unavailable for, as a 
-    # % of days.
 
-    sdec_input = False
+    # With common random numbers every trial is given the same master seed,
+    # so run k of each trial sees the same patients.
 
-    while sdec_input == False:
+    if g.common_random_numbers == True and g.master_seed is None:
+        g.master_seed = common_master_seed()
 
-        sdec_value = int(input("What percentage of the day should the SDEC " \
-        "be available? (0-100)"))
-        if sdec_value <= 100 and sdec_value >= 0:
-            g.sdec_unav_freq = 1440 * (sdec_value / 100)
-            g.sdec_unav_time = 1440 - g.sdec_unav_freq
-            sdec_input = True
-        elif sdec_value == 100:
-            g.sdec_unav_freq = g.sim_duration * 2
-            g.sdec_unav_time = 0
-            sdec_input = True
-        else:
-            print ("Invalid Input Please Try Again")
+    trials = []
 
-    # This code asks the user how long the SDEC should be unavailable for, as a 
-    # % of days.
+    for x in range(3):
 
-    ctp_input = False
+        # Code to ask the user how many beds are active on the unit.
 
-    while ctp_input == False:
+        user_ward_beds = False
 
-        ctp_value = int(input("What percentage of the day should the CTP " \
-        "be available? (0-100)"))
-        if ctp_value <= 100 and ctp_value >= 0:
-            g.ctp_unav_freq = 1440 * (ctp_value / 100)
-            g.ctp_unav_time = 1440 - g.ctp_unav_freq
-            ctp_input = True
-        elif sdec_value == 100:
-            g.ctp_unav_freq = g.sim_duration * 2
-            g.ctp_unav_time = 0
-            sdec_input = True
-        else:
-            print ("Invalid Input Please Try Again")
+        while user_ward_beds == False:
 
-    # Create an instance of the Trial class
-    my_trial = Trial()
+            g.number_of_ward_beds = int(input("Choose Number of Ward Beds"))
+            if g.number_of_ward_beds > 0:
+                user_ward_beds = True
+            else:
+                print ("Invalid Input Please Try Again")
 
-    # Call the run_trial method of our Trial object
-    my_trial.run_trial()
+        # This code asks if the user wants to have full therapy support for the SDEC
 
-    g.trials_run_counter += 1
+        therapy_input = False
 
-print ("All Trials Completed")
+        while therapy_input == False:
 
+            therapy_value = input ("Run SDEC with Full Therapy Support? Yes / No")
+            if therapy_value == "Yes" or therapy_value == "yes":
+                g.therapy_sdec = True
+                therapy_input = True
+            elif therapy_value == "No" or therapy_value == "no":
+                g.therapy_sdec = False
+                therapy_input = True
+            else:
+                print ("Invalid Input Please Try Again")
 
-# Combine all trial results into a single dictionary.
+        # This code asks the user how long the SDEC should be unavailable for, as a 
+        # % of days.
 
-trial_numbers = g.trial_sdec_financial_savings.keys()
-combined_results = {
-    trial: {
-        "Mean Q Time Nurse (Mins)": g.trial_mean_q_time_nurse.get(trial, None),
-        "Number of Admissions Avoided In Run": \
-            g.trial_number_of_admissions_avoided.get(trial, None),
-        "Mean Q Time Ward (Hours)": g.trial_mean_q_time_ward.get(trial, None),
-        "Mean Occupancy": g.trial_mean_occupancy.get(trial, None),
-        "Number of Admission Delays": \
-            g.trial_number_of_admission_delays.get(trial, None),
-        "Total SDEC Savings (£)":\
-            g.trial_financial_savings_of_a_a.get(trial, None),\
-            "Total SDEC Staff Cost (£)": g.sdec_medical_cost.get(trial, None),
-        "SDEC Savings - Costs (£)": \
-            g.trial_sdec_financial_savings.get(trial, None),
-        "Thrombolysis Savings (£)":\
-              g.trial_thrombolysis_savings.get(trial, None),
-        "Total Savings (£)": g.trial_total_savings.get(trial, None)}
-    for trial in trial_numbers}
+        sdec_input = False
 
-df_all_trial_results = pd.DataFrame.from_dict(combined_results, orient='index')
-df_all_trial_results.index.name = 'Trial Number'
+        while sdec_input == False:
 
-if g.write_to_csv == True:
-    df_all_trial_results.to_csv("all_trial_results.csv", 
-                               index=False)
+            sdec_value = int(input("What percentage of the day should the SDEC " \
+            "be available? (0-100)"))
+            if sdec_value <= 100 and sdec_value >= 0:
+                set_sdec_open_percent(sdec_value)
+                sdec_input = True
+            else:
+                print ("Invalid Input Please Try Again")
+
+        # This code asks the user how long the CTP should be unavailable for, as a 
+        # % of days.
+
+        ctp_input = False
+
+        while ctp_input == False:
+
+            ctp_value = int(input("What percentage of the day should the CTP " \
+            "be available? (0-100)"))
+            if ctp_value <= 100 and ctp_value >= 0:
+                set_ctp_open_percent(ctp_value)
+                ctp_input = True
+            else:
+                print ("Invalid Input Please Try Again")
+
+        # Create an instance of the Trial class, using the settings that have
+        # just been entered in the g class
+        my_trial = Trial(ScenarioConfig.from_g())
+
+        # Call the run_trial method of our Trial object
+        my_trial.run_trial()
+        trials.append(my_trial)
+
+        g.trials_run_counter += 1
+
+    print ("All Trials Completed")
+
+    # Combine all trial results into a single DataFrame.
+
+    df_all_trial_results = combine_trial_results(trials)
+
+    if g.write_to_csv == True:
+        df_all_trial_results.to_csv(os.path.join(g.output_folder,
+                                                 "all_trial_results.csv"), 
+                                   index=False)
+
+    # With common random numbers, the difference between each trial and the
+    # first trial is shown with a confidence interval.
+
+    if g.common_random_numbers == True:
+        df_paired_differences = paired_differences(trials)
+        print ("---------------------------------------------------")
+        print ("Paired Differences Compared To Trial 1:")
+        print (df_paired_differences.to_string(index=False))
+
+        if g.write_to_csv == True:
+            df_paired_differences.to_csv(os.path.join(g.output_folder,
+                                         "paired_differences.csv"), 
+                                         index=False)
+
+# This function reads a scenario file for the batch runner. The file is a JSON
+# file that can contain "settings" that are applied to every scenario, a list
+# of "scenarios" and a "grid" of settings that is expanded into one scenario 
+# for every combination of values. A file that is just a list is read as a 
+# list of scenarios. Each scenario is a dictionary of g class values to 
+# change, plus an optional "name".
+
+def load_scenarios(path):
+
+    with open(path) as scenario_file:
+        scenario_data = json.load(scenario_file)
+
+    if isinstance(scenario_data, list):
+        scenario_data = {"scenarios": scenario_data}
+
+    settings = scenario_data.get("settings", {})
+    scenarios = [dict(scenario) for scenario in 
+                 scenario_data.get("scenarios", [])]
+
+    grid = scenario_data.get("grid", {})
+    if grid:
+        names = list(grid.keys())
+        for values in itertools.product(*[grid[name] for name in names]):
+            scenarios.append(dict(zip(names, values)))
+
+    if not scenarios:
+        scenarios = [{}]
+
+    # Every value is checked against the scenario config so that a typo in 
+    # the scenario file doesn't go unnoticed.
+
+    known_settings = set(ScenarioConfig.setting_names())
+    for scenario in [settings] + scenarios:
+        for name in scenario:
+            if name != "name" and name not in known_settings:
+                raise ValueError(f"Unknown setting '{name}' in scenario file")
+
+    # The precision results are checked against the results of a trial, in
+    # the same way, before any runs are carried out.
+
+    result_names = Trial(ScenarioConfig.from_g()).df_trial_results.columns
+    for scenario in [settings] + scenarios:
+        for column in scenario.get("precision_results") or []:
+            if column not in result_names:
+                raise ValueError(f"Unknown result '{column}' in "
+                                 "precision_results")
+
+    for number, scenario in enumerate(scenarios, start=1):
+        scenario.setdefault("name", f"Scenario {number}")
+        for name, value in settings.items():
+            scenario.setdefault(name, value)
+
+    return scenarios
+
+# This function runs a list of scenarios without asking the user for any 
+# input. Every run of every scenario is shared between a single pool of worker
+# processes, so all of the scenarios are run at the same time. Each scenario is
+# stored as a trial, and the results are written to the output folder as 
+# "all_trial_results.csv" (one row per scenario) and "scenario_summary.json".
+
+def run_scenarios(scenarios, workers, output_folder):
+
+    os.makedirs(output_folder, exist_ok=True)
+    base_config = ScenarioConfig.from_g()
+
+    # A config is made for each scenario from the g class and the settings of
+    # the scenario, the trial number is set to the scenario number so the CSV
+    # files for each scenario have different names.
+
+    configs = []
+    for number, scenario in enumerate(scenarios, start=1):
+        settings = {name: value for name, value in scenario.items()
+                    if name != "name"}
+        configs.append(base_config.with_settings(**settings, 
+                                                 trials_run_counter=number,
+                                                 output_folder=output_folder))
+
+    # Scenarios using common random numbers or sharing their warm up without
+    # a master seed are all given the same master seed, so run k of each of 
+    # them sees the same patients.
+
+    shared_seed = common_master_seed()
+    configs = [config.with_settings(master_seed=shared_seed) 
+               if (config.common_random_numbers == True or 
+                   config.share_warm_up == True) and 
+               config.master_seed is None else config for config in configs]
+
+    # Scenarios with a target half width need a master seed so the seeds of 
+    # the runs added later follow on from the first runs.
+
+    configs = [config.with_settings(master_seed=common_master_seed())
+               if config.target_half_width is not None and 
+               config.master_seed is None else config for config in configs]
+
+    # The runs are shared between a pool of processes if more than one worker
+    # is given.
+
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        # The warm up period of each scenario that asks for it is found from 
+        # a pilot run, the pilot runs are carried out side by side.
+
+        auto_numbers = [number for number, config in enumerate(configs) 
+                        if config.auto_warm_up == True]
+        auto_configs = [configs[number] for number in auto_numbers]
+        if executor is not None:
+            warm_up_periods = list(executor.map(estimate_warm_up, 
+                                                auto_configs))
+        else:
+            warm_up_periods = [estimate_warm_up(config) 
+                               for config in auto_configs]
+        for number, warm_up_period in zip(auto_numbers, warm_up_periods):
+            configs[number] = configs[number].with_settings(
+                warm_up_period=warm_up_period)
+
+        trials = [Trial(config) for config in configs]
+
+        # Scenarios that share their warm up are put in a group with the 
+        # other scenarios they can share it with, every other scenario is in
+        # a group of its own. Each task carries out one run of every scenario
+        # in a group.
+
+        groups = {}
+        for number, config in enumerate(configs):
+            if config.share_warm_up == True:
+                key = warm_start_key(config)
+            else:
+                key = number
+            groups.setdefault(key, []).append(number)
+
+        tasks = []
+        for numbers in groups.values():
+            config = configs[numbers[0]]
+            for run, seed in enumerate(run_seeds(config.master_seed,
+                                                 config.number_of_runs)):
+                tasks.append((numbers, run, seed))
+
+        # The runs are put back together into a trial for each scenario. Once
+        # the first runs are done, scenarios with a target half width that 
+        # hasn't been met are given another batch of runs, the workers are 
+        # shared between these scenarios.
+
+        # The results of each run are added to its trial as soon as the run
+        # finishes, so the live statistics of every trial stay up to date. 
+        # The trial stores them in run order, so the results are the same 
+        # with any number of workers.
+
+        while len(tasks) > 0:
+            max_children = max(1, workers // len(tasks))
+            if executor is not None:
+                futures = {executor.submit(run_group, run, seed,
+                                           [configs[number] for number 
+                                            in numbers], True, 
+                                           max_children): (numbers, run)
+                           for numbers, run, seed in tasks}
+                run_outputs = ((futures[future], future.result()) for future 
+                               in concurrent.futures.as_completed(futures))
+            else:
+                run_outputs = (((numbers, run), 
+                                run_group(run, seed, [configs[number] for 
+                                                      number in numbers]))
+                               for numbers, run, seed in tasks)
+
+            for (numbers, run), outputs in run_outputs:
+                for number, run_output in zip(numbers, outputs):
+                    trials[number].add_run_results(run, *run_output)
+
+            pending = [number for number, trial in enumerate(trials)
+                       if trial.needs_more_runs() == True]
+            tasks = []
+            for number in pending:
+                runs = trials[number].next_runs(max(1, workers // 
+                                                    len(pending)))
+                seeds = run_seeds(configs[number].master_seed, runs.stop)
+                tasks.extend(([number], run, seeds[run]) for run in runs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # The trial results are stored in the same way as the interactive model.
+
+    for trial in trials:
+        trial.store_trial_results()
+
+    df_all_trial_results = combine_trial_results(trials)
+
+    # The scenario name and the settings that were changed are added to the
+    # start of the combined results so each row can be identified.
+
+    setting_names = ["name"]
+    for scenario in scenarios:
+        for name in scenario:
+            if name not in setting_names:
+                setting_names.append(name)
+
+    for position, name in enumerate(setting_names):
+        df_all_trial_results.insert(position, 
+            "Scenario" if name == "name" else name,
+            [scenario.get(name, getattr(config, name, None)) 
+             for scenario, config in zip(scenarios, configs)])
+
+    df_all_trial_results.to_csv(os.path.join(output_folder,
+                                             "all_trial_results.csv"), 
+                                index=False)
+
+    summary = []
+    for number, (scenario, trial) in enumerate(zip(scenarios, trials), 
+                                               start=1):
+        summary.append({
+            "trial_number": number,
+            "name": scenario["name"],
+            "settings": {name: value for name, value in scenario.items()
+                         if name != "name"},
+            "number_of_runs": trial.runs_used,
+            "warm_up_period": trial.config.warm_up_period,
+            "trial_means": {column: float(value) for column, value in 
+                            zip(trial.run_statistics.columns, 
+                                trial.run_statistics.mean)},
+            "wait_time_percentiles": trial_percentiles(trial),
+            "runs": trial.df_trial_results.sort_index().to_dict(
+                orient="list")})
+
+    # The scenarios that share the first scenario's master seed are compared
+    # with it run by run, this is only done with common random numbers.
+
+    paired_trials = [trial for trial in trials 
+                     if trial.config.common_random_numbers == True and
+                     trial.config.master_seed == trials[0].config.master_seed]
+    summary_differences = []
+    if trials[0] in paired_trials and len(paired_trials) > 1:
+        df_paired_differences = paired_differences(
+            paired_trials, [scenarios[trials.index(trial)]["name"] 
+                            for trial in paired_trials])
+        df_paired_differences.to_csv(os.path.join(output_folder,
+                                     "paired_differences.csv"), index=False)
+        summary_differences = df_paired_differences.to_dict(orient="records")
+
+    with open(os.path.join(output_folder, "scenario_summary.json"), 
+              "w") as summary_file:
+        json.dump({"scenarios": summary, 
+                   "paired_differences": summary_differences}, 
+                  summary_file, indent=2)
+
+    return df_all_trial_results
+
+# This function makes a Latin hypercube sample of points in the unit cube, 
+# each setting's range is split into as many equal parts as there are points
+# and each part is used by exactly one point.
+
+def latin_hypercube(number_of_points, dimensions, rng):
+    parts = rng.permuted(np.tile(np.arange(number_of_points), 
+                                 (dimensions, 1)), axis=1).T
+    return (parts + rng.random((number_of_points, dimensions))) / \
+        number_of_points
+
+# Metamodel (emulator) of the trial results. A polynomial response surface is
+# fitted by least squares to the results of trials carried out at a design of
+# points over a range of each setting, it can then predict the results at any
+# point in the ranges in a fraction of a second. Each prediction comes with its
+# standard error and a 95% prediction interval for the mean of a trial at that
+# point. Points outside the ranges the metamodel was trained on are flagged,
+# as the response surface can't be trusted there, and can be run as real 
+# trials which are then added to the training data.
+#
+# The trials are run as scenarios (see run_scenarios), so the runs of every 
+# trial in a batch are shared between the workers. The first batch is a Latin
+# hypercube, each batch after that is the set of points where the predictions
+# are least certain. The uncertainty of a least squares fit doesn't depend on
+# the results, so a whole batch can be picked before any of it is run.
+
+class Metamodel:
+
+    # Settings that only take whole numbers or True / False.
+
+    integer_settings = {"number_of_ward_beds", "number_of_nurses", 
+                        "number_of_ctp", "sdec_beds"}
+    boolean_settings = {"therapy_sdec"}
+
+    # The trial results that are predicted, by default.
+
+    default_outputs = ["Mean Q Time Nurse (Mins)", 
+                       "Number of Admissions Avoided In Run",
+                       "Mean Q Time Ward (Hours)", "Mean Occupancy",
+                       "Number of Admission Delays", "Total SDEC Savings (£)",
+                       "Total SDEC Staff Cost (£)", "SDEC Savings - Costs (£)",
+                       "Thrombolysis Savings (£)", "Total Savings (£)"]
+
+    # The ranges are given as {setting: (lowest, highest)}, the base settings
+    # are used for every trial (eg the number of runs). A degree of 2 fits 
+    # the squares of the settings and each pair of settings multiplied 
+    # together as well as the settings themselves.
+
+    def __init__(self, ranges, base_settings=None, degree=2, outputs=None):
+        self.ranges = {name: (float(low), float(high)) 
+                       for name, (low, high) in ranges.items()}
+        self.settings = list(self.ranges)
+        self.base_settings = dict(base_settings or {})
+        self.degree = degree
+        self.outputs = list(outputs or self.default_outputs)
+        self.design = np.zeros((0, len(self.settings)))
+        self.results = np.zeros((0, len(self.outputs)))
+        self.coefficients = None
+
+    # Scales points (one row per point) so each range goes from -1 to 1.
+
+    def scale(self, points):
+        low = np.array([self.ranges[name][0] for name in self.settings])
+        high = np.array([self.ranges[name][1] for name in self.settings])
+        return 2 * (np.asarray(points, dtype=float) - low) / \
+            np.where(high > low, high - low, 1) - 1
+
+    # The terms of the polynomial for each point. True / False settings 
+    # don't have a squared term, as it would be the same as the setting.
+
+    def terms(self, points):
+        x = np.atleast_2d(self.scale(points))
+        columns = [np.ones(len(x))]
+        columns += [x[:, i] for i in range(x.shape[1])]
+        if self.degree >= 2:
+            for i, j in itertools.combinations(range(x.shape[1]), 2):
+                columns.append(x[:, i] * x[:, j])
+            for i, name in enumerate(self.settings):
+                if name not in self.boolean_settings:
+                    columns.append(x[:, i] ** 2)
+        return np.column_stack(columns)
+
+    # Turns points in the unit cube into settings in the ranges, whole number
+    # and True / False settings are rounded.
+
+    def unit_to_settings(self, unit_points):
+        points = np.array([[low + value * (high - low) for value, 
+                            (low, high) in zip(row, self.ranges.values())]
+                           for row in unit_points])
+        for i, name in enumerate(self.settings):
+            if name in self.integer_settings or name in self.boolean_settings:
+                points[:, i] = np.round(points[:, i])
+        return points
+
+    # Picks the points of the next batch. The first batch is a Latin 
+    # hypercube, after that points are taken one at a time from a large 
+    # Latin hypercube of candidates, each time the candidate with the 
+    # largest prediction variance given the design so far (and the points 
+    # already picked for the batch).
+
+    def next_batch(self, number_of_points, rng, candidates_per_point=200):
+        if len(self.design) == 0:
+            return self.unit_to_settings(latin_hypercube(
+                number_of_points, len(self.settings), rng))
+
+        candidates = self.unit_to_settings(latin_hypercube(
+            number_of_points * candidates_per_point, len(self.settings), rng))
+        candidate_terms = self.terms(candidates)
+        design_terms = self.terms(self.design)
+
+        batch = []
+        for _ in range(number_of_points):
+            inverse = np.linalg.pinv(design_terms.T @ design_terms)
+            variance = np.einsum("ij,jk,ik->i", candidate_terms, inverse,
+                                 candidate_terms)
+            best = int(np.argmax(variance))
+            batch.append(candidates[best])
+            design_terms = np.vstack([design_terms, candidate_terms[best]])
+        return np.array(batch)
+
+    # Makes the scenario for a point, with the base settings.
+
+    def point_scenario(self, point, name):
+        scenario = {"name": name, **self.base_settings}
+        for value, setting in zip(point, self.settings):
+            if setting in self.boolean_settings:
+                scenario[setting] = bool(value)
+            elif setting in self.integer_settings:
+                scenario[setting] = int(value)
+            else:
+                scenario[setting] = float(value)
+        return scenario
+
+    # Runs a trial at each of the points and adds the results to the 
+    # training data. The trials of each call are written to their own folder.
+
+    def run_points(self, points, workers, output_folder):
+        first = len(self.design)
+        scenarios = [self.point_scenario(point, f"Design {first + number}") 
+                     for number, point in enumerate(points)]
+        df_results = run_scenarios(scenarios, workers, os.path.join(
+            output_folder, f"design {first}-{first + len(points) - 1}"))
+        self.add_results(points, df_results[self.outputs].to_numpy(float))
+        return df_results
+
+    def add_results(self, points, results):
+        self.design = np.vstack([self.design, np.atleast_2d(points)])
+        self.results = np.vstack([self.results, np.atleast_2d(results)])
+        self.fit()
+
+    # Trains the metamodel, with a first batch and then the given number of
+    # batches at the least certain points. Returns the combined results of 
+    # every trial.
+
+    def train(self, initial_points, batch_points, batches, workers, 
+              output_folder, seed=None):
+        rng = np.random.default_rng(seed)
+        all_results = [self.run_points(self.next_batch(initial_points, rng),
+                                       workers, output_folder)]
+        for _ in range(batches):
+            all_results.append(self.run_points(
+                self.next_batch(batch_points, rng), workers, output_folder))
+        return pd.concat(all_results, ignore_index=True)
+
+    # Fits the response surface of each output by least squares. The 
+    # residual variance is used for the uncertainty of the predictions, it
+    # can only be found if there are more trials than terms.
+
+    def fit(self):
+        design_terms = self.terms(self.design)
+        self.inverse = np.linalg.pinv(design_terms.T @ design_terms)
+        self.coefficients = self.inverse @ design_terms.T @ self.results
+
+        self.degrees_of_freedom = len(self.design) - design_terms.shape[1]
+        if self.degrees_of_freedom > 0:
+            residuals = self.results - design_terms @ self.coefficients
+            self.residual_variance = (residuals ** 2).sum(axis=0) / \
+                self.degrees_of_freedom
+        else:
+            self.residual_variance = np.full(len(self.outputs), np.nan)
+
+    # Makes a point from the settings of a query, settings that aren't given
+    # take their value from the base settings (or the g class). If the 
+    # percentage of the day the SDEC or CTP is open hasn't been set it is 
+    # found from the times it is closed, a closed time of 0 means always open.
+
+    def query_point(self, query):
+        defaults = ScenarioConfig.from_g().with_settings(**self.base_settings)
+        point = []
+        for name in self.settings:
+            value = query.get(name, getattr(defaults, name))
+            if value is None and name in ("sdec_open_percent", 
+                                          "ctp_open_percent"):
+                unit = name.split("_")[0]
+                unav_time = getattr(defaults, f"{unit}_unav_time")
+                unav_freq = getattr(defaults, f"{unit}_unav_freq")
+                value = 100 if unav_time == 0 else \
+                    100 * unav_freq / (unav_freq + unav_time)
+            point.append(float(value))
+        return np.array(point)
+
+    # Returns the settings of a query that are outside the trained ranges.
+
+    def outside_ranges(self, query):
+        point = self.query_point(query)
+        return [name for value, name in zip(point, self.settings)
+                if not self.ranges[name][0] <= value <= self.ranges[name][1]]
+
+    # Predicts the trial results for a query, eg 
+    # predict({"number_of_ward_beds": 4, "sdec_open_percent": 70}). Returns 
+    # a DataFrame with a row for each output.
+
+    def predict(self, query):
+        point_terms = self.terms(self.query_point(query))[0]
+        prediction = point_terms @ self.coefficients
+        leverage = point_terms @ self.inverse @ point_terms
+        standard_error = np.sqrt(self.residual_variance * leverage)
+
+        if self.degrees_of_freedom > 0:
+            t_value = t_quantile(0.975, self.degrees_of_freedom)
+        else:
+            t_value = np.nan
+        interval = t_value * np.sqrt(self.residual_variance * (1 + leverage))
+
+        outside = self.outside_ranges(query)
+        return pd.DataFrame({"Output": self.outputs,
+                             "Prediction": prediction,
+                             "Standard Error": standard_error,
+                             "Lower 95%": prediction - interval,
+                             "Upper 95%": prediction + interval,
+                             "Outside Trained Region": len(outside) > 0})
+
+    # Predicts the results for a query, but if the query is outside the 
+    # trained ranges a real trial is run instead, the ranges are widened to
+    # include it and it is added to the training data. Returns the 
+    # predictions and whether a trial was run.
+
+    def predict_or_simulate(self, query, workers, output_folder):
+        outside = self.outside_ranges(query)
+        if len(outside) == 0:
+            return self.predict(query), False
+
+        point = self.query_point(query)
+        for value, name in zip(point, self.settings):
+            low, high = self.ranges[name]
+            self.ranges[name] = (min(low, value), max(high, value))
+        df_results = self.run_points(point[np.newaxis, :], workers, 
+                                     output_folder)
+
+        predictions = self.predict(query)
+        predictions["Simulated"] = df_results[self.outputs].to_numpy(
+            float)[0]
+        return predictions, True
+
+    # The metamodel is saved as its settings and training data, it is fitted
+    # again when it is loaded.
+
+    def save(self, path):
+        with open(path, "w") as metamodel_file:
+            json.dump({"ranges": self.ranges, 
+                       "base_settings": self.base_settings,
+                       "degree": self.degree, "outputs": self.outputs,
+                       "design": self.design.tolist(),
+                       "results": self.results.tolist()}, 
+                      metamodel_file, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as metamodel_file:
+            data = json.load(metamodel_file)
+        metamodel = cls(data["ranges"], data["base_settings"], 
+                        data["degree"], data["outputs"])
+        if data["design"]:
+            metamodel.add_results(np.array(data["design"]), 
+                                  np.array(data["results"]))
+        return metamodel
+
+# Search for the smallest number of ward beds that meets targets for the
+# trial results, eg a mean ward queue time under 24 hours. Each number of beds
+# in a range is a candidate, for each of the SDEC and CTP open percentages
+# given. Every candidate gets a few runs, then the runs are shared out in 
+# rounds to the candidates that haven't been decided (an optimal computing 
+# budget allocation): a candidate is feasible once the confidence interval of
+# every target result is below its target and infeasible once one is above
+# it. Candidates near a target need the most runs to be decided, so each is 
+# given runs in proportion to the number of runs it needs for its intervals 
+# to clear the targets.
+#
+# Adding beds can only shorten the queues, so once a number of beds is 
+# feasible the candidates with more beds (and the same SDEC and CTP) are
+# dropped, and once a number of beds is infeasible the candidates with fewer
+# beds are dropped. Run k of every candidate sees the same patients (common 
+# random numbers), which keeps the results in order of the number of beds.
+# The runs of each round are carried out side by side by the workers.
+
+class BedSearch:
+
+    # The targets are given as {result column: highest value allowed}, using
+    # the columns of the trial results (eg "Mean Q Time Ward (Hour)"). Beds 
+    # is the (lowest, highest) number of beds to search. A candidate that 
+    # hasn't been decided after the maximum number of runs is decided by its
+    # means.
+
+    def __init__(self, targets, beds, base_settings=None, 
+                 sdec_open_percents=None, ctp_open_percents=None, 
+                 initial_runs=5, max_runs=50, confidence=0.95):
+        self.targets = dict(targets)
+        for column in self.targets:
+            if column not in Trial(ScenarioConfig.from_g()).df_trial_results:
+                raise ValueError(f"Unknown result '{column}' in targets")
+        self.initial_runs = max(2, initial_runs)
+        self.max_runs = max(self.initial_runs, max_runs)
+        self.confidence = confidence
+
+        # Graphs and CSV files aren't made for the search's runs. A shared 
+        # master seed is made if one isn't set.
+
+        base_config = ScenarioConfig.from_g().with_settings(
+            **(base_settings or {}))
+        base_config = base_config.with_settings(gen_graph=False, 
+                                                write_to_csv=False,
+                                                target_half_width=None)
+        if base_config.master_seed is None:
+            base_config = base_config.with_settings(
+                master_seed=common_master_seed())
+        self.master_seed = base_config.master_seed
+
+        self.candidates = []
+        for sdec_open_percent, ctp_open_percent in itertools.product(
+            sdec_open_percents or [base_config.sdec_open_percent],
+            ctp_open_percents or [base_config.ctp_open_percent]):
+            for number_of_beds in range(beds[0], beds[1] + 1):
+                settings = {"number_of_ward_beds": number_of_beds,
+                            "trials_run_counter": len(self.candidates) + 1}
+                if sdec_open_percent is not None:
+                    settings["sdec_open_percent"] = sdec_open_percent
+                if ctp_open_percent is not None:
+                    settings["ctp_open_percent"] = ctp_open_percent
+                self.candidates.append({
+                    "group": (sdec_open_percent, ctp_open_percent),
+                    "beds": number_of_beds,
+                    "trial": Trial(base_config.with_settings(**settings)),
+                    "status": "Undecided"})
+
+    # Returns the mean and the half width of the confidence interval of each
+    # target result of a candidate, from the trial's running statistics.
+
+    def intervals(self, candidate):
+        return candidate["trial"].confidence_intervals(self.confidence, 
+                                                       self.targets)
+
+    # Decides the candidates whose intervals have cleared the targets, or 
+    # that have had the maximum number of runs, then drops the candidates 
+    # that can't be the smallest feasible number of beds.
+
+    def update_status(self):
+        for candidate in self.candidates:
+            if candidate["status"] != "Undecided":
+                continue
+            intervals = self.intervals(candidate)
+            if all(mean + half_width < self.targets[column] for column, 
+                   (mean, half_width) in intervals.items()):
+                candidate["status"] = "Feasible"
+            elif any(mean - half_width > self.targets[column] for column,
+                     (mean, half_width) in intervals.items()):
+                candidate["status"] = "Infeasible"
+            elif candidate["trial"].runs_used >= self.max_runs:
+                if all(mean <= self.targets[column] for column, 
+                       (mean, _) in intervals.items()):
+                    candidate["status"] = "Feasible (by mean)"
+                else:
+                    candidate["status"] = "Infeasible (by mean)"
+
+        for group in self.groups():
+            feasible_beds = [candidate["beds"] for candidate in group 
+                             if candidate["status"].startswith("Feasible")]
+            infeasible_beds = [candidate["beds"] for candidate in group 
+                               if candidate["status"].startswith("Infeasible")]
+            for candidate in group:
+                if candidate["status"] != "Undecided":
+                    continue
+                if len(feasible_beds) > 0 and \
+                    candidate["beds"] > min(feasible_beds):
+                    candidate["status"] = "Dropped (more beds than feasible)"
+                elif len(infeasible_beds) > 0 and \
+                    candidate["beds"] < max(infeasible_beds):
+                    candidate["status"] = \
+                        "Dropped (fewer beds than infeasible)"
+
+    # The candidates with each SDEC and CTP open percentage.
+
+    def groups(self):
+        groups = {}
+        for candidate in self.candidates:
+            groups.setdefault(candidate["group"], []).append(candidate)
+        return list(groups.values())
+
+    # Estimates the number of runs a candidate needs to be decided. For each
+    # target the interval has to shrink until it doesn't include the target.
+    # The half width shrinks with the square root of the number of runs (the
+    # t value is kept the same). A candidate is infeasible as soon as one 
+    # result is above its target, otherwise every result has to be below its
+    # target.
+
+    def runs_needed(self, candidate):
+        number_of_runs = candidate["trial"].runs_used
+        above = []
+        below = []
+        for column, (mean, half_width) in self.intervals(candidate).items():
+            gap = abs(mean - self.targets[column])
+            if gap > 0:
+                needed = number_of_runs * (half_width / gap) ** 2
+            else:
+                needed = math.inf
+            if mean > self.targets[column]:
+                above.append(needed)
+            else:
+                below.append(needed)
+        needed = min(above) if len(above) > 0 else max(below)
+        return min(needed, self.max_runs) - number_of_runs
+
+    # Shares a number of runs between the undecided candidates in proportion
+    # to the runs each needs, with the runs left over from rounding down 
+    # going to the largest remainders. Returns {candidate number: runs}.
+
+    def allocate(self, budget):
+        undecided = [number for number, candidate in 
+                     enumerate(self.candidates) 
+                     if candidate["status"] == "Undecided"]
+        if len(undecided) == 0:
+            return {}
+        room = {number: self.max_runs - 
+                self.candidates[number]["trial"].runs_used 
+                for number in undecided}
+        weights = {number: min(max(1, self.runs_needed(
+            self.candidates[number])), room[number]) for number in undecided}
+        total_weight = sum(weights.values())
+        budget = min(budget, sum(room.values()))
+
+        shares = {number: budget * weight / total_weight 
+                  for number, weight in weights.items()}
+        allocation = {number: min(int(share), room[number]) 
+                      for number, share in shares.items()}
+        for number in sorted(undecided, key=lambda number: 
+                             allocation[number] - shares[number]):
+            if sum(allocation.values()) >= budget:
+                break
+            if allocation[number] < room[number]:
+                allocation[number] += 1
+        return {number: runs for number, runs in allocation.items() 
+                if runs > 0}
+
+    # Carries out the runs of a round, {candidate number: runs}, in the pool
+    # of processes if one is given.
+
+    def run_round(self, allocation, executor=None):
+        tasks = []
+        for number, extra_runs in allocation.items():
+            trial = self.candidates[number]["trial"]
+            runs = range(trial.runs_used, trial.runs_used + extra_runs)
+            seeds = run_seeds(self.master_seed, runs.stop)
+            tasks.extend((trial, run, seeds[run]) for run in runs)
+
+        if executor is not None:
+            futures = [executor.submit(run_replication, run, seed, 
+                                       trial.config, True)
+                       for trial, run, seed in tasks]
+            outputs = [future.result() for future in futures]
+        else:
+            outputs = [run_replication(run, seed, trial.config) 
+                       for trial, run, seed in tasks]
+
+        for (trial, run, _), (results, *_) in zip(tasks, outputs):
+            trial.add_run_results(run, results)
+
+    # Carries out the search. Each round has as many runs as there are 
+    # workers, or undecided candidates if there are more of them. The 
+    # results of every candidate are written to bed_search.csv and the 
+    # smallest feasible number of beds for each SDEC and CTP open percentage
+    # is written to bed_search_minimum.csv, and returned.
+
+    def run(self, workers=1, output_folder="."):
+        os.makedirs(output_folder, exist_ok=True)
+        executor = None
+        if workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers)
+
+        try:
+            allocation = {number: self.initial_runs 
+                          for number in range(len(self.candidates))}
+            round_number = 0
+            while len(allocation) > 0:
+                round_number += 1
+                self.run_round(allocation, executor)
+                self.update_status()
+                undecided = sum(candidate["status"] == "Undecided" 
+                                for candidate in self.candidates)
+                print(f"Round {round_number}: {sum(allocation.values())} "
+                      f"runs, {undecided} candidates undecided")
+                allocation = self.allocate(max(workers, undecided))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        df_candidates = self.results_frame()
+        df_candidates.to_csv(os.path.join(output_folder, "bed_search.csv"),
+                             index=False)
+        df_minimum = self.minimum_beds()
+        df_minimum.to_csv(os.path.join(output_folder, 
+                                       "bed_search_minimum.csv"), index=False)
+        print(df_minimum.to_string(index=False))
+        return df_minimum
+
+    def results_frame(self):
+        rows = []
+        for candidate in self.candidates:
+            row = {"Number of Ward Beds": candidate["beds"],
+                   "SDEC Open %": candidate["group"][0],
+                   "CTP Open %": candidate["group"][1],
+                   "Number of Runs": candidate["trial"].runs_used}
+            for column, (mean, half_width) in \
+                self.intervals(candidate).items():
+                row[column] = mean
+                row[f"{column} CI Half Width"] = half_width
+            row["Status"] = candidate["status"]
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    # The smallest feasible number of beds for each SDEC and CTP open 
+    # percentage, None if no number of beds in the range is feasible.
+
+    def minimum_beds(self):
+        rows = []
+        for group in self.groups():
+            feasible_beds = [candidate["beds"] for candidate in group
+                             if candidate["status"].startswith("Feasible")]
+            rows.append({"SDEC Open %": group[0]["group"][0],
+                         "CTP Open %": group[0]["group"][1],
+                         "Minimum Ward Beds": min(feasible_beds) 
+                         if len(feasible_beds) > 0 else None,
+                         "Total Runs": sum(candidate["trial"].runs_used 
+                                           for candidate in group)})
+        return pd.DataFrame(rows)
+
+# The code below only runs when this file is run directly, so the classes
+# above can be used by worker processes without asking the user for input.
+# Giving a scenario file runs the model without any input, otherwise the user
+# is asked for the settings of each trial.
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Stroke assessment discrete event simulation")
+    parser.add_argument("--scenarios", 
+                        help="JSON scenario file to run without user input")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes for the scenarios")
+    parser.add_argument("--output", default=".",
+                        help="folder the scenario results are written to")
+    parser.add_argument("--train-metamodel", 
+                        help="JSON metamodel file to train, the metamodel is"
+                        " saved to metamodel.json in the output folder")
+    parser.add_argument("--metamodel", 
+                        help="trained metamodel to answer a query with")
+    parser.add_argument("--query", nargs="*", default=[],
+                        help="settings of the query, eg "
+                        "number_of_ward_beds=4 sdec_open_percent=70")
+    parser.add_argument("--search-beds", 
+                        help="JSON file of the targets and the range of beds"
+                        " to search for the smallest number of ward beds")
+    parser.add_argument("--validate-fast-engine", type=int, metavar="RUNS",
+                        help="check the fast engine against the model over "
+                        "this number of runs")
+    parser.add_argument("--convert-trace", nargs=2, 
+                        metavar=("CSV", "FOLDER"),
+                        help="convert an arrival log CSV file into a trace "
+                        "folder that can be replayed with arrival_trace")
+    parser.add_argument("--simulate", action="store_true",
+                        help="run a trial if the query is outside the "
+                        "trained region")
+    args = parser.parse_args()
+
+    if args.validate_fast_engine is not None:
+        validate_fast_engine(number_of_runs=args.validate_fast_engine)
+
+    elif args.convert_trace is not None:
+        trace = ArrivalTrace.convert(*args.convert_trace)
+        print(f"Converted {trace.info['rows']} patients over "
+              f"{trace.number_of_days} days to {trace.folder}")
+
+    elif args.train_metamodel is not None:
+
+        # A metamodel file gives the ranges of the settings, the settings 
+        # used for every trial, and the number of points in the first batch 
+        # and in each batch after it.
+
+        with open(args.train_metamodel) as spec_file:
+            spec = json.load(spec_file)
+        metamodel = Metamodel(spec["ranges"], spec.get("settings"),
+                              spec.get("degree", 2), spec.get("outputs"))
+        metamodel.train(spec.get("initial_points", 20), 
+                        spec.get("batch_points", args.workers),
+                        spec.get("batches", 1), args.workers, args.output,
+                        spec.get("seed"))
+        metamodel.save(os.path.join(args.output, "metamodel.json"))
+
+    # A bed search file gives the targets, the range of beds and optionally
+    # the SDEC and CTP open percentages to search, and the settings used for 
+    # every run.
+
+    elif args.search_beds is not None:
+        with open(args.search_beds) as spec_file:
+            spec = json.load(spec_file)
+        BedSearch(spec["targets"], spec["beds"], spec.get("settings"),
+                  spec.get("sdec_open_percents"), 
+                  spec.get("ctp_open_percents"), 
+                  spec.get("initial_runs", 5), spec.get("max_runs", 50),
+                  spec.get("confidence", 0.95)).run(args.workers, args.output)
+
+    elif args.metamodel is not None:
+        metamodel = Metamodel.load(args.metamodel)
+        query = {name: json.loads(value) for name, value in 
+                 (setting.split("=", 1) for setting in args.query)}
+        if args.simulate == True:
+            predictions, simulated = metamodel.predict_or_simulate(
+                query, args.workers, args.output)
+            if simulated == True:
+                metamodel.save(args.metamodel)
+        else:
+            predictions = metamodel.predict(query)
+        print(predictions.to_string(index=False))
+        outside = metamodel.outside_ranges(query)
+        if len(outside) > 0:
+            print(f"Outside the trained region: {', '.join(outside)}")
+
+    elif args.scenarios is not None:
+        run_scenarios(load_scenarios(args.scenarios), args.workers, 
+                      args.output)
+    else:
+        run_interactive()
@@ -0,0 +1,224 @@
+import argparse
+import concurrent.futures
+import contextlib
+import importlib.util
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# This script measures how fast the model runs and how much memory it uses
+# across a matrix of settings: the number of ward beds, how many times faster
+# patients arrive than the default, the percentage of the day the SDEC and CTP
+# are open and the length of the run. Each case records the wall time, the
+# number of SimPy events per second, the peak memory (RSS) of the process and
+# the time taken per patient. The results are written to a JSON file with the
+# commit they were measured on, so the results of two commits can be compared
+# with --compare.
+#
+# Each case is run in a new process, one at a time, so the peak memory of one
+# case doesn't carry over into the next and the cases don't slow each other
+# down.
+
+model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                          "Stroke Admission Model.py")
+spec = importlib.util.spec_from_file_location("stroke_admission_model",
+                                              model_path)
+model = importlib.util.module_from_spec(spec)
+
+# The model is added to the loaded modules so the worker processes of a trial
+# can find the functions they are sent.
+
+sys.modules[spec.name] = model
+spec.loader.exec_module(model)
+
+# The values of each setting in the matrix. The quick matrix is a smaller
+# version that finishes in a few minutes, the full matrix takes much longer.
+# Horizons are in days, the warm up period is a fifth of the horizon as in the
+# g class.
+
+full_matrix = {"number_of_ward_beds": [1, 5, 10, 25, 50],
+               "arrival_multiplier": [1, 5, 10, 20],
+               "open_percent": [0, 50, 100],
+               "horizon_days": [30, 365, 1825]}
+
+quick_matrix = {"number_of_ward_beds": [1, 10, 50],
+                "arrival_multiplier": [1, 20],
+                "open_percent": [0, 100],
+                "horizon_days": [30, 365]}
+
+# Trials are timed for a few settings, with the runs carried out one after
+# another and shared between worker processes.
+
+trial_cases = [{"number_of_ward_beds": beds, "number_of_runs": 4,
+                "number_of_workers": workers, "horizon_days": 365}
+               for beds in [10, 50] for workers in [1, 4]]
+
+# Makes the config for a case from the default settings in the g class.
+
+def case_config(case):
+    base_config = model.ScenarioConfig.from_g()
+    sim_duration = 1440 * case["horizon_days"]
+    multiplier = case.get("arrival_multiplier", 1)
+    open_percent = case.get("open_percent", base_config.sdec_open_percent)
+    return base_config.with_settings(
+        sim_duration=sim_duration,
+        warm_up_period=sim_duration / 5,
+        number_of_ward_beds=case["number_of_ward_beds"],
+        patient_inter_day=base_config.patient_inter_day / multiplier,
+        patient_inter_night=base_config.patient_inter_night / multiplier,
+        sdec_open_percent=open_percent,
+        ctp_open_percent=open_percent,
+        number_of_runs=case.get("number_of_runs", 1),
+        number_of_workers=case.get("number_of_workers", 1),
+        master_seed=1, write_to_csv=False, gen_graph=False,
+        result_cache_folder=None)
+
+# The peak RSS of this process in MB. Linux gives the value in KB and macOS in
+# bytes. The resource module isn't available on Windows.
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / 1024 ** 2
+    return peak / 1024
+
+# Runs a single model run for a case. SimPy gives every event it schedules an
+# ID from a counter, so the next ID is the number of events in the run.
+
+def run_model_case(case):
+    config = case_config(case)
+    start_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    my_model = model.Model(0, config, seed=1)
+    my_model.run()
+    wall_time = time.perf_counter() - start
+
+    events = next(my_model.env._eid)
+    patients = my_model.patient_counter
+    return {"wall_time": wall_time,
+            "events": events,
+            "events_per_second": events / wall_time,
+            "patients": patients,
+            "seconds_per_patient": wall_time / patients if patients else None,
+            "start_rss_mb": start_rss,
+            "peak_rss_mb": peak_rss_mb()}
+
+# Runs a trial for a case, the printout of the trial is hidden. The peak RSS
+# only includes this process, not the worker processes.
+
+def run_trial_case(case):
+    config = case_config(case)
+    start_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    trial = model.Trial(config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        trial.run_trial()
+    wall_time = time.perf_counter() - start
+
+    return {"wall_time": wall_time,
+            "runs_per_second": trial.runs_used / wall_time,
+            "start_rss_mb": start_rss,
+            "peak_rss_mb": peak_rss_mb()}
+
+# The commit the benchmark was run on, and if there were changes that weren't
+# committed.
+
+def git_commit():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=folder,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain"],
+                                cwd=folder, capture_output=True, text=True,
+                                check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, status.strip() != ""
+
+def case_name(case):
+    return ", ".join(f"{name}={value}" for name, value in case.items())
+
+# Prints the wall time and peak RSS of each case against the same case in an
+# earlier results file. A ratio above 1 means the case is slower (or uses
+# more memory) than before.
+
+def compare(results, old_results):
+    old_cases = {(case["kind"], case_name(case["settings"])): case
+                 for case in old_results["cases"]}
+    print(f"Compared to commit {old_results['commit']}")
+    print(f"{'Time Ratio':>10} {'RSS Ratio':>10}  Case")
+    for case in results["cases"]:
+        old_case = old_cases.get((case["kind"], case_name(case["settings"])))
+        if old_case is None:
+            continue
+        time_ratio = case["wall_time"] / old_case["wall_time"]
+        if case["peak_rss_mb"] and old_case["peak_rss_mb"]:
+            rss_ratio = f"{case['peak_rss_mb'] / old_case['peak_rss_mb']:.2f}"
+        else:
+            rss_ratio = "-"
+        print(f"{time_ratio:>10.2f} {rss_ratio:>10}  {case['kind']}: "
+              f"{case_name(case['settings'])}")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Throughput and memory benchmark of the stroke model")
+    parser.add_argument("--quick", action="store_true",
+                        help="run the smaller matrix")
+    parser.add_argument("--no-trials", action="store_true",
+                        help="only time single model runs")
+    parser.add_argument("--output", default="throughput.json",
+                        help="JSON file the results are written to")
+    parser.add_argument("--compare",
+                        help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    matrix = quick_matrix if args.quick == True else full_matrix
+    cases = [("model", dict(zip(matrix, values)))
+             for values in itertools.product(*matrix.values())]
+    if args.no_trials == False:
+        cases += [("trial", case) for case in trial_cases]
+
+    commit, uncommitted_changes = git_commit()
+    results = {"commit": commit,
+               "uncommitted_changes": uncommitted_changes,
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "processor_count": os.cpu_count(),
+               "cases": []}
+
+    # A new process is used for every case. A new pool is made for each case
+    # rather than using max_tasks_per_child, as that starts the process with
+    # "spawn" and the trial's own worker processes would then be spawned too.
+
+    for kind, case in cases:
+        run_case = run_model_case if kind == "model" else run_trial_case
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            measurements = executor.submit(run_case, case).result()
+        results["cases"].append({"kind": kind, "settings": case,
+                                 **measurements})
+        print(f"{measurements['wall_time']:>8.2f}s "
+              f"{measurements['peak_rss_mb'] or 0:>8.0f}MB  {kind}: "
+              f"{case_name(case)}", flush=True)
+
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as old_file:
+            compare(results, json.load(old_file))
@@ -0,0 +1,56 @@
+import importlib.util
+import os
+import time
+
+# This script compares the number of SimPy events used when patients held in
+# the SDEC check the ward every minute for a free bed (the old method) against
+# waiting for a ward bed to be released (the new method). Each run is given
+# the same seed so both methods see the same patients.
+
+# The model file has spaces in its name, so it is loaded from its path rather
+# than imported.
+
+model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                          "Stroke Admission Model.py")
+spec = importlib.util.spec_from_file_location("stroke_admission_model",
+                                              model_path)
+model = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(model)
+
+g = model.g
+
+# A shorter run than the default year is used so the script finishes quickly,
+# the SDEC and CTP are both open half of the day.
+
+g.sim_duration = 1440 * 90
+g.warm_up_period = g.sim_duration / 5
+g.sdec_unav_freq = 720
+g.sdec_unav_time = 720
+g.ctp_unav_freq = 720
+g.ctp_unav_time = 720
+
+base_config = model.ScenarioConfig.from_g()
+seed = 1
+
+print(f"{'Ward Beds':>10} {'Method':>8} {'Events':>10} {'Seconds':>8} "
+      f"{'Held in SDEC':>13}")
+
+for beds in [1, 2, 3, 5]:
+    for polling in [True, False]:
+        config = base_config.with_settings(number_of_ward_beds=beds,
+                                           ward_bed_polling=polling)
+
+        start = time.perf_counter()
+        my_model = model.Model(0, config, seed)
+        my_model.run()
+        seconds = time.perf_counter() - start
+
+        # SimPy gives every event it schedules an ID from a counter, so the
+        # next ID is the number of events scheduled during the run.
+
+        events = next(my_model.env._eid)
+        held = (my_model.results_df["SDEC Yield Count"] > 0).sum()
+        method = "Polling" if polling == True else "Event"
+
+        print(f"{beds:>10} {method:>8} {events:>10} {seconds:>8.2f} "
+              f"{held:>13}")